@@ -0,0 +1,12 @@
+"""
+    Fixtures shared by the unitary tests
+"""
+import pytest
+import shopstats
+
+
+@pytest.fixture(autouse=True)
+def api_params(monkeypatch):
+    """ points shopstats to an unreachable API instead of reading the
+        bitphyaccess.json of the developer """
+    monkeypatch.setattr(shopstats, 'api_params', { 'url_base': 'http://localhost:1', 'headers': {} })
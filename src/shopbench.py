@@ -0,0 +1,512 @@
+#! /usr/bin/env python3
+"""
+    This script benchmarks some stages of shopstats on synthetic data
+    without calling the API
+"""
+
+import shopspecs
+import shopstats
+import shopstore
+import pandas as pd
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+@contextlib.contextmanager
+def patched(module, **attributes):
+    """ temporarily replaces the given attributes of the module """
+    originals = { name: getattr(module, name) for name in attributes }
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(module, name, value)
+
+
+def synthetic_shops(nshops, nchains=10):
+    """ returns a list of nshops shops as returned by shopstats.get_shops() """
+    return [ ('chain_%s' % (i % nchains), 'shop_%s' % i, 'shopname_%s' % i)
+             for i in range(nshops) ]
+
+
+def timeit(function, *args, **kwargs):
+    """ returns the seconds spent by the call to function """
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def synthetic_raw_entries(nentries, distinct_ratio=0.5, malformed_ratio=0.01, seed=0):
+    """ returns a list of nentries entries of a raw nodepoint """
+    rng = random.Random(seed)
+    ndistinct = max(int(nentries * distinct_ratio), 1)
+    return [ { 'id': 'malformed' } if rng.random() < malformed_ratio
+             else { 'originalId': 'oid%s' % rng.randrange(ndistinct), 'name': 'name' }
+             for _ in range(nentries) ]
+
+
+def synthetic_aggregated_entries(nentries, subentries=5, malformed_ratio=0.01, seed=0, subkey='sales'):
+    """ returns a list of entries of an aggregation nodepoint with the
+        subkey, containing nentries subentries in total. Without subkey,
+        a list of nentries entries """
+    rng = random.Random(seed)
+    lines = [ { 'nobilling': 0 } if rng.random() < malformed_ratio else { 'billing': round(rng.uniform(-10, 500), 2) }
+              for _ in range(nentries) ]
+    if not subkey:
+        return lines
+    return [ { subkey: lines[start:start + subentries] } for start in range(0, nentries, subentries) ]
+
+
+# Reference processors of the entries: they interpret the spec of the
+# flat keys for each entry. They're the baseline of the compiled specs
+# (see shopspecs), and their results must be the same
+
+
+def compute_raw_entries(nodepoint_spec, entries, malformed_sample=None):
+    """ Computes the counters of a given raw nodepoint entries
+        returns counters as a tuple
+        - number of items in the nodepoint
+        - number of distinct items
+        - number of malformed items. i.e. those not containing the identity key
+
+        :param malformed_sample: shopmalformed.MalformedSample where the
+                                 malformed entries are added
+    """
+    nodepoint_equality_key = nodepoint_spec['equality_key']
+    identity_values = [ entry[nodepoint_equality_key] for entry in entries if nodepoint_equality_key in entry ]
+    counter = len(identity_values)
+    distinct = len(set(identity_values))
+    malformed = len(entries) - len(identity_values)
+    if malformed and malformed_sample is not None:
+        malformed_sample.update((entry for entry in entries if nodepoint_equality_key not in entry), nodepoint_equality_key)
+    return counter, distinct, malformed
+
+
+def compute_aggregated_entries(nodepoint_spec, entries, malformed_sample=None):
+    """ Computes the counters of a given aggregated nodepoint entries
+        returns counters as a tuple
+        - number of items in the nodepoint
+        - the aggregated value of the entries as defined by the nodepoint_specs
+        - number of malformed items. i.e. those not containing the identity key
+
+        :param malformed_sample: shopmalformed.MalformedSample where the
+                                 malformed entries are added
+    """
+    counter = 0
+    aggregation = 0
+    malformed = 0
+    if nodepoint_spec['subkey']:
+        # getting actual subentries
+        subentries = []
+        for entry in entries:
+            if nodepoint_spec['subkey'] not in entry:
+                malformed += 1
+                if malformed_sample is not None:
+                    malformed_sample.add(entry, nodepoint_spec['subkey'])
+                continue
+            subentries += entry[nodepoint_spec['subkey']]
+    else:
+        subentries = entries
+
+    # aggregating subentries
+    for entry in subentries:
+        if nodepoint_spec['aggregation_key'] not in entry:
+            malformed += 1
+            if malformed_sample is not None:
+                malformed_sample.add(entry, nodepoint_spec['aggregation_key'])
+            continue
+        aggregation += entry[nodepoint_spec['aggregation_key']]
+        counter += 1
+
+    return counter, aggregation, malformed
+
+
+entries_processors = {
+        'raw': compute_raw_entries,
+        'aggregation': compute_aggregated_entries,
+        }
+
+
+def bench_entries_processors(nentries=1000000):
+    """ times the entries_processors and the compiled specs (see
+        shopspecs) on nentries synthetic entries
+        returns a list of (nodepoint type, seconds, compiled seconds) """
+    specs = {
+            'raw': { 'name': 'bench', 'type': 'raw', 'equality_key': 'originalId', 'column_suffix': 'distinct' },
+            'aggregation': { 'name': 'bench', 'type': 'aggregation', 'aggregation_key': 'billing', 'subkey': 'sales', 'column_suffix': 'billing' },
+            }
+    entries = {
+            'raw': synthetic_raw_entries(nentries),
+            'aggregation': synthetic_aggregated_entries(nentries),
+            }
+    results = []
+    logging.disable(logging.WARNING)    # one warning per malformed entry
+    try:
+        for nodepoint_type, spec in specs.items():
+            counters = {}
+            seconds = {}
+            compiled = shopspecs.compile_spec(spec)
+            for name, processor in (('plain', entries_processors[nodepoint_type]),
+                                    ('compiled', lambda spec, entries: compiled.process(entries))):
+                start = time.perf_counter()
+                counters[name] = processor(spec, entries[nodepoint_type])
+                seconds[name] = time.perf_counter() - start
+            assert counters['plain'] == counters['compiled'], counters
+            results.append((nodepoint_type, seconds['plain'], seconds['compiled']))
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+def print_entries_processors(results, nentries):
+    print('Entries processors (%s entries)' % nentries)
+    print('%12s %12s %12s %16s' % ('type', 'seconds', 'compiled', 'ns/entry (comp)'))
+    for nodepoint_type, seconds, compiled_seconds in results:
+        print('%12s %12.4f %12.4f %16.0f' % (nodepoint_type, seconds, compiled_seconds, compiled_seconds / nentries * 1e9))
+
+
+# modules only required to render the charts
+plotting_modules = ('matplotlib', 'matplotlib.pyplot', 'seaborn')
+
+
+def bench_import_time(statement='import shopstats', repeat=3):
+    """ times the import statement in new python processes
+        returns a dict with
+        - seconds: the best time of the repetitions
+        - plotting_modules: plotting_modules loaded by the statement
+        - querystring: shopstats.querystring after the statement
+        - nodepoint_specs: shopstats.nodepoint_specs after the statement
+    """
+    code = '\n'.join([
+        'import json, sys, time',
+        'start = time.perf_counter()',
+        statement,
+        'seconds = time.perf_counter() - start',
+        'import shopstats',
+        'print(json.dumps({ "seconds": seconds, "querystring": shopstats.querystring,',
+        '                   "nodepoint_specs": shopstats.nodepoint_specs,',
+        '                   "plotting_modules": [ m for m in %r if m in sys.modules ] }))' % (plotting_modules,),
+        ])
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([ sys.executable, '-c', code ], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        results.append(json.loads(output))
+    return dict(min(results, key=lambda result: result['seconds']))
+
+
+def print_import_time():
+    print('Import time')
+    for statement in ('import shopstats', 'import shopstats, matplotlib.pyplot, seaborn'):
+        result = bench_import_time(statement)
+        print('%48s %8.4f s' % (statement, result['seconds']))
+
+
+def synthetic_stats(nshops, nperiods=1, seed=0):
+    """ returns a combined stats DataFrame (see shopstats.combine_periods())
+        of nshops for nperiods with the default nodepoint_specs """
+    rng = random.Random(seed)
+    columns = [ 'period', 'chain_id', 'shop_id', 'shop_name' ]
+    for nodepoint_spec in shopstats.get_nodepoint_specs():
+        columns += shopstats.compose_nodepoint_column(nodepoint_spec)
+    rows = []
+    for period in range(nperiods):
+        for chain_id, shop_id, shop_name in synthetic_shops(nshops):
+            counters = [ rng.uniform(0, 10000) if column.endswith('_billing') else rng.randrange(1000)
+                         for column in columns[4:] ]
+            rows.append([ '2019%02d' % (period % 12 + 1), chain_id, shop_id, shop_name ] + counters)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def bench_stats_loading(nshops=5000, nperiods=24, formats=None):
+    """ saves synthetic stats of nshops x nperiods in each format and
+        times their loading by shopcharts.load_shopstats() in new processes
+        returns a list of (format, file MB, seconds, RSS MB) where RSS is
+        the growth of the resident memory of the process (linux only) """
+    formats = formats or ([ 'csv', 'feather', 'parquet' ] if shopstats.columnar_formats_available() else [ 'csv' ])
+    df = synthetic_stats(nshops, nperiods)
+    code = '\n'.join([
+        'import os, sys, time',
+        'import shopcharts',
+        'import shopstats',
+        'if shopstats.columnar_formats_available():',
+        '    import pyarrow.feather, pyarrow.parquet',
+        'def rss():',
+        '    with open("/proc/self/statm") as f:',
+        '        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")',
+        'initial_rss = rss()',
+        'start = time.perf_counter()',
+        'df = shopcharts.load_shopstats(sys.argv[1])',
+        'print(time.perf_counter() - start, (rss() - initial_rss) / 1024 ** 2)',
+        ])
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for stats_format in formats:
+            filename = os.path.join(directory, 'stats.%s' % stats_format)
+            shopstats.write_stats(df, filename, stats_format, index=False)
+            output = subprocess.run([ sys.executable, '-c', code, filename ], check=True, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            seconds, rss = map(float, output.split())
+            results.append((stats_format, os.path.getsize(filename) / 1024 ** 2, seconds, rss))
+    return results
+
+
+def print_stats_loading(results, nshops, nperiods):
+    print('Stats loading (%s shops x %s periods)' % (nshops, nperiods))
+    print('%12s %12s %12s %12s' % ('format', 'MB', 'seconds', 'RSS MB'))
+    for stats_format, size, seconds, rss in results:
+        print('%12s %12.1f %12.4f %12.0f' % (stats_format, size, seconds, rss))
+
+
+def bench_store_queries(nshops=5000, nperiods=24, repeat=20):
+    """ appends synthetic stats of nshops x nperiods to a shopstore and
+        times its queries
+        returns a list of (operation, seconds) where the seconds of the
+        queries are the mean of repeat random shops """
+    rng = random.Random(0)
+    df = synthetic_stats(nshops, nperiods)
+    shops = synthetic_shops(nshops)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        store = shopstore.StatsStore(os.path.join(directory, 'store.db'))
+        start = time.perf_counter()
+        for period, period_df in df.groupby('period'):
+            store.append(period, period_df.drop(columns='period'))
+        results.append(('append', time.perf_counter() - start))
+        queries = {
+                'shop_series': lambda chain_id, shop_id: store.shop_series(chain_id, shop_id, [ 'products_malformed' ]),
+                'nodepoint_series': lambda chain_id, shop_id: store.nodepoint_series('products', chain_id, shop_id),
+                }
+        for name, query in queries.items():
+            seconds = 0
+            for _ in range(repeat):
+                chain_id, shop_id, _ = rng.choice(shops)
+                seconds += timeit(query, chain_id, shop_id)
+            results.append((name, seconds / repeat))
+        store.close()
+    return results
+
+
+def print_store_queries(results, nshops, nperiods):
+    print('Historical store (%s shops x %s periods)' % (nshops, nperiods))
+    print('%18s %12s' % ('operation', 'seconds'))
+    for operation, seconds in results:
+        print('%18s %12.4f' % (operation, seconds))
+
+
+def synthetic_payloads(nlines, nodepoint_specs=None, malformed_ratio=0.01, distinct_ratio=0.8, seed=0):
+    """ returns a dict endpoint -> JSON payload of a shop with nlines
+        entries (raw nodepoints) or sales lines (aggregation nodepoints).
+        Some entries are malformed and, in raw nodepoints, some are duplicated.
+        The payload of an endpoint is generated for its first nodepoint """
+    payloads = {}
+    for nodepoint_spec in nodepoint_specs or shopstats.get_nodepoint_specs():
+        endpoint = shopspecs.compile_spec(nodepoint_spec).endpoint
+        if endpoint in payloads:
+            continue
+        if nodepoint_spec['type'] == 'raw':
+            entries = synthetic_raw_entries(nlines, distinct_ratio=distinct_ratio, malformed_ratio=malformed_ratio, seed=seed)
+        else:
+            entries = synthetic_aggregated_entries(nlines, malformed_ratio=malformed_ratio, seed=seed,
+                                                   subkey=nodepoint_spec['subkey'])
+        payloads[endpoint] = json.dumps(entries)
+    return payloads
+
+
+def synthetic_api_contents(nshops, nlines, nodepoint_specs=None):
+    """ returns the contents of test_shopstats.build_mock_url_request()
+        for nshops shops with nlines lines of each nodepoint in total.
+        Every shop serves the same payloads """
+    shops = synthetic_shops(nshops)
+    chains = {}
+    for chain_id, shop_id, shop_name in shops:
+        chains.setdefault(chain_id, []).append({ 'id': shop_id, 'name': shop_name })
+    contents = { '/user/accessible-resources': json.dumps([ { 'id': chain_id, 'shops': chain_shops }
+                                                           for chain_id, chain_shops in chains.items() ]) }
+    payloads = synthetic_payloads(max(nlines // nshops, 1), nodepoint_specs)
+    # the longest endings first, so /sales doesn't match /products/sales
+    for name in sorted(payloads, key=len, reverse=True):
+        contents['/%s' % name] = payloads[name]
+    return contents
+
+
+def parse_scenario(text):
+    """ returns the tuple (shops, lines) of a SHOPSxLINES scenario
+
+        >>> parse_scenario('100x1000000')
+        (100, 1000000)
+    """
+    try:
+        nshops, nlines = map(int, text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('scenario must be given as SHOPSxLINES: %s' % text)
+    return nshops, nlines
+
+
+def bench_load(nshops, nlines):
+    """ times the stages of shopstats for nshops with nlines of each
+        nodepoint in total, served by mocked requests
+        returns a dict stage -> seconds with the stages
+        - generate_dataframe
+        - processor_raw, processor_aggregation: processing the payloads of a shop
+        - sort_columns
+        - one for each chart of shopstats.chart_functions
+    """
+    from test_shopstats import build_mock_url_request
+    contents = synthetic_api_contents(nshops, nlines)
+    results = {}
+    logging.disable(logging.WARNING)    # one warning per malformed entry
+    try:
+        with patched(shopstats.requests.Session, request=build_mock_url_request(contents)), \
+                patched(shopstats, api_params={ 'url_base': 'http://bitphy.invalid', 'headers': {} }):
+            start = time.perf_counter()
+            df = shopstats.generate_dataframe(shopstats.get_nodepoint_specs())
+            results['generate_dataframe'] = time.perf_counter() - start
+        for nodepoint_type in shopspecs.SPEC_TYPES:
+            seconds = 0
+            for nodepoint_spec in shopstats.get_nodepoint_specs():
+                if nodepoint_spec['type'] == nodepoint_type:
+                    compiled = shopspecs.compile_spec(nodepoint_spec)
+                    entries = json.loads(contents['/%s' % compiled.endpoint])
+                    seconds += timeit(compiled.process, entries)
+            results['processor_%s' % nodepoint_type] = seconds
+    finally:
+        logging.disable(logging.NOTSET)
+    start = time.perf_counter()
+    df = shopstats.sort_columns(df)
+    results['sort_columns'] = time.perf_counter() - start
+    shopstats.use_non_interactive_backend()
+    shopstats.import_plotting()         # not timed in the first chart
+    with tempfile.TemporaryDirectory() as directory:
+        for chart in shopstats.chart_functions:
+            _, seconds, _, _ = shopstats.render_chart(chart, df, os.path.join(directory, '%s.png' % chart), 'June 2019')
+            results[chart] = seconds
+    return results
+
+
+def bench_load_scenarios(scenarios):
+    """ returns a dict 'SHOPSxLINES' -> bench_load() results """
+    return { '%sx%s' % scenario: bench_load(*scenario) for scenario in scenarios }
+
+
+def find_regressions(results, baseline, tolerance=0.2, min_seconds=0.01):
+    """ compares the bench_load_scenarios() results with a baseline
+        returns a list of (scenario, stage, baseline seconds, seconds) of
+        the stages slower than the baseline by more than tolerance.
+        Stages faster than min_seconds are too noisy to be compared """
+    regressions = []
+    for scenario, stages in results.items():
+        for stage, seconds in stages.items():
+            expected = baseline.get(scenario, {}).get(stage)
+            if expected is None or max(seconds, expected) < min_seconds:
+                continue
+            if seconds > expected * (1 + tolerance):
+                regressions.append((scenario, stage, expected, seconds))
+    return regressions
+
+
+def print_load_scenarios(results, baseline=None):
+    print('Synthetic load (SHOPSxLINES of each nodepoint)')
+    print('%16s %22s %12s %12s' % ('scenario', 'stage', 'seconds', 'baseline'))
+    for scenario, stages in results.items():
+        for stage, seconds in stages.items():
+            expected = (baseline or {}).get(scenario, {}).get(stage)
+            print('%16s %22s %12.4f %12s' % (scenario, stage, seconds, '%.4f' % expected if expected is not None else '-'))
+
+
+def legacy_dataframe_assembly(shops, nodepoint_specs, counters):
+    """ previous assembly of generate_dataframe() results:
+        one boolean mask write per (shop, nodepoint) """
+    columns = [ 'chain_id', 'shop_id', 'shop_name' ]
+    for nodepoint_spec in nodepoint_specs:
+        columns += shopstats.compose_nodepoint_column(nodepoint_spec)
+    df = pd.DataFrame([ { 'chain_id': chain_id, 'shop_id': shop_id, 'shop_name': shop_name }
+                        for chain_id, shop_id, shop_name in shops ], columns=columns)
+    for chain_id, shop_id, _ in shops:
+        for nodepoint_spec in nodepoint_specs:
+            df.loc[df['shop_id'] == shop_id, shopstats.compose_nodepoint_column(nodepoint_spec)] = counters
+    return df
+
+
+def bench_dataframe_assembly(shop_counts=(10, 100, 1000, 10000), legacy_limit=1000):
+    """ times the assembly of the generate_dataframe() results
+        with a constant counters source
+        returns a list of (nshops, seconds, legacy seconds or None) """
+    counters = (3, 2, 1)
+    results = []
+    for nshops in shop_counts:
+        shops = synthetic_shops(nshops)
+        with patched(shopstats,
+                     get_shops=lambda: shops,
+                     get_endpoint_counters=lambda chain_id, shop_id, nodepoint_specs, **options: [ counters ] * len(nodepoint_specs)):
+            seconds = timeit(shopstats.generate_dataframe, shopstats.get_nodepoint_specs())
+        legacy_seconds = None
+        if nshops <= legacy_limit:
+            legacy_seconds = timeit(legacy_dataframe_assembly, shops, shopstats.get_nodepoint_specs(), counters)
+        results.append((nshops, seconds, legacy_seconds))
+    return results
+
+
+def print_dataframe_assembly(results):
+    print('DataFrame assembly (%s nodepoints)' % len(shopstats.get_nodepoint_specs()))
+    print('%8s %12s %12s' % ('shops', 'seconds', 'legacy'))
+    for nshops, seconds, legacy_seconds in results:
+        legacy = '%12.4f' % legacy_seconds if legacy_seconds is not None else '%12s' % '-'
+        print('%8d %12.4f %s' % (nshops, seconds, legacy))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks shopstats on synthetic data')
+    parser.add_argument('--shops', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='numbers of shops for the DataFrame assembly')
+    parser.add_argument('--entries', type=int, default=1000000,
+                        help='number of entries for the entries processors')
+    parser.add_argument('--stats-shops', type=int, default=5000,
+                        help='number of shops of the stats to be loaded')
+    parser.add_argument('--stats-periods', type=int, default=24,
+                        help='number of periods of the stats to be loaded')
+    parser.add_argument('--load', type=parse_scenario, nargs='+', metavar='SHOPSxLINES',
+                        help='runs the synthetic load suite instead, for the given scenarios, '
+                             'e.g. 10x1000 10000x5000000')
+    parser.add_argument('--baseline', metavar='FILENAME',
+                        help='baseline of the synthetic load suite. Slower stages are flagged as regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown over the baseline flagged as a regression (default: %(default)s)')
+    parser.add_argument('--save-baseline', metavar='FILENAME',
+                        help='saves the results of the synthetic load suite as a baseline')
+    arguments = parser.parse_args()
+    if arguments.load:
+        results = bench_load_scenarios(arguments.load)
+        baseline = None
+        if arguments.baseline:
+            with open(arguments.baseline) as f:
+                baseline = json.load(f)
+        print_load_scenarios(results, baseline)
+        if arguments.save_baseline:
+            with open(arguments.save_baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+            print('Baseline saved at %s' % arguments.save_baseline)
+        if baseline:
+            regressions = find_regressions(results, baseline, arguments.tolerance)
+            for scenario, stage, expected, seconds in regressions:
+                print('REGRESSION %s %s: %.4f s -> %.4f s (%+.0f%%)' % (scenario, stage, expected, seconds,
+                                                                        100 * (seconds / expected - 1)))
+            sys.exit(1 if regressions else 0)
+        sys.exit(0)
+    print_import_time()
+    print_dataframe_assembly(bench_dataframe_assembly(arguments.shops))
+    print_entries_processors(bench_entries_processors(arguments.entries), arguments.entries)
+    print_stats_loading(bench_stats_loading(arguments.stats_shops, arguments.stats_periods),
+                        arguments.stats_shops, arguments.stats_periods)
+    print_store_queries(bench_store_queries(arguments.stats_shops, arguments.stats_periods),
+                        arguments.stats_shops, arguments.stats_periods)
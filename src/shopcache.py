@@ -0,0 +1,137 @@
+"""
+    Persistent cache of the responses of the Bitphy API
+
+    Responses are stored compressed in a sqlite file.
+    - responses of closed periods never expire
+    - the rest of responses expire after a TTL. Once expired, they're
+      revalidated with the API using ETag/If-Modified-Since
+    - when the stored responses exceed the size limit, the least
+      recently used ones are evicted
+"""
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+
+# default limit of the size of the stored (compressed) responses
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# default seconds before a response of an open period expires
+DEFAULT_TTL = 3600
+
+CacheEntry = collections.namedtuple('CacheEntry',
+        ['key', 'body', 'content_type', 'etag', 'last_modified', 'expires'])
+
+
+def compose_key(url, params=None):
+    """ returns the key of the request for the given url and query params
+
+        >>> compose_key('http://x/a', {'b': 1, 'a': 2}) == compose_key('http://x/a', {'a': 2, 'b': 1})
+        True
+    """
+    params = params or {}
+    query = '&'.join('%s=%s' % (name, params[name]) for name in sorted(params))
+    return hashlib.sha256(('%s?%s' % (url, query)).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """ sqlite backed LRU cache of API responses """
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = time.time          # source of the current time
+        self.lock = threading.Lock()
+        self.stats = { 'hits': 0, 'misses': 0, 'stale': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0 }
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires REAL,
+                    accessed REAL NOT NULL)''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.connection.commit()
+
+    def get(self, key):
+        """ returns the tuple (entry, fresh)
+            - entry: the CacheEntry stored for the key or None
+            - fresh: True when the entry can be used without revalidation
+            It counts the result as a hit, a miss or a stale entry
+        """
+        now = self.clock()
+        with self.lock:
+            row = self.connection.execute(
+                    'SELECT body, content_type, etag, last_modified, expires FROM responses WHERE key = ?',
+                    (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None, False
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+            body, content_type, etag, last_modified, expires = row
+            fresh = expires is None or expires > now
+            self.stats['hits' if fresh else 'stale'] += 1
+        return CacheEntry(key, zlib.decompress(body), content_type, etag, last_modified, expires), fresh
+
+    def put(self, key, body, headers, closed=False):
+        """ stores the body of a response for the key
+            :param headers: headers of the response
+            :param closed: when True the response never expires
+        """
+        now = self.clock()
+        compressed = zlib.compress(body)
+        expires = None if closed else now + self.ttl
+        with self.lock:
+            self.connection.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, compressed, len(compressed), headers.get('content-type'),
+                     headers.get('etag'), headers.get('last-modified'), expires, now))
+            self.stats['stores'] += 1
+            self.evict()
+            self.connection.commit()
+
+    def refresh(self, key, closed=False):
+        """ extends the expiration of a revalidated entry """
+        now = self.clock()
+        expires = None if closed else now + self.ttl
+        with self.lock:
+            self.connection.execute('UPDATE responses SET expires = ?, accessed = ? WHERE key = ?',
+                                    (expires, now, key))
+            self.connection.commit()
+            self.stats['revalidated'] += 1
+
+    def evict(self):
+        """ removes the least recently used entries until the size limit
+            is satisfied. Caller must hold the lock """
+        (total,) = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            self.stats['evictions'] += 1
+
+    def size(self):
+        """ returns the size in bytes of the stored responses """
+        with self.lock:
+            (total,) = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return total
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
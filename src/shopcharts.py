@@ -1,7 +1,7 @@
 #! /usr/bin/env python3
 """
     This script generates different charts for the shopstats results
-    stored in a csv file
+    stored in a csv, feather or parquet file
 """
 
 import shopstats
@@ -10,6 +10,35 @@ import re
 import datetime
 import sys
 
+
+def detect_format(filename):
+    """ returns the format of a shopstats results file: 'feather', 'parquet' or 'csv'
+        from the magic bytes at its beginning """
+    with open(filename, 'rb') as f:
+        magic = f.read(6)
+    if magic == b'ARROW1':
+        return 'feather'
+    if magic.startswith(b'PAR1'):
+        return 'parquet'
+    return 'csv'
+
+
+def load_shopstats(filename):
+    """ loads the shopstats results from a file in any of the formats
+        of detect_format(). Columnar files are converted to pandas with
+        their schema, which copies them, and each Arrow column is freed
+        once converted
+    """
+    stats_format = detect_format(filename)
+    if stats_format == 'feather':
+        import pyarrow.feather
+        return pyarrow.feather.read_table(filename, memory_map=True).to_pandas(split_blocks=True, self_destruct=True)
+    if stats_format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(filename).to_pandas(split_blocks=True, self_destruct=True)
+    return pd.read_csv(filename, dtype={ 'chain_id': 'category', 'shop_id': 'category', 'shop_name': 'category' })
+
+
 def get_data_context_from_filename(filename):
     """ given the csv filename
         it gets the month and year if present, and 
@@ -18,9 +47,9 @@ def get_data_context_from_filename(filename):
         >>> get_data_context_from_filename('shopstats_201906.csv')
         'June 2019'
         >>> get_data_context_from_filename('shopstats.csv')
-        'test'¡
+        'test'
     """
-    m = re.match('.*_(\d{4})(\d{2})\.csv', filename)
+    m = re.match(r'.*_(\d{4})(\d{2})\.(csv|feather|parquet)$', filename)
     if m:
         context = datetime.date(year=int(m.group(1)), month=int(m.group(2)), day=1).strftime('%B %Y')
     else:
@@ -30,14 +59,14 @@ def get_data_context_from_filename(filename):
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
-        print("Usage: %s «shopstats filename.csv»" % sys.argv[0])
+        print("Usage: %s «shopstats filename.csv|.feather|.parquet»" % sys.argv[0])
         sys.exit(1)
-    csv_filename = sys.argv[1]
-    df = pd.read_csv(csv_filename)
+    filename = sys.argv[1]
+    df = load_shopstats(filename)
     distinct_chart_filename = 'distinct.png'
     malformed_chart_filename = 'malformed.png'
     billing_chart_filename = 'billing.png'
-    context = get_data_context_from_filename(csv_filename)
+    context = get_data_context_from_filename(filename)
     shopstats.save_malformed_stats_chart(df, malformed_chart_filename, context)
     shopstats.save_sales_stats_chart(df, billing_chart_filename, context)
     shopstats.save_duplicated_stats_chart(df, distinct_chart_filename, context)
@@ -0,0 +1,292 @@
+#! /usr/bin/env python3
+"""
+    Local fake Bitphy API for load testing shopstats offline
+
+    It serves the endpoints requested by shopstats
+    - /user/accessible-resources
+    - /chains/{chain}/shops/{shop}/{nodepoint}?dateStart=...&dateEnd=...
+    with synthetic entries generated from a seed: the same seed, shop,
+    nodepoint and dates always produce the same response. Responses have
+    an ETag, so the response cache of shopstats can revalidate them.
+
+    Latency, error rate, throttling and payload sizes are configurable.
+    When run as a script, it serves until interrupted and can write the
+    bitphyaccess.json pointing shopstats to it.
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+import shopspecs
+import shopstats
+
+
+def parse_latency(text):
+    """ returns a function returning a latency in seconds given a random
+        generator, from a distribution given as
+        - constant:SECONDS
+        - uniform:MIN:MAX
+        - lognormal:MEDIAN:SIGMA
+
+        >>> parse_latency('constant:0.5')(random.Random(0))
+        0.5
+    """
+    name, *params = text.split(':')
+    try:
+        params = [ float(param) for param in params ]
+        if name == 'constant' and len(params) == 1:
+            return lambda rng: params[0]
+        if name == 'uniform' and len(params) == 2:
+            return lambda rng: rng.uniform(*params)
+        if name == 'lognormal' and len(params) == 2:
+            median, sigma = params
+            return lambda rng: median * rng.lognormvariate(0, sigma)
+    except ValueError:
+        pass
+    raise ValueError('Unknown latency distribution %s' % text)
+
+
+def compose_shops(nshops, nchains):
+    """ returns the list of (chain_id, shop_id, shop_name) served """
+    return [ ('chain_%s' % (i % nchains), 'shop_%s' % i, 'Shop %s' % i) for i in range(nshops) ]
+
+
+def generate_entries(nodepoint_spec, nlines, rng, malformed_ratio=0.01, distinct_ratio=0.8):
+    """ returns nlines entries of a nodepoint (sales lines for the
+        aggregation nodepoints), some of them malformed and, for the raw
+        nodepoints, some of them duplicated """
+    if nodepoint_spec['type'] == 'raw':
+        key = nodepoint_spec['equality_key']
+        ndistinct = max(int(nlines * distinct_ratio), 1)
+        return [ { 'id': i } if rng.random() < malformed_ratio else { key: 'oid%s' % rng.randrange(ndistinct), 'name': 'name %s' % i }
+                 for i in range(nlines) ]
+    key = nodepoint_spec['aggregation_key']
+    lines = [ { 'quantity': 1 } if rng.random() < malformed_ratio else { key: round(rng.uniform(-10, 500), 2), 'quantity': 1 }
+              for _ in range(nlines) ]
+    subkey = nodepoint_spec['subkey']
+    if not subkey:
+        return lines
+    entries = []
+    start = 0
+    while start < len(lines):
+        size = rng.randint(1, 9)
+        entries.append({ 'id': len(entries), subkey: lines[start:start + size] })
+        start += size
+    return entries
+
+
+class FakeBitphyApi:
+    """ fake Bitphy API served by a local HTTP server in a thread """
+
+    def __init__(self, nshops=100, nchains=5, lines=1000, lines_spread=0.5, latency='constant:0',
+                 error_rate=0, max_concurrency=None, rate=None, retry_after=1,
+                 malformed_ratio=0.01, seed=0, nodepoint_specs=None, host='127.0.0.1', port=0,
+                 clock=time.monotonic):
+        """ :param lines: mean number of lines of each nodepoint of a shop
+            :param lines_spread: lines of each shop vary uniformly within
+                                 lines * (1 +- lines_spread)
+            :param latency: distribution of the latency. See parse_latency()
+            :param error_rate: ratio of the requests failing with a 500
+            :param max_concurrency: requests being served at once. Beyond it
+                                    they're throttled with a 429
+            :param rate: requests per second. Beyond it they're throttled
+            :param retry_after: seconds of the Retry-After of the throttled requests
+            :param malformed_ratio: ratio of the malformed entries
+            :param seed: seed of the generated data
+            :param clock: seconds of the windows of the rate
+        """
+        self.shops = compose_shops(nshops, nchains)
+        self.shop_keys = { (chain_id, shop_id) for chain_id, shop_id, _ in self.shops }
+        self.lines = lines
+        self.lines_spread = lines_spread
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.retry_after = retry_after
+        self.malformed_ratio = malformed_ratio
+        self.seed = seed
+        # the entries of an endpoint are generated for its first nodepoint
+        self.nodepoint_specs = {}
+        for spec in nodepoint_specs or shopstats.get_nodepoint_specs():
+            self.nodepoint_specs.setdefault(shopspecs.compile_spec(spec).endpoint, spec)
+        self.rng = random.Random(seed)          # latency, errors
+        self.lock = threading.Lock()
+        self.active = 0
+        self.clock = clock
+        self.rate_window = (0, 0)               # (second, requests in the second)
+        self.stats = { 'requests': 0, 'ok': 0, 'not_modified': 0, 'errors': 0, 'throttled': 0, 'bytes': 0 }
+        self.server = http.server.ThreadingHTTPServer((host, port), self.build_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url_base(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, active=self.active)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def throttle(self):
+        """ returns True when the request exceeds the concurrency or the rate """
+        with self.lock:
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                return True
+            if self.rate:
+                second = int(self.clock())
+                window_second, requests = self.rate_window
+                requests = requests + 1 if second == window_second else 1
+                self.rate_window = (second, requests)
+                if requests > self.rate:
+                    return True
+            self.active += 1
+            return False
+
+    def compose_resources(self):
+        chains = {}
+        for chain_id, shop_id, shop_name in self.shops:
+            chains.setdefault(chain_id, []).append({ 'id': shop_id, 'name': shop_name })
+        return [ { 'id': chain_id, 'name': chain_id, 'shops': shops } for chain_id, shops in chains.items() ]
+
+    def compose_entries(self, chain_id, shop_id, nodepoint, query):
+        """ returns the entries of the nodepoint, deterministic for the seed,
+            shop, nodepoint and dates """
+        key = '%s/%s/%s/%s/%s/%s' % (self.seed, chain_id, shop_id, nodepoint,
+                                     query.get('dateStart', [''])[0], query.get('dateEnd', [''])[0])
+        rng = random.Random(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest())
+        spread = self.lines * self.lines_spread
+        nlines = max(int(rng.uniform(self.lines - spread, self.lines + spread)), 0)
+        return generate_entries(self.nodepoint_specs[nodepoint], nlines, rng, self.malformed_ratio)
+
+    def respond(self, path, query):
+        """ returns the tuple (status code, body) of a request """
+        if path == '/user/accessible-resources':
+            return 200, self.compose_resources()
+        parts = path.strip('/').split('/', 4)
+        if len(parts) != 5 or parts[0] != 'chains' or parts[2] != 'shops':
+            return 404, { 'error': 'Unknown endpoint %s' % path }
+        _, chain_id, _, shop_id, nodepoint = parts
+        if nodepoint not in self.nodepoint_specs:
+            return 404, { 'error': 'Unknown nodepoint %s' % nodepoint }
+        if (chain_id, shop_id) not in self.shop_keys:
+            return 404, { 'error': 'Unknown shop %s/%s' % (chain_id, shop_id) }
+        if 'dateStart' not in query or 'dateEnd' not in query:
+            return 400, { 'error': 'dateStart and dateEnd are required' }
+        return 200, self.compose_entries(chain_id, shop_id, nodepoint, query)
+
+    def build_handler(self):
+        api = self
+
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # keep-alive
+
+            def send_body(self, status_code, body, headers=()):
+                self.send_response(status_code)
+                self.send_header('content-type', 'application/json; charset=utf-8')
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                api.count('requests')
+                if api.throttle():
+                    api.count('throttled')
+                    self.send_body(429, b'{}', [ ('Retry-After', str(api.retry_after)) ])
+                    return
+                try:
+                    with api.lock:
+                        latency = api.latency(api.rng)
+                        failed = api.rng.random() < api.error_rate
+                    time.sleep(max(latency, 0))
+                    if failed:
+                        api.count('errors')
+                        self.send_body(500, b'{"error": "fake error"}')
+                        return
+                    url = urllib.parse.urlsplit(self.path)
+                    status_code, contents = api.respond(url.path, urllib.parse.parse_qs(url.query))
+                    body = json.dumps(contents).encode('utf-8')
+                    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+                    if status_code == 200 and self.headers.get('If-None-Match') == etag:
+                        api.count('not_modified')
+                        self.send_body(304, b'', [ ('ETag', etag) ])
+                        return
+                    api.count('ok' if status_code == 200 else 'errors')
+                    api.count('bytes', len(body))
+                    self.send_body(status_code, body, [ ('ETag', etag) ] if status_code == 200 else [])
+                finally:
+                    with api.lock:
+                        api.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """ serves the requests in a daemon thread """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves a fake Bitphy API with synthetic data')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--shops', type=int, default=100, help='number of shops (default: %(default)s)')
+    parser.add_argument('--chains', type=int, default=5, help='number of chains (default: %(default)s)')
+    parser.add_argument('--lines', type=int, default=1000,
+                        help='mean lines of each nodepoint of a shop (default: %(default)s)')
+    parser.add_argument('--lines-spread', type=float, default=0.5,
+                        help='relative variation of the lines of each shop (default: %(default)s)')
+    parser.add_argument('--latency', default='constant:0', metavar='DISTRIBUTION',
+                        help='latency distribution: constant:SECONDS, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0, help='ratio of requests failing with a 500')
+    parser.add_argument('--max-concurrency', type=int, help='requests served at once before throttling them')
+    parser.add_argument('--rate', type=float, help='requests per second before throttling them')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of the throttled requests')
+    parser.add_argument('--malformed-ratio', type=float, default=0.01, help='ratio of malformed entries')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--write-params', metavar='FILENAME',
+                        help='writes the api params file pointing to this server, e.g. bitphyaccess.json')
+    arguments = parser.parse_args()
+    api = FakeBitphyApi(nshops=arguments.shops, nchains=arguments.chains, lines=arguments.lines,
+                        lines_spread=arguments.lines_spread, latency=arguments.latency, error_rate=arguments.error_rate,
+                        max_concurrency=arguments.max_concurrency, rate=arguments.rate,
+                        retry_after=arguments.retry_after, malformed_ratio=arguments.malformed_ratio,
+                        seed=arguments.seed, host=arguments.host, port=arguments.port)
+    if arguments.write_params:
+        with open(arguments.write_params, 'w') as f:
+            json.dump({ 'url_base': api.url_base, 'headers': {} }, f, indent=4)
+        print('API params saved at %s' % arguments.write_params)
+    print('Serving the fake Bitphy API at %s' % api.url_base)
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.server.server_close()
+        print('Stats: %s' % api.get_stats())
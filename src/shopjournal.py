@@ -0,0 +1,102 @@
+"""
+    Write-ahead journal of the computed counters
+
+    Each completed (period, chain_id, shop_id, nodepoint) unit is appended
+    as a JSON line and flushed at once, so the counters computed before a
+    process dies are not lost. An interrupted run resumes by loading the
+    journal and skipping its units. Units are written with the digest of
+    their nodepoint spec, so those of a changed spec are computed again.
+"""
+import json
+import logging
+import os
+import threading
+import numpy as np
+import shopsketch
+
+
+def format_period(period):
+    return period if isinstance(period, str) else period.strftime('%Y%m')
+
+
+def to_json_value(value):
+    """ returns the counter as a JSON serializable value, NaN as None """
+    if value is None or value != value:
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class Journal:
+    """ append-only journal of the counters of each unit """
+
+    def __init__(self, filename, resume=False):
+        """ :param resume: when True the units already in the file are
+                           loaded. Otherwise the file is truncated
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.units = {}
+        if resume and os.path.exists(filename):
+            self.load()
+        self.file = open(filename, 'a' if resume else 'w')
+
+    @staticmethod
+    def compose_key(period, chain_id, shop_id, nodepoint):
+        return (format_period(period), str(chain_id), str(shop_id), nodepoint)
+
+    def load(self):
+        """ loads the units of the file. A last incomplete line, written
+            when the process died, is ignored """
+        with open(self.filename) as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if number == len(lines):
+                    logging.warning('Ignoring the incomplete last line of the journal %s', self.filename)
+                    lines.pop()
+                    break
+                raise
+            key = self.compose_key(record['period'], record['chain_id'], record['shop_id'], record['nodepoint'])
+            counters = tuple(np.nan if value is None else value for value in record['counters'])
+            sketch = shopsketch.HyperLogLog.from_dict(record['sketch']) if 'sketch' in record else None
+            self.units[key] = (counters, sketch, record.get('spec_digest'))
+        # rewrites the loaded lines so the next records start in a new line
+        with open(self.filename, 'w') as f:
+            f.writelines(line if line.endswith('\n') else line + '\n' for line in lines)
+
+    def get(self, period, chain_id, shop_id, nodepoint, spec_digest=None):
+        """ returns the tuple (counters, sketch) of a completed unit or None
+
+            :param spec_digest: digest of the current nodepoint spec. The
+                                units written with another digest, or
+                                without it, are ignored
+        """
+        unit = self.units.get(self.compose_key(period, chain_id, shop_id, nodepoint))
+        if unit is None or (spec_digest is not None and unit[2] != spec_digest):
+            return None
+        return unit[:2]
+
+    def write(self, period, chain_id, shop_id, nodepoint, counters, sketch=None, spec_digest=None):
+        """ appends a completed unit and flushes it to the file """
+        key = self.compose_key(period, chain_id, shop_id, nodepoint)
+        period, chain_id, shop_id, _ = key
+        record = { 'period': period, 'chain_id': chain_id, 'shop_id': shop_id, 'nodepoint': nodepoint,
+                   'counters': [ to_json_value(value) for value in counters ] }
+        if sketch is not None:
+            record['sketch'] = sketch.to_dict()
+        if spec_digest is not None:
+            record['spec_digest'] = spec_digest
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.units[key] = (tuple(counters), sketch, spec_digest)
+
+    def __len__(self):
+        return len(self.units)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,165 @@
+"""
+    JSON utilities for the responses of the Bitphy API
+"""
+import codecs
+import importlib.util
+import json
+import logging
+import re
+import threading
+
+_decoder = json.JSONDecoder()
+
+_whitespace = ' \t\n\r'
+
+# characters ending a number or a literal (true, false, null) inside an array
+_scalar_delimiters = frozenset(_whitespace + ',]')
+
+
+def loads_stdlib(data):
+    """ parses a JSON document from bytes (utf-8, -16 or -32) or str """
+    return json.loads(data)
+
+
+# runs of 19 digits or more, which may be integers beyond 64 bits. orjson
+# parses those integers as floats
+_long_digits = re.compile(rb'\d{19}')
+
+# documents parsed by the stdlib instead of orjson, by reason. See loads_orjson()
+fallbacks = { 'not_accepted': 0, 'big_integers': 0 }
+fallbacks_lock = threading.Lock()
+
+
+def has_big_floats(item):
+    """ returns True when the parsed item contains floats of integer
+        magnitude beyond 64 bits, as orjson parses the big integers
+
+        >>> has_big_floats([ { 'id': '12345678901234567890', 'billing': 1.5 } ])
+        False
+        >>> has_big_floats([ { 'billing': 1.2345678901234568e+29 } ])
+        True
+    """
+    stack = [ item ]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, float) and abs(item) >= 2 ** 63:
+            return True
+    return False
+
+
+def count_fallback(reason):
+    with fallbacks_lock:
+        fallbacks[reason] += 1
+    logging.debug('JSON document parsed by the stdlib instead of orjson: %s', reason)
+
+
+def loads_orjson(data):
+    """ like loads_stdlib() but parsed by orjson. The documents orjson
+        doesn't accept (NaN, not utf-8...) or parses differently (integers
+        beyond 64 bits) are parsed by the stdlib, so both give identical
+        results. These fallbacks are counted in fallbacks """
+    import orjson
+    try:
+        parsed = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        count_fallback('not_accepted')
+        return loads_stdlib(data)
+    # only the documents with long runs of digits, e.g. in ids, are checked
+    if _long_digits.search(data.encode('utf-8') if isinstance(data, str) else data) and has_big_floats(parsed):
+        count_fallback('big_integers')
+        return loads_stdlib(data)
+    return parsed
+
+
+# JSON decoders by name: functions parsing bytes
+decoders = {
+        'json': loads_stdlib,
+        'orjson': loads_orjson,
+        }
+
+
+def available_decoders():
+    """ returns the names of the decoders whose modules are installed """
+    return [ name for name in decoders if importlib.util.find_spec(name) is not None ]
+
+
+def get_decoder(name='auto'):
+    """ returns the decoder function of the given name. 'auto' is the
+        fastest installed decoder: orjson, or else the stdlib json.
+        It raises ValueError when the decoder is unknown or not installed
+    """
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in available_decoders() else 'json'
+    if name not in decoders:
+        raise ValueError('Unknown JSON decoder %s' % name)
+    if name not in available_decoders():
+        raise ValueError('JSON decoder %s is not installed' % name)
+    return decoders[name]
+
+
+def iter_json_array(chunks):
+    """ given an iterable of bytes chunks containing a JSON array,
+        it yields the items of the array while the chunks are received.
+        Only the item being parsed is kept in memory.
+
+        It raises ValueError when the contents are not a JSON array
+
+        >>> list(iter_json_array([b'[{"a": 1}, ', b'{"a"', b': 2}]']))
+        [{'a': 1}, {'a': 2}]
+    """
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    state = 'start'         # start -> first_item -> separator <-> item -> end
+    chunks = iter(chunks)
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        buffer += text_decoder.decode(b'' if final else chunk, final=final)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in _whitespace:
+                position += 1
+            if position == len(buffer):
+                break
+            if state == 'end':
+                raise ValueError('Unexpected contents after the JSON array at %s' % position)
+            if state == 'start':
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                position += 1
+                state = 'first_item'
+                continue
+            if state in ('first_item', 'separator') and buffer[position] == ']':
+                position += 1
+                state = 'end'
+                continue
+            if state == 'separator':
+                if buffer[position] != ',':
+                    raise ValueError("Expected ',' or ']' in the JSON array")
+                position += 1
+                state = 'item'
+                continue
+            if buffer[position] not in '{["':
+                # numbers and literals could go on in the next chunk
+                scalar_end = position
+                while scalar_end < len(buffer) and buffer[scalar_end] not in _scalar_delimiters:
+                    scalar_end += 1
+                if scalar_end == len(buffer) and not final:
+                    break
+            try:
+                item, item_end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break               # the item is not complete yet
+            yield item
+            position = item_end
+            state = 'separator'
+        buffer = buffer[position:]
+    if state != 'end':
+        raise ValueError('Unexpected end of the JSON array')
@@ -0,0 +1,176 @@
+"""
+    Scheduling of the requests to the Bitphy API
+
+    The requests to each host are limited by
+    - a token bucket: at most `rate` requests per second, with bursts of
+      `burst` requests
+    - an AIMD concurrency window: the number of requests in flight grows
+      by one after a window of successful requests, and it's halved when
+      the host throttles (429 or 503). The host is not requested again
+      until its Retry-After has elapsed
+"""
+import email.utils
+import threading
+import time
+
+# status codes of the responses of a throttling host
+THROTTLING_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    """ returns the seconds to wait given a Retry-After header, either
+        delay seconds or an HTTP date. None when it can't be parsed
+
+        >>> parse_retry_after('2')
+        2.0
+        >>> parse_retry_after('Wed, 21 Oct 2015 07:28:10 GMT', now=1445412480)
+        10.0
+        >>> parse_retry_after('soon') is None
+        True
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - (time.time() if now is None else now), 0.0)
+
+
+class TokenBucket:
+    """ rate limit of rate tokens per second, with bursts of burst tokens """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ takes a token and returns the seconds to wait before using it """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0.0)
+
+
+class HostLimiter:
+    """ AIMD concurrency window and rate limit of the requests to a host """
+
+    def __init__(self, max_window, min_window=1, rate=None, burst=None, decrease=0.5, clock=time.monotonic):
+        """ :param max_window: maximum number of requests in flight
+            :param min_window: minimum number of requests in flight
+            :param rate: maximum requests per second. By default, unlimited
+            :param burst: requests sent at once before the rate applies
+            :param decrease: factor of the window when the host throttles
+        """
+        self.max_window = max_window
+        self.min_window = min_window
+        self.decrease = decrease
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock) if rate else None
+        self.window = float(max_window)
+        self.epoch = 0              # increased on each decrease of the window
+        self.paused_until = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.stats = { 'requests': 0, 'throttled': 0, 'decreases': 0, 'rate_waits': 0 }
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """ waits until a request can be sent
+            returns the ticket to be given to release() """
+        with self.condition:
+            self.queued += 1
+            while True:
+                wait = self.paused_until - self.clock()
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight >= int(self.window):
+                    self.condition.wait()
+                else:
+                    break
+            self.queued -= 1
+            self.in_flight += 1
+            self.stats['requests'] += 1
+            ticket = self.epoch
+        if self.bucket:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                with self.condition:
+                    self.stats['rate_waits'] += 1
+                time.sleep(wait)
+        return ticket
+
+    def release(self, ticket, throttled=False, pause=None):
+        """ records the end of a request
+            :param ticket: returned by acquire() for the request
+            :param throttled: whether the host throttled the request
+            :param pause: seconds before the host can be requested again
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.stats['throttled'] += 1
+                # requests sent before the last decrease don't decrease it again
+                if ticket == self.epoch:
+                    self.window = max(self.min_window, self.window * self.decrease)
+                    self.epoch += 1
+                    self.stats['decreases'] += 1
+                if pause:
+                    self.paused_until = max(self.paused_until, self.clock() + pause)
+            else:
+                self.window = min(self.max_window, self.window + 1 / self.window)
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, in_flight=self.in_flight, queued=self.queued, window=self.window,
+                        paused=max(self.paused_until - self.clock(), 0))
+
+
+class RequestScheduler:
+    """ HostLimiter of each requested host """
+
+    def __init__(self, max_window=10, rate=None, burst=None, host_limits=None):
+        """ :param host_limits: dict host -> dict of HostLimiter params
+                                overriding the rest of params for the host
+        """
+        self.defaults = { 'max_window': max_window, 'rate': rate, 'burst': burst }
+        self.host_limits = host_limits or {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def get_limiter(self, host):
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = HostLimiter(**dict(self.defaults, **self.host_limits.get(host, {})))
+            return self.limiters[host]
+
+    def acquire(self, host):
+        return self.get_limiter(host).acquire()
+
+    def release(self, host, ticket, throttled=False, pause=None):
+        self.get_limiter(host).release(ticket, throttled=throttled, pause=pause)
+
+    def get_stats(self):
+        """ returns a dict with the totals of the stats of the hosts
+            (requests, throttled, in_flight, queued...) and the stats of
+            each host in 'hosts' """
+        with self.lock:
+            limiters = dict(self.limiters)
+        hosts = { host: limiter.get_stats() for host, limiter in limiters.items() }
+        totals = {}
+        for stats in hosts.values():
+            for name, value in stats.items():
+                if name not in ('window', 'paused'):
+                    totals[name] = totals.get(name, 0) + value
+        return dict(totals, hosts=hosts)
@@ -0,0 +1,106 @@
+"""
+    Logging utilities for shopstats
+
+    - Payload: formats a payload (parsed entries or response bytes) only
+      when the message is emitted, truncated to a size cap, with the
+      digest of the bytes
+    - RateLimitFilter: lets through a burst of each repeated message per
+      interval, and reports how many were suppressed. Messages repeated
+      for each entry or request are logged with extra=RATE_LIMITED
+"""
+import hashlib
+import logging
+import reprlib
+import threading
+import time
+
+# characters of a formatted payload
+DEFAULT_PAYLOAD_CHARS = 500
+
+# extra of the logging calls whose messages are rate limited, e.g.
+# logging.warning('Request to %s failed', url, extra=RATE_LIMITED)
+RATE_LIMITED = { 'rate_limited': True }
+
+
+class Payload:
+    """ lazy representation of a payload to be given as argument of the
+        logging calls, e.g. logging.debug('entries: %s', Payload(entries))
+        It's only formatted when the message is emitted, and never beyond
+        max_chars characters, whatever the size of the payload
+
+        >>> str(Payload(list(range(1000))))
+        'list of 1000: [0, 1, 2, 3, 4, 5, ...]'
+        >>> str(Payload(list(range(1000)), max_chars=30))
+        'list of 1000: [0, 1, 2, 3, ...'
+        >>> str(Payload(b'{"id": 1}'))
+        'bytes of 9 (blake2b cf099939cd7acef7): {"id": 1}'
+    """
+
+    def __init__(self, value, max_chars=DEFAULT_PAYLOAD_CHARS):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            digest = hashlib.blake2b(value, digest_size=8).hexdigest()
+            head = bytes(value[:self.max_chars]).decode('utf-8', errors='replace')
+            text = 'bytes of %s (blake2b %s): %s' % (len(value), digest, head)
+        else:
+            limits = reprlib.Repr()
+            limits.maxlevel = 3
+            limits.maxstring = limits.maxother = self.max_chars
+            text = limits.repr(value)
+            if isinstance(value, (list, dict, tuple, set)):
+                text = '%s of %s: %s' % (type(value).__name__, len(value), text)
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars - 3] + '...'
+        return text
+
+
+class RateLimitFilter(logging.Filter):
+    """ filter letting through the first `burst` records of each message
+        logged with extra=RATE_LIMITED in each interval of seconds. The
+        rest are suppressed, and the next record let through reports how
+        many of them were suppressed. Records of the same message are
+        those of the same logger, level and message template, so messages
+        must be logged with lazy arguments: logging.warning('... %s', value)
+    """
+
+    def __init__(self, interval=60, burst=10, clock=time.monotonic):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.clock = clock
+        self.windows = {}       # message -> [ start of the window, records let through, suppressed ]
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'rate_limited', False):
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = self.clock()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                window = self.windows[key] = [ now, 0, window[2] if window else 0 ]
+            if window[1] >= self.burst:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+        if suppressed:
+            record.msg = '%s (%s similar messages suppressed)' % (record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+def install_rate_limit(interval=60, burst=10, logger=None):
+    """ adds a RateLimitFilter to the handlers of the logger (by default
+        the root logger) and returns it """
+    rate_limit = RateLimitFilter(interval=interval, burst=burst)
+    for handler in (logger or logging.getLogger()).handlers:
+        handler.addFilter(rate_limit)
+    return rate_limit
@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+"""
+    Samples of the malformed entries of the nodepoints
+
+    For each nodepoint of each shop, it keeps a reservoir sample of a
+    fixed number of its malformed entries, and the histogram of the keys
+    they're missing, with bounded memory however many entries are
+    malformed. The samples are saved as JSON lines next to the stats.
+
+    When run as a script, it prints the missing keys of each nodepoint
+    of the samples files given as arguments.
+"""
+import json
+import random
+import sys
+import pandas as pd
+
+# malformed entries kept for each nodepoint of each shop
+DEFAULT_SAMPLE_SIZE = 5
+
+# characters of the JSON of a kept entry. Longer entries are truncated
+DEFAULT_ENTRY_CHARS = 1000
+
+
+def compact_entry(entry, max_chars=DEFAULT_ENTRY_CHARS):
+    """ returns the entry when its JSON is shorter than max_chars,
+        otherwise its JSON truncated to max_chars
+
+        >>> compact_entry({ 'id': 1 })
+        {'id': 1}
+        >>> compact_entry({ 'name': 'x' * 100 }, max_chars=20)
+        '{"name": "xxxxxxx...'
+    """
+    text = json.dumps(entry, default=str)
+    if len(text) <= max_chars:
+        return entry
+    return text[:max_chars - 3] + '...'
+
+
+class MalformedSample:
+    """ reservoir sample of the malformed entries of a nodepoint of a
+        shop, and count of their missing keys
+
+        >>> sample = MalformedSample(size=2)
+        >>> sample.update(({ 'id': i } for i in range(100)), 'billing')
+        >>> sample.count, len(sample.entries), sample.missing_keys
+        (100, 2, {'billing': 100})
+    """
+
+    def __init__(self, size=DEFAULT_SAMPLE_SIZE, max_chars=DEFAULT_ENTRY_CHARS, seed=0):
+        self.size = size
+        self.max_chars = max_chars
+        self.rng = random.Random(seed)
+        self.count = 0
+        self.entries = []
+        self.missing_keys = {}
+
+    def add(self, entry, missing_key):
+        """ adds a malformed entry missing the given key. Each of the
+            added entries has the same probability of being kept """
+        self.count += 1
+        self.missing_keys[missing_key] = self.missing_keys.get(missing_key, 0) + 1
+        if len(self.entries) < self.size:
+            self.entries.append(compact_entry(entry, self.max_chars))
+            return
+        position = self.rng.randrange(self.count)
+        if position < self.size:
+            self.entries[position] = compact_entry(entry, self.max_chars)
+
+    def update(self, entries, missing_key):
+        for entry in entries:
+            self.add(entry, missing_key)
+
+    def merge(self, other):
+        """ adds the malformed entries of the other sample to this one.
+            Each kept entry is drawn from one of the samples with a
+            probability proportional to its malformed entries not drawn
+            yet, so every malformed entry of both samples has the same
+            probability of being kept """
+        remaining = [ self.count, other.count ]
+        pools = [ list(self.entries), list(other.entries) ]
+        for pool in pools:
+            self.rng.shuffle(pool)
+        entries = []
+        while len(entries) < self.size and any(pools):
+            weights = [ max(count, len(pool)) if pool else 0 for count, pool in zip(remaining, pools) ]
+            side = 0 if self.rng.random() * sum(weights) < weights[0] else 1
+            entries.append(pools[side].pop())
+            remaining[side] -= 1
+        self.entries = entries
+        self.count += other.count
+        for missing_key, count in other.missing_keys.items():
+            self.missing_keys[missing_key] = self.missing_keys.get(missing_key, 0) + count
+
+    def to_dict(self):
+        return { 'malformed': self.count, 'missing_keys': self.missing_keys, 'entries': self.entries }
+
+    @classmethod
+    def from_dict(cls, data):
+        sample = cls(size=max(len(data['entries']), 1))
+        sample.count = data['malformed']
+        sample.missing_keys = dict(data['missing_keys'])
+        sample.entries = list(data['entries'])
+        return sample
+
+
+def save_samples(filename, samples):
+    """ saves the samples as a JSON line for each
+        (chain_id, shop_id, nodepoint) -> MalformedSample """
+    with open(filename, 'w') as f:
+        for (chain_id, shop_id, nodepoint), sample in samples.items():
+            line = dict(chain_id=chain_id, shop_id=shop_id, nodepoint=nodepoint, **sample.to_dict())
+            f.write(json.dumps(line, default=str) + '\n')
+
+
+def load_samples(filename, samples=None):
+    """ loads the samples saved by save_samples() and merges them into
+        the given samples dict. It returns the samples """
+    samples = {} if samples is None else samples
+    with open(filename) as f:
+        for line in f:
+            data = json.loads(line)
+            key = (data['chain_id'], data['shop_id'], data['nodepoint'])
+            sample = MalformedSample.from_dict(data)
+            if key in samples:
+                samples[key].merge(sample)
+            else:
+                samples[key] = sample
+    return samples
+
+
+def summarize(samples):
+    """ returns a DataFrame with a row for each nodepoint and missing key
+        with the malformed entries missing it and the number of shops
+        having them, sorted by malformed entries """
+    totals = {}
+    for (_, _, nodepoint), sample in samples.items():
+        for missing_key, count in sample.missing_keys.items():
+            malformed, shops = totals.get((nodepoint, missing_key), (0, 0))
+            totals[(nodepoint, missing_key)] = (malformed + count, shops + 1)
+    rows = [ [ nodepoint, missing_key, malformed, shops ] for (nodepoint, missing_key), (malformed, shops) in totals.items() ]
+    df = pd.DataFrame(rows, columns=[ 'nodepoint', 'missing_key', 'malformed', 'shops' ])
+    return df.sort_values([ 'malformed', 'nodepoint' ], ascending=[ False, True ], ignore_index=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: %s «malformed entries filename.jsonl»..." % sys.argv[0])
+        sys.exit(1)
+    samples = {}
+    for filename in sys.argv[1:]:
+        load_samples(filename, samples)
+    print(summarize(samples).to_string(index=False))
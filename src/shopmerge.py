@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+"""
+    This script merges the outputs of the shards of a period, as saved by
+    shopstats.py --shard i/N, into the outputs of a single node run and
+    renders their charts. When the shards have sketches, they're merged
+    and rolled up too, and so are the samples of their malformed entries.
+"""
+
+import shopmalformed
+import shopsketch
+import shopstats
+import shopcharts
+import pandas as pd
+import argparse
+import logging
+import os
+import re
+import sys
+
+# index of the shard outputs: position of the shop in shopstats.get_shops()
+position_column = 'shop_position'
+
+
+def parse_shard_filename(filename):
+    """ returns the tuple (period, shard, nshards) of a shard output filename
+
+        >>> parse_shard_filename('shopstats_201906_shard2of4.csv')
+        (datetime.date(2019, 6, 1), 2, 4)
+    """
+    m = re.match(r'.*_(\d{6})_shard(\d+)of(\d+)\.(csv|feather|parquet)$', filename)
+    if not m:
+        raise ValueError('Not the output of a shard: %s' % filename)
+    return shopstats.parse_period(m.group(1)), int(m.group(2)), int(m.group(3))
+
+
+def load_shard(filename):
+    """ loads the stats of a shard indexed by the position of its shops """
+    if shopcharts.detect_format(filename) == 'csv':
+        df = pd.read_csv(filename, index_col=position_column,
+                         dtype={ 'chain_id': str, 'shop_id': str, 'shop_name': str })
+    else:
+        df = shopcharts.load_shopstats(filename)
+        df = df.astype({ column: str for column in ('chain_id', 'shop_id', 'shop_name') }).set_index(position_column)
+    return df
+
+
+def merge_shards(dataframes):
+    """ given the stats of the shards, it returns the stats of a single
+        node run: the shops in the order of get_shops() and the columns
+        sorted by shopstats.sort_columns()
+        It raises ValueError when a shop is in more than one shard
+    """
+    df = pd.concat(dataframes).sort_index()
+    if df.index.has_duplicates:
+        raise ValueError('Shops found in more than one shard: %s' % sorted(set(df.index[df.index.duplicated()])))
+    if len(df) and not df.index.equals(pd.RangeIndex(len(df))):
+        logging.warning('Missing shops in the shards: the merged stats have %s shops of %s', len(df), df.index.max() + 1)
+    df = df.reset_index(drop=True)
+    return shopstats.sort_columns(df)
+
+
+def check_shards(filenames):
+    """ returns the period of the shards filenames
+        It raises ValueError when they're of different periods or some
+        shard is missing """
+    shards = [ parse_shard_filename(filename) for filename in filenames ]
+    periods = { period for period, _, _ in shards }
+    if len(periods) != 1:
+        raise ValueError('Shards of different periods: %s' % ', '.join(sorted(p.strftime('%Y%m') for p in periods)))
+    nshards = { nshards for _, _, nshards in shards }
+    found = { shard for _, shard, _ in shards }
+    if len(nshards) != 1 or found != set(range(1, max(nshards) + 1)):
+        raise ValueError('Missing shards: found %s of %s' % (sorted(found), sorted(nshards)))
+    return periods.pop()
+
+
+def compose_shard_filename(filename, output):
+    """ returns the filename of an output (a key of shopstats.filename_templates)
+        saved with the stats of a shard
+
+        >>> compose_shard_filename('outputs/shopstats_201906_shard2of4.csv', 'malformed_entries')
+        'outputs/malformed_entries_201906_shard2of4.jsonl'
+    """
+    period, shard, nshards = parse_shard_filename(filename)
+    label = shopstats.get_shard_label(period, (shard, nshards))
+    return os.path.join(os.path.dirname(filename), shopstats.filename_templates[output] % label)
+
+
+def compose_sketches_filename(filename):
+    """ returns the filename of the sketches saved with the stats of a shard
+
+        >>> compose_sketches_filename('outputs/shopstats_201906_shard2of4.csv')
+        'outputs/sketches_201906_shard2of4.jsonl'
+    """
+    return compose_shard_filename(filename, 'sketches')
+
+
+def find_shard_outputs(filenames, output, description):
+    """ returns the filenames of an output saved with the stats of each
+        shard, or None when no shard has it
+        It raises ValueError when only some shards have it """
+    output_filenames = sorted({ compose_shard_filename(filename, output) for filename in filenames })
+    found = [ filename for filename in output_filenames if os.path.exists(filename) ]
+    if not found:
+        return None
+    if len(found) < len(output_filenames):
+        raise ValueError('Missing %s of the shards: %s' %
+                         (description, ', '.join(filename for filename in output_filenames if filename not in found)))
+    return found
+
+
+def load_shard_sketches(filenames):
+    """ returns the sketches of the shards of the stats filenames merged
+        in a dict, or None when the shards have no sketches
+        It raises ValueError when only some shards have them """
+    found = find_shard_outputs(filenames, 'sketches', 'sketches')
+    if found is None:
+        return None
+    sketches = {}
+    for filename in found:
+        shopsketch.load_sketches(filename, sketches)
+    return sketches
+
+
+def load_shard_malformed(filenames):
+    """ returns the malformed samples of the shards of the stats filenames
+        merged in a dict, or None when the shards have no samples
+        It raises ValueError when only some shards have them """
+    found = find_shard_outputs(filenames, 'malformed_entries', 'malformed entries')
+    if found is None:
+        return None
+    samples = {}
+    for filename in found:
+        shopmalformed.load_samples(filename, samples)
+    return samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merges the shopstats outputs of the shards of a period')
+    parser.add_argument('filenames', nargs='+', metavar='FILENAME',
+                        help='outputs of every shard, e.g. shopstats_201906_shard*of4.csv')
+    parser.add_argument('--format', nargs='+', choices=shopstats.stats_formats, default=['csv'], dest='formats',
+                        help='formats of the merged stats (default: csv)')
+    parser.add_argument('--chart-processes', type=int, metavar='N',
+                        help='processes rendering the charts (default: one per CPU)')
+    parser.add_argument('--chart-tile-rows', type=int, default=shopstats.chart_tile_rows, metavar='N',
+                        help='shops of each tile of the charts, 0 for single charts (default: %(default)s)')
+    arguments = parser.parse_args()
+    try:
+        period = check_shards(arguments.filenames)
+        sketches = load_shard_sketches(arguments.filenames)
+        malformed = load_shard_malformed(arguments.filenames)
+    except ValueError as error:
+        sys.exit(str(error))
+    logging.basicConfig(filename='%s.log'%sys.argv[0],level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    df = merge_shards([ load_shard(filename) for filename in arguments.filenames ])
+    chart_jobs = shopstats.save_period_outputs(df, period, sketches=sketches, formats=arguments.formats,
+                                               malformed=malformed, tile_rows=arguments.chart_tile_rows)
+    rendering = shopstats.render_charts(chart_jobs, processes=arguments.chart_processes)
+    for filename in rendering['chart_seconds']:
+        print("Chart saved at %s" % filename)
@@ -0,0 +1,200 @@
+"""
+    Instrumentation of the stages of shopstats
+
+    Metrics are counters and histograms identified by a name and labels,
+    e.g. request_seconds{nodepoint="products"}. They are exported as JSON
+    and as a Prometheus textfile (for the textfile collector of the node
+    exporter).
+"""
+import bisect
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+# upper bounds of the buckets of the histograms of seconds
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+# upper bounds of the buckets of the histograms of bytes
+BYTES_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 ** 2, 8 * 1024 ** 2, 64 * 1024 ** 2, 512 * 1024 ** 2)
+
+
+class Histogram:
+    """ distribution of the observed values in buckets """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [ 0 ] * (len(self.buckets) + 1)     # last one is +Inf
+        self.count = 0
+        self.sum = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        """ returns a list of (upper bound, observations <= upper bound) """
+        counts = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+    def to_dict(self):
+        return {
+                'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'min': self.min if self.count else None,
+                'max': self.max if self.count else None,
+                'buckets': { format_bound(bound): count for bound, count in self.cumulative_counts() },
+                }
+
+
+def format_bound(bound):
+    """ returns the bucket upper bound as Prometheus le label
+
+        >>> format_bound(0.5), format_bound(1024), format_bound(math.inf)
+        ('0.5', '1024', '+Inf')
+    """
+    if bound == math.inf:
+        return '+Inf'
+    return repr(bound)
+
+
+def format_labels(labels):
+    """ returns the labels in Prometheus format
+
+        >>> format_labels((('nodepoint', 'products'), ('stage', 'a"b')))
+        '{nodepoint="products",stage="a\\\\"b"}'
+    """
+    if not labels:
+        return ''
+    escaped = ( (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                for name, value in labels )
+    return '{%s}' % ','.join('%s="%s"' % item for item in escaped)
+
+
+class Metrics:
+    """ thread safe registry of counters and histograms """
+
+    def __init__(self, prefix='shopstats'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.definitions = {}
+        self.series = {}
+
+    def define(self, name, kind, description, buckets=SECONDS_BUCKETS, top=None):
+        """ defines a metric
+            :param kind: 'counter' or 'histogram'
+            :param buckets: upper bounds of the buckets of a histogram
+            :param top: when given, only the top series by value (counters)
+                        or by sum (histograms) are exported. For metrics
+                        with many labels, e.g. by shop
+        """
+        if kind not in ('counter', 'histogram'):
+            raise ValueError('Unknown kind of metric %s' % kind)
+        self.definitions[name] = { 'kind': kind, 'description': description, 'buckets': buckets, 'top': top }
+
+    def get_series(self, name, labels):
+        """ returns the series of the metric with the labels. Caller must hold the lock """
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.series:
+            definition = self.definitions[name]
+            self.series[key] = Histogram(definition['buckets']) if definition['kind'] == 'histogram' else 0
+        return key
+
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            key = self.get_series(name, labels)
+            self.series[key] += value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.series[self.get_series(name, labels)].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ observes the seconds spent in the with block """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """ returns the value of a counter or the Histogram of a series, None if missing """
+        with self.lock:
+            return self.series.get((name, tuple(sorted(labels.items()))))
+
+    def collect(self):
+        """ returns a dict name -> list of (labels, value or Histogram)
+            sorted by labels, or by value for the metrics with top """
+        with self.lock:
+            collected = { name: [] for name in self.definitions }
+            for (name, labels), value in self.series.items():
+                copied = value
+                if isinstance(value, Histogram):
+                    copied = Histogram(value.buckets)
+                    copied.__dict__.update(value.__dict__, counts=list(value.counts))
+                collected[name].append((labels, copied))
+        for name, series in collected.items():
+            top = self.definitions[name]['top']
+            if top:
+                series.sort(key=lambda item: item[1].sum if isinstance(item[1], Histogram) else item[1], reverse=True)
+                del series[top:]
+            else:
+                series.sort(key=lambda item: item[0])
+        return collected
+
+    def to_dict(self):
+        return {
+                name: {
+                    'kind': self.definitions[name]['kind'],
+                    'description': self.definitions[name]['description'],
+                    'series': [ dict(labels=dict(labels), **(value.to_dict() if isinstance(value, Histogram) else { 'value': value }))
+                                for labels, value in series ],
+                    }
+                for name, series in self.collect().items()
+                }
+
+    def to_prometheus(self):
+        """ returns the metrics in the Prometheus text exposition format """
+        lines = []
+        for name, series in self.collect().items():
+            definition = self.definitions[name]
+            full_name = '%s_%s' % (self.prefix, name)
+            lines.append('# HELP %s %s' % (full_name, definition['description']))
+            lines.append('# TYPE %s %s' % (full_name, definition['kind']))
+            for labels, value in series:
+                if not isinstance(value, Histogram):
+                    lines.append('%s%s %s' % (full_name, format_labels(labels), value))
+                    continue
+                for bound, count in value.cumulative_counts():
+                    lines.append('%s_bucket%s %s' % (full_name, format_labels(labels + (('le', format_bound(bound)),)), count))
+                lines.append('%s_sum%s %s' % (full_name, format_labels(labels), value.sum))
+                lines.append('%s_count%s %s' % (full_name, format_labels(labels), value.count))
+        return '\n'.join(lines) + '\n'
+
+    def save_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def save_prometheus(self, filename):
+        """ saves the textfile atomically, so the collector never reads it half written """
+        temporary = '%s.%s.tmp' % (filename, os.getpid())
+        with open(temporary, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, filename)
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
@@ -0,0 +1,213 @@
+#! /usr/bin/env python3
+"""
+    Mergeable sketches to estimate the number of distinct values of
+    raw nodepoints across shops, chains and runs.
+
+    When run as a script, it merges the sketches files given as
+    arguments and prints the distinct estimates of each chain and
+    of all the chains.
+"""
+import base64
+import hashlib
+import json
+import math
+import sys
+import zlib
+import numpy as np
+import pandas as pd
+
+# chain_id of the rollup row containing all the chains
+ALL_CHAINS = '*'
+
+
+class HyperLogLog:
+    """ HyperLogLog sketch of a set of values
+
+        >>> sketch = HyperLogLog(error=0.01)
+        >>> sketch.update('oid%s' % i for i in range(1000))
+        >>> abs(sketch.count() - 1000) < 30
+        True
+    """
+
+    def __init__(self, error=0.01, precision=None):
+        """ :param error: the expected relative error of the estimates
+            :param precision: log2 of the number of registers. Overrides error
+        """
+        if precision is None:
+            precision = math.ceil(math.log2((1.04 / error) ** 2))
+        if not 4 <= precision <= 18:
+            raise ValueError('HyperLogLog precision must be between 4 and 18: %s' % precision)
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @staticmethod
+    def hash(value):
+        """ returns a 64 bits hash of the value, stable across processes """
+        return int.from_bytes(hashlib.blake2b(repr(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        rest_bits = 64 - self.precision
+        hashed = self.hash(value)
+        index = hashed >> rest_bits
+        rank = rest_bits - (hashed & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """ adds the values of the other sketch to this one """
+        if other.precision != self.precision:
+            raise ValueError('Merging HyperLogLog sketches of different precision: %s and %s' % (self.precision, other.precision))
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """ returns the estimated number of distinct values """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)   # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def copy(self):
+        sketch = HyperLogLog(precision=self.precision)
+        sketch.registers[:] = self.registers
+        return sketch
+
+    def to_dict(self):
+        return {
+                'precision': self.precision,
+                'registers': base64.b64encode(zlib.compress(self.registers.tobytes())).decode('ascii'),
+                }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(precision=data['precision'])
+        sketch.registers[:] = np.frombuffer(zlib.decompress(base64.b64decode(data['registers'])), dtype=np.uint8)
+        return sketch
+
+
+class TDigest:
+    """ t-digest of the distribution of a set of values, to estimate their
+        quantiles with bounded memory. Values are buffered and merged into
+        at most about compression / 2 centroids, smaller near the tails
+
+        >>> digest = TDigest()
+        >>> digest.update(np.arange(1, 10001))
+        >>> abs(digest.quantile(0.5) - 5000) < 50, digest.quantile(0), digest.quantile(1)
+        (True, 1.0, 10000.0)
+    """
+
+    def __init__(self, compression=100, buffer_size=None):
+        self.compression = compression
+        self.buffer_size = buffer_size or 10 * compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.buffer.append(values)
+        self.buffered += len(values)
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        if self.buffered >= self.buffer_size:
+            self.compress()
+
+    def compress(self):
+        """ merges the buffered values into the centroids. Each centroid
+            covers at most a unit of the scale function
+            k(q) = compression / (2 pi) * asin(2q - 1) """
+        if not self.buffer:
+            return
+        means = np.concatenate([ self.means ] + self.buffer)
+        weights = np.concatenate([ self.weights, np.ones(self.buffered) ])
+        self.buffer = []
+        self.buffered = 0
+        order = np.argsort(means)
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        centers = (np.cumsum(weights) - weights / 2) / total
+        scale = self.compression / (2 * math.pi) * np.arcsin(2 * centers - 1)
+        # scale is increasing: consecutive values in the same unit are merged
+        units = np.floor(scale - scale[0])
+        clusters = np.concatenate(([ 0 ], np.cumsum(units[1:] != units[:-1])))
+        self.weights = np.bincount(clusters, weights=weights)
+        self.means = np.bincount(clusters, weights=means * weights) / self.weights
+
+    def quantile(self, q):
+        """ returns the estimated value of the quantile q (0 to 1) """
+        self.compress()
+        if not self.count:
+            return math.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([ 0 ], centers, [ self.count ]))
+        values = np.concatenate(([ self.min ], self.means, [ self.max ]))
+        return float(np.interp(q * self.count, positions, values))
+
+
+def save_sketches(filename, sketches):
+    """ saves the sketches as a JSON line for each
+        (chain_id, shop_id, nodepoint) -> HyperLogLog """
+    with open(filename, 'w') as f:
+        for (chain_id, shop_id, nodepoint), sketch in sketches.items():
+            line = dict(sketch.to_dict(), chain_id=chain_id, shop_id=shop_id, nodepoint=nodepoint)
+            f.write(json.dumps(line) + '\n')
+
+
+def load_sketches(filename, sketches=None):
+    """ loads the sketches saved by save_sketches() and merges them into
+        the given sketches dict. It returns the sketches """
+    sketches = {} if sketches is None else sketches
+    with open(filename) as f:
+        for line in f:
+            data = json.loads(line)
+            key = (data['chain_id'], data['shop_id'], data['nodepoint'])
+            sketch = HyperLogLog.from_dict(data)
+            if key in sketches:
+                sketches[key].merge(sketch)
+            else:
+                sketches[key] = sketch
+    return sketches
+
+
+def rollup(sketches):
+    """ merges the sketches of each chain and of all the chains
+        returns a DataFrame with a row for each chain and a last row
+        for ALL_CHAINS, with a column <nodepoint>_distinct_estimate
+        for each nodepoint
+    """
+    merged = {}
+    for (chain_id, _, nodepoint), sketch in sketches.items():
+        for key in ((chain_id, nodepoint), (ALL_CHAINS, nodepoint)):
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = sketch.copy()
+    chains = sorted({ chain_id for chain_id, _ in merged if chain_id != ALL_CHAINS }) + [ ALL_CHAINS ]
+    nodepoints = sorted({ nodepoint for _, nodepoint in merged })
+    rows = [ [ chain_id ] + [ merged[(chain_id, nodepoint)].count() if (chain_id, nodepoint) in merged else np.nan
+                              for nodepoint in nodepoints ]
+             for chain_id in chains ]
+    return pd.DataFrame(rows, columns=[ 'chain_id' ] + [ '%s_distinct_estimate' % nodepoint for nodepoint in nodepoints ])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: %s «sketches filename.jsonl»..." % sys.argv[0])
+        sys.exit(1)
+    sketches = {}
+    for filename in sys.argv[1:]:
+        load_sketches(filename, sketches)
+    print(rollup(sketches).to_string(index=False))
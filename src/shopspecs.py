@@ -0,0 +1,405 @@
+"""
+    Nodepoint specs: loading, validation and compilation
+
+    The nodepoint specs are read from a JSON file (nodepoints.json by
+    default), a list of specs such as
+        { "name": "sales", "type": "aggregation", "aggregation_key": "billing",
+          "subkey": null, "column_suffix": "billing", "aggregations": [ "mean", "p90" ] }
+    - raw specs count the entries and their distinct equality_key
+    - aggregation specs count the entries of the subkey of each entry (or
+      the entries themselves when subkey is null) and sum their
+      aggregation_key, and optionally the extra aggregations of their
+      values (mean, min, max, quantiles, refunds...), computed in the
+      same pass
+    Keys are key paths: nested keys are separated by dots, e.g.
+    "amounts.billing".
+
+    By default, the entries of a spec are requested to the endpoint of its
+    name. Specs with other names may share an endpoint with the optional
+    "endpoint" key, and add query params with "params", e.g.
+        { "name": "tickets-sales", "endpoint": "tickets", "type": "aggregation", ... }
+    Specs of the same endpoint and params share their requests.
+
+    Each spec is validated and compiled once into a CompiledSpec, whose
+    extractors are functions specialised for its key paths.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import numpy as np
+import shoplog
+import shopsketch
+
+# types of nodepoints
+SPEC_TYPES = ('raw', 'aggregation')
+
+# query params of the period of the requests, which the params of a spec
+# can't override
+PERIOD_PARAMS = ('dateStart', 'dateEnd', 'dateRange')
+
+# extra aggregations of the values of the aggregation nodepoints
+# - mean, min, max and sum of squares of the values
+# - refunds: number of negative values
+# - zeros: number of zero values
+# - pNN: quantile NN (0 < NN < 100, e.g. p50, p99.9) estimated with a
+#   shopsketch.TDigest
+AGGREGATIONS = ('mean', 'min', 'max', 'sum_squares', 'refunds', 'zeros')
+
+# compression of the digests of the quantiles
+QUANTILES_COMPRESSION = 100
+
+# specs file loaded by default
+DEFAULT_SPECS_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nodepoints.json')
+
+
+def sum_sequentially(values, start=0):
+    """ returns start plus the sum of the values as computed by adding
+        them one after the other, as shopbench.compute_aggregated_entries()
+        does
+
+        >>> sum_sequentially([1, 2, 3])
+        6
+        >>> sum_sequentially([0.1, 0.2, 0.3]) == 0.1 + 0.2 + 0.3
+        True
+        >>> sum_sequentially([0.2, 0.3], start=0.1) == 0.1 + 0.2 + 0.3
+        True
+        >>> sum_sequentially([])
+        0
+    """
+    if len(values) == 0:
+        return start
+    array = np.asarray(values)
+    if array.dtype.kind in 'iu' and isinstance(start, int) and \
+            np.abs(array).max() < np.iinfo(np.int64).max // len(array):
+        return start + int(array.sum())
+    if array.dtype.kind == 'f' or (array.dtype.kind in 'iu' and isinstance(start, float)):
+        # accumulate adds in order, unlike sum(), which adds pairwise
+        if start != 0:
+            array = np.concatenate(([ float(start) ], array.astype(np.float64)))
+        return float(np.add.accumulate(array, dtype=np.float64)[-1])
+    aggregation = start
+    for value in values:
+        aggregation += value
+    return aggregation
+
+
+def parse_path(path):
+    """ returns the keys of a key path
+
+        >>> parse_path('amounts.billing')
+        ('amounts', 'billing')
+    """
+    keys = tuple(path.split('.'))
+    if not all(keys):
+        raise ValueError('Invalid key path %r' % path)
+    return keys
+
+
+def compile_extractor(path):
+    """ returns a function that given a list of entries returns the list
+        of values at the key path of the entries having it
+
+        >>> compile_extractor('a.b')([ { 'a': { 'b': 1 } }, { 'a': 2 }, { 'b': 3 } ])
+        [1]
+    """
+    keys = parse_path(path)
+    first = keys[0]
+    if len(keys) == 1:
+        def extract(entries):
+            return [ entry[first] for entry in entries if first in entry ]
+        return extract
+    rest = keys[1:]
+
+
+    def extract_nested(entries):
+        values = [ entry[first] for entry in entries if first in entry ]
+        for key in rest:
+            values = [ value[key] for value in values if isinstance(value, dict) and key in value ]
+        return values
+    return extract_nested
+
+
+def compile_predicate(path):
+    """ returns a function returning whether an entry has the key path
+
+        >>> has_billing = compile_predicate('amounts.billing')
+        >>> has_billing({ 'amounts': { 'billing': 1 } }), has_billing({ 'amounts': 1 })
+        (True, False)
+    """
+    keys = parse_path(path)
+    first = keys[0]
+    if len(keys) == 1:
+        return lambda entry: first in entry
+    rest = keys[1:]
+
+
+    def has_path(entry):
+        if first not in entry:
+            return False
+        value = entry[first]
+        for key in rest:
+            if not isinstance(value, dict) or key not in value:
+                return False
+            value = value[key]
+        return True
+    return has_path
+
+
+def parse_quantile(aggregation):
+    """ returns the quantile (0 to 1) of a pNN aggregation, None when it's
+        not a quantile
+
+        >>> parse_quantile('p90'), parse_quantile('p99.9'), parse_quantile('max')
+        (0.9, 0.999, None)
+    """
+    m = re.fullmatch(r'p(\d{1,2}(\.\d+)?)', aggregation)
+    if not m or not 0 < float(m.group(1)) < 100:
+        return None
+    return round(float(m.group(1)) / 100, 10)
+
+
+def aggregation_order(aggregation):
+    """ returns the sort key of the aggregations as shown in the stats:
+        mean, min, the quantiles, max, and the rest
+
+        >>> sorted([ 'zeros', 'max', 'p99', 'mean', 'p50', 'min' ], key=aggregation_order)
+        ['mean', 'min', 'p50', 'p99', 'max', 'zeros']
+    """
+    quantile = parse_quantile(aggregation)
+    if quantile is not None:
+        return (2, quantile)
+    order = { 'mean': 0, 'min': 1, 'max': 3 }
+    return (order.get(aggregation, 4), AGGREGATIONS.index(aggregation) if aggregation in AGGREGATIONS else 0)
+
+
+def validate_spec(spec):
+    """ raises ValueError when the spec is not valid """
+    name = spec.get('name')
+    if not isinstance(name, str) or not name:
+        raise ValueError('Nodepoint spec without name: %s' % spec)
+    if spec.get('type') not in SPEC_TYPES:
+        raise ValueError('Nodepoint spec %s: type must be one of %s' % (name, ', '.join(SPEC_TYPES)))
+    if not isinstance(spec.get('column_suffix'), str) or not spec['column_suffix']:
+        raise ValueError('Nodepoint spec %s: column_suffix is required' % name)
+    paths = [ 'equality_key' ] if spec['type'] == 'raw' else [ 'aggregation_key' ]
+    if spec['type'] == 'aggregation' and spec.get('subkey') is not None:
+        paths.append('subkey')
+    for path in paths:
+        if not isinstance(spec.get(path), str):
+            raise ValueError('Nodepoint spec %s: %s is required' % (name, path))
+        try:
+            parse_path(spec[path])
+        except ValueError as e:
+            raise ValueError('Nodepoint spec %s: %s' % (name, e))
+    endpoint = spec.get('endpoint', name)
+    if not isinstance(endpoint, str) or not endpoint:
+        raise ValueError('Nodepoint spec %s: endpoint must be a non empty string' % name)
+    params = spec.get('params', {})
+    if not isinstance(params, dict) or not all(isinstance(value, (str, int, float)) for value in params.values()):
+        raise ValueError('Nodepoint spec %s: params must be an object of strings or numbers' % name)
+    overridden = sorted(set(params) & set(PERIOD_PARAMS))
+    if overridden:
+        raise ValueError('Nodepoint spec %s: params can not override the period params %s' % (name, ', '.join(overridden)))
+    aggregations = spec.get('aggregations', [])
+    if aggregations and spec['type'] != 'aggregation':
+        raise ValueError('Nodepoint spec %s: only aggregation nodepoints have aggregations' % name)
+    unknown = { aggregation for aggregation in aggregations
+                if aggregation not in AGGREGATIONS and parse_quantile(aggregation) is None }
+    if unknown or len(set(aggregations)) != len(aggregations):
+        raise ValueError('Nodepoint spec %s: aggregations must be distinct of %s or pNN quantiles'
+                         % (name, ', '.join(AGGREGATIONS)))
+
+
+def load_specs(filename=DEFAULT_SPECS_FILENAME):
+    """ returns the list of nodepoint specs of the JSON file
+        It raises ValueError when some spec is not valid """
+    with open(filename) as f:
+        specs = json.load(f)
+    if not isinstance(specs, list):
+        raise ValueError('Nodepoint specs must be a list: %s' % filename)
+    compile_specs(specs)
+    return specs
+
+
+def add_malformed(compiled, malformed_sample, entries, is_wellformed, key):
+    """ adds the entries without the key to the malformed_sample, when
+        given, and logs them in DEBUG """
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if malformed_sample is None and not debug:
+        return
+    malformed_entries = [ entry for entry in entries if not is_wellformed(entry) ]
+    if malformed_sample is not None:
+        malformed_sample.update(malformed_entries, key)
+    if debug:
+        for entry in malformed_entries:
+            logging.debug("Entry of nodepoint %s doesn't contain %s: %s", compiled.name, key, shoplog.Payload(entry),
+                          extra=shoplog.RATE_LIMITED)
+
+
+class RawAccumulator:
+    """ counters of the entries of a raw nodepoint, updated with lists of
+        entries """
+
+    def __init__(self, compiled, malformed_sample=None, sketch=None):
+        self.compiled = compiled
+        self.malformed_sample = malformed_sample
+        self.sketch = sketch
+        self.identity_values = set()
+        self.counter = 0
+        self.malformed = 0
+
+    def update(self, entries):
+        compiled = self.compiled
+        values = compiled.extract_identity(entries)
+        self.counter += len(values)
+        if len(values) < len(entries):
+            self.malformed += len(entries) - len(values)
+            add_malformed(compiled, self.malformed_sample, entries, compiled.has_identity, compiled.equality_key)
+        if self.sketch is not None:
+            self.sketch.update(values)
+        self.identity_values.update(values)
+
+    def counters(self):
+        return self.counter, len(self.identity_values), self.malformed
+
+
+class AggregationAccumulator:
+    """ counters of the entries of an aggregation nodepoint, updated with
+        lists of entries """
+
+    def __init__(self, compiled, malformed_sample=None, sketch=None):
+        self.compiled = compiled
+        self.malformed_sample = malformed_sample
+        self.counter = 0
+        self.aggregation = 0
+        self.malformed = 0
+        self.extra = { 'min': None, 'max': None, 'sum_squares': 0, 'refunds': 0, 'zeros': 0 }
+        self.digest = shopsketch.TDigest(QUANTILES_COMPRESSION) if compiled.quantiles else None
+
+    def update(self, entries):
+        compiled = self.compiled
+        if compiled.subkey:
+            subentry_lists = compiled.extract_subentries(entries)
+            if len(subentry_lists) < len(entries):
+                self.malformed += len(entries) - len(subentry_lists)
+                add_malformed(compiled, self.malformed_sample, entries, compiled.has_subentries, compiled.subkey)
+            entries = list(itertools.chain.from_iterable(subentry_lists))
+        values = compiled.extract_value(entries)
+        if len(values) < len(entries):
+            self.malformed += len(entries) - len(values)
+            add_malformed(compiled, self.malformed_sample, entries, compiled.has_value, compiled.aggregation_key)
+        self.counter += len(values)
+        self.aggregation = sum_sequentially(values, self.aggregation)
+        if not values or not compiled.aggregations:
+            return
+        # the extra aggregations are computed on a single array of the values
+        array = np.asarray(values, dtype=np.float64)
+        extra = self.extra
+        for aggregation in compiled.aggregations:
+            if aggregation == 'min':
+                extra['min'] = float(array.min()) if extra['min'] is None else min(extra['min'], float(array.min()))
+            elif aggregation == 'max':
+                extra['max'] = float(array.max()) if extra['max'] is None else max(extra['max'], float(array.max()))
+            elif aggregation == 'sum_squares':
+                extra['sum_squares'] = sum_sequentially(array * array, extra['sum_squares'])
+            elif aggregation == 'refunds':
+                extra['refunds'] += int(np.count_nonzero(array < 0))
+            elif aggregation == 'zeros':
+                extra['zeros'] += int(np.count_nonzero(array == 0))
+        if self.digest is not None:
+            self.digest.update(array)
+
+    def get_aggregation(self, aggregation):
+        """ returns the value of an extra aggregation, NaN when it's
+            undefined for the entries, e.g. the mean of no entries """
+        if aggregation == 'mean':
+            return self.aggregation / self.counter if self.counter else np.nan
+        quantile = parse_quantile(aggregation)
+        if quantile is not None:
+            return self.digest.quantile(quantile)
+        value = self.extra[aggregation]
+        return np.nan if value is None else value
+
+    def counters(self):
+        extra = tuple(self.get_aggregation(aggregation) for aggregation in self.compiled.aggregations)
+        return (self.counter, self.aggregation, self.malformed) + extra
+
+
+class CompiledSpec:
+    """ validated nodepoint spec with the extractors of its key paths """
+
+    def __init__(self, spec):
+        validate_spec(spec)
+        self.spec = spec
+        self.name = spec['name']
+        self.type = spec['type']
+        self.endpoint = spec.get('endpoint', self.name)
+        self.params = dict(spec.get('params', {}))
+        # specs with the same fetch_key share their requests
+        self.fetch_key = (self.endpoint, json.dumps(self.params, sort_keys=True))
+        # changes whenever the spec changes its counters
+        self.digest = hashlib.blake2b(json.dumps(spec, sort_keys=True).encode('utf-8'), digest_size=8).hexdigest()
+        self.aggregations = tuple(spec.get('aggregations', ()))
+        self.quantiles = [ aggregation for aggregation in self.aggregations if parse_quantile(aggregation) is not None ]
+        if self.type == 'raw':
+            self.equality_key = spec['equality_key']
+            self.extract_identity = compile_extractor(self.equality_key)
+            self.has_identity = compile_predicate(self.equality_key)
+        else:
+            self.subkey = spec.get('subkey')
+            if self.subkey:
+                self.extract_subentries = compile_extractor(self.subkey)
+                self.has_subentries = compile_predicate(self.subkey)
+            self.aggregation_key = spec['aggregation_key']
+            self.extract_value = compile_extractor(self.aggregation_key)
+            self.has_value = compile_predicate(self.aggregation_key)
+
+    def accumulator(self, malformed_sample=None, sketch=None):
+        """ returns the accumulator of the counters of the entries
+            :param malformed_sample: shopmalformed.MalformedSample where the
+                                     malformed entries are added
+            :param sketch: shopsketch.HyperLogLog where the identity values
+                           of a raw nodepoint are added
+        """
+        accumulator_class = RawAccumulator if self.type == 'raw' else AggregationAccumulator
+        return accumulator_class(self, malformed_sample=malformed_sample, sketch=sketch)
+
+    def process(self, entries, malformed_sample=None, sketch=None):
+        """ returns the counters of the list of entries as a tuple
+            - number of items in the nodepoint
+            - number of distinct items (raw) or aggregated value (aggregation)
+            - number of malformed items
+            - the extra aggregations, NaN when there are no items
+        """
+        accumulator = self.accumulator(malformed_sample=malformed_sample, sketch=sketch)
+        accumulator.update(entries)
+        return accumulator.counters()
+
+
+# compiled specs by their JSON
+compiled_specs = {}
+
+
+def compile_spec(spec):
+    """ returns the CompiledSpec of the spec, compiled once
+        It raises ValueError when the spec is not valid """
+    key = json.dumps(spec, sort_keys=True)
+    compiled = compiled_specs.get(key)
+    if compiled is None:
+        compiled = compiled_specs[key] = CompiledSpec(spec)
+    return compiled
+
+
+def compile_specs(specs):
+    """ returns the list of CompiledSpec of the specs
+        It raises ValueError when some spec is not valid or their names
+        are repeated """
+    compiled = [ compile_spec(spec) for spec in specs ]
+    names = [ spec.name for spec in compiled ]
+    repeated = sorted({ name for name in names if names.count(name) > 1 })
+    if repeated:
+        raise ValueError('Repeated nodepoint specs: %s' % ', '.join(repeated))
+    return compiled
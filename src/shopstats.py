@@ -5,13 +5,50 @@
 from typing import Dict
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import logging
 import datetime
+import hashlib
+import html
+import itertools
+import os
 import sys
+import argparse
+import concurrent.futures
+import threading
+import time
+import resource
+import importlib.util
+import urllib.parse
+import shopcache
+import shopjson
+import shopjournal
+import shoplimit
+import shoplog
+import shopmalformed
+import shopmetrics
+import shopsketch
+import shopspecs
+import shopstore
+
+# Instrumentation of the stages of the run. See shopmetrics
+metrics = shopmetrics.Metrics()
+metrics.define('stage_seconds', 'histogram', 'Seconds spent in each stage of the run')
+metrics.define('request_seconds', 'histogram', 'Seconds until the response of the API is received, by nodepoint')
+metrics.define('response_bytes', 'histogram', 'Bytes of the responses of the API, by nodepoint',
+               buckets=shopmetrics.BYTES_BUCKETS)
+metrics.define('decode_seconds', 'histogram', 'Seconds decoding the JSON responses, by nodepoint')
+metrics.define('decoded_bytes', 'counter', 'Bytes of the decoded JSON responses, by nodepoint')
+metrics.define('compute_seconds', 'histogram', 'Seconds computing the counters of the entries, by nodepoint. '
+                                               'When streaming, it includes receiving and decoding them')
+metrics.define('entries', 'counter', 'Entries received, by nodepoint')
+metrics.define('errors', 'counter', 'Nodepoints whose counters could not be computed, by nodepoint')
+metrics.define('deduplicated_requests', 'counter', 'Requests saved by sharing them among the nodepoints of the same endpoint')
+metrics.define('shop_seconds', 'counter', 'Seconds computing the nodepoints of the 20 slowest shops', top=20)
+metrics.define('chart_seconds', 'histogram', 'Seconds rendering each chart')
 
 # File containing bitphy api connection params
 api_params_filename = 'bitphyaccess.json'
@@ -19,136 +56,441 @@ api_params_filename = 'bitphyaccess.json'
 # it contains the api parameters obtained from the api_params_filename
 api_params = None
 
+# File containing the nodepoint specs. See shopspecs
+nodepoint_specs_filename = shopspecs.DEFAULT_SPECS_FILENAME
+
 # Types of nodepoints are:
 #   'raw': intended for raw nodepoints.
-#   'sales': intended for sales nodepoints.
-nodepoint_specs = [
-        { "name": "customers"                , "type": "raw"         , "equality_key": "originalId" , "column_suffix": "distinct" }    ,
-        { "name": "product-categories"       , "type": "raw"         , "equality_key": "originalId" , "column_suffix": "distinct" }    ,
-        { "name": "products"                 , "type": "raw"         , "equality_key": "originalId" , "column_suffix": "distinct" }    ,
-        { "name": "sellers"                  , "type": "raw"         , "equality_key": "originalId" , "column_suffix": "distinct" }    ,
-        { "name": "tickets"                  , "type": "raw"         , "equality_key": "originalId" , "column_suffix": "distinct" }    ,
-        { "name": "customers/sales"          , "type": "aggregation" , "aggregation_key": "billing" , "subkey": "sales"                , "column_suffix": "billing" } ,
-        { "name": "product-categories/sales" , "type": "aggregation" , "aggregation_key": "billing" , "subkey": "productCategorySales" , "column_suffix": "billing" } ,
-        { "name": "products/sales"           , "type": "aggregation" , "aggregation_key": "billing" , "subkey": "productSales"         , "column_suffix": "billing" } ,
-        { "name": "sales"                    , "type": "aggregation" , "aggregation_key": "billing" , "subkey": None                   , "column_suffix": "billing" } ,
-        { "name": "sellers/sales"            , "type": "aggregation" , "aggregation_key": "billing" , "subkey": "sales"                , "column_suffix": "billing" } ,
-        ]
-
-# Functions to process different types of entries
-
-
-def compute_raw_entries(nodepoint_spec, entries):
-    """ Computes the counters of a given raw nodepoint entries
-        returns counters as a tuple
-        - number of items in the nodepoint
-        - number of distinct items
-        - number of malformed items. i.e. those not containing the identity key
-
-        Note: the nodepoint_spec is not required for processing raw nodepoints.
-        However it is included to uniform processing functions
-    """
-    nodepoint_equality_key = nodepoint_spec['equality_key']
-    identity_values = [ entry[nodepoint_equality_key] for entry in entries if nodepoint_equality_key in entry ]
-    counter = len(identity_values)
-    distinct = len(set(identity_values))
-    malformed = len(entries) - len(identity_values)
-    return counter, distinct, malformed
-
-
-def compute_aggregated_entries(nodepoint_spec, entries):
-    """ Computes the counters of a given aggregated nodepoint entries
-        returns counters as a tuple
-        - number of items in the nodepoint
-        - the aggregated value of the entries as defined by the nodepoint_specs
-        - number of malformed items. i.e. those not containing the identity key
-    """
-    counter = 0
-    aggregation = 0
-    malformed = 0
-    if nodepoint_spec['subkey']:
-        # getting actual subentries
-        subentries = []
-        for entry in entries:
-            if nodepoint_spec['subkey'] not in entry:
-                logging.warning("Entry for node %s doesn't contin expected subkey %s: %s" % (nodepoint_spec['name'], nodepoint_spec['subkey'], entry))
-                malformed += 1
-                continue
-            subentries += entry[nodepoint_spec['subkey']]
-    else:
-        subentries = entries
+#   'aggregation': intended for sales nodepoints.
+# They're loaded from nodepoint_specs_filename by get_nodepoint_specs()
+nodepoint_specs = None
 
-    # aggregating subentries
-    for entry in subentries:
-        if nodepoint_spec['aggregation_key'] not in entry:
-            logging.warning("Entry for nodepoint %s doesn't contain aggregation key %s: %s" % (nodepoint_spec['name'], nodepoint_spec['aggregation_key'], entry))
-            malformed += 1
-            continue
-        aggregation += entry[nodepoint_spec['aggregation_key']]
-        counter += 1
+# Query string to define the parameters for the queries
+# ATTENTION: some queries do not need all the params included in this query
+querystring = None
 
-    return counter, aggregation, malformed
 
+def get_next_month(period):
+    """ returns the first day of the month following the period
 
-entries_processors = {
-        'raw': compute_raw_entries,
-        'aggregation': compute_aggregated_entries,
-        }
+        >>> get_next_month(datetime.date(2019, 6, 1))
+        datetime.date(2019, 7, 1)
+        >>> get_next_month(datetime.date(2019, 12, 1))
+        datetime.date(2020, 1, 1)
+    """
+    if period.month == 12:
+        return period.replace(year=period.year + 1, month=1, day=1)
+    return period.replace(month=period.month + 1, day=1)
 
 
-# Query string to define the parameters for the queries
-# ATTENTION: some queries do not need all the params included in this query
-querystring = None
+def iter_periods(first_period, last_period):
+    """ yields the first day of each month from first_period to last_period,
+        both included
 
+        >>> [ period.strftime('%Y%m') for period in iter_periods(datetime.date(2019, 11, 1), datetime.date(2020, 2, 1)) ]
+        ['201911', '201912', '202001', '202002']
+    """
+    period = first_period.replace(day=1)
+    while period <= last_period:
+        yield period
+        period = get_next_month(period)
 
-def get_querystring():
-    """ returns the query params
-        dateStart: first day of this month
+
+def parse_period(text):
+    """ returns the period (first day of the month) of a YYYYMM or YYYY-MM text
+
+        >>> parse_period('2019-06')
+        datetime.date(2019, 6, 1)
+        >>> parse_period('201912')
+        datetime.date(2019, 12, 1)
+    """
+    return datetime.datetime.strptime(text.replace('-', ''), '%Y%m').date()
+
+
+def compose_querystring(period):
+    """ returns the query params for the month of the given period
+        dateStart: first day of the month
         dateEnd: first day of next month
         dateRange: 3 (monthly date only)
     """
+    first_day_this_month = period.replace(day=1)
+    return {"dateStart": first_day_this_month, "dateEnd": get_next_month(first_day_this_month), "dateRange": "3"}
+
+
+def get_querystring():
+    """ returns the query params for the current month
+        See compose_querystring()
+    """
     global querystring
     if not querystring:
-        today = datetime.date.today()
-        first_day_this_month = today.replace(day=1)
-        first_day_next_month = first_day_this_month.replace(month=(today.month % 12 + 1))
-        querystring = {"dateStart": first_day_this_month, "dateEnd":first_day_next_month, "dateRange":"3"}
+        querystring = compose_querystring(datetime.date.today())
     return querystring
 
+
+def get_current_period():
+    """ returns the first day of the current month """
+    return get_querystring()['dateStart']
+
+
+def get_period_title(period):
+    """ returns the month and year of the period
+        e.g. June 2019
+    """
+    return period.strftime('%B %Y')
+
+
 def get_current_month_as_title():
     """ returns current month and year
         e.g. June 2019
     """
-    return get_querystring()['dateStart'].strftime('%B %Y')
+    return get_period_title(get_current_period())
 
 # filenames for the different outputs
 filename_templates = {
         'csv': 'shopstats_%s.csv',
+        'feather': 'shopstats_%s.feather',
+        'parquet': 'shopstats_%s.parquet',
         'malformed_chart': 'malformed_%s.png',
         'billing_chart': 'billing_%s.png',
         'dup_chart': 'distinct_%s.png',
+        'chart_index': 'charts_%s.html',
+        'sketches': 'sketches_%s.jsonl',
+        'rollup_csv': 'distinct_rollup_%s.csv',
+        'malformed_entries': 'malformed_entries_%s.jsonl',
         }
 
-def get_filename(base):
-    """ returns the required filename composed with the month and year """
-    return filename_templates[base] % get_querystring()['dateStart'].strftime('%Y%m')
+def get_filename(base, period=None):
+    """ returns the required filename composed with the month and year
+        of the period. By default, the current period """
+    return filename_templates[base] % (period or get_current_period()).strftime('%Y%m')
 
 
 # requests modules
 def response_is_ok(response):
     """ returns True when
+        - there is a response and
         - response status code is ok and
         - contents type is json
     """
+    if response is None:
+        return False
     if not (response.status_code < 400):
-        logging.warning("\tResponse code is not ok: %s" % response.headers)
+        logging.warning("\tResponse code is not ok: %s", response.headers, extra=shoplog.RATE_LIMITED)
         return False
     if response.headers.get('content-type') != 'application/json; charset=utf-8':
-        logging.warning("\tResponse content type is not ok: %s" % response.headers)
+        logging.warning("\tResponse content type is not ok: %s", response.headers, extra=shoplog.RATE_LIMITED)
         return False
     return True
 
 
+# Parameters of the HTTP connection pool shared by all the requests to the API
+#   pool_size: number of connections kept alive. It should match the number of workers
+#   retries: number of retries on 5xx responses, timeouts and connection resets
+#   backoff_factor: the n-th retry waits backoff_factor * 2 ** (n - 1) seconds
+#   timeout: seconds to wait for the connection and for the response
+http_pool_params = {
+        'pool_size': 10,
+        'retries': 3,
+        'backoff_factor': 0.5,
+        'timeout': 60,
+        }
+
+# HTTP session shared by all the requests to the API. See get_session()
+session = None
+
+# Limits of the requests to each host. See configure_scheduler()
+#   max_in_flight: maximum requests in flight. By default, the pool_size
+#   rate, burst: maximum requests per second and bursts. By default, unlimited
+#   host_limits: dict host -> dict of shoplimit.HostLimiter params for the host
+scheduler_params = {
+        'max_in_flight': None,
+        'rate': None,
+        'burst': None,
+        'host_limits': {},
+        }
+
+# Scheduler shared by all the requests to the API. See get_scheduler()
+scheduler = None
+
+# counters of the HTTP activity not tracked by the connection pool
+http_stats = { 'requests': 0, 'retries': 0, 'errors': 0 }
+http_stats_lock = threading.Lock()
+
+
+def count_http_stat(name, value=1):
+    """ increments the given http_stats counter """
+    with http_stats_lock:
+        http_stats[name] += value
+
+
+class CountingRetry(Retry):
+    """ Retry policy that counts each retry in http_stats """
+
+    def increment(self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)
+        count_http_stat('retries')
+        return retry
+
+
+def configure_session(**params):
+    """ updates the http_pool_params with the given params
+        The shared session is rebuilt on next get_session()
+    """
+    global session, scheduler
+    unknown = set(params) - set(http_pool_params)
+    if unknown:
+        raise ValueError('Unknown HTTP pool params: %s' % ', '.join(sorted(unknown)))
+    http_pool_params.update(params)
+    if session:
+        session.close()
+    session = None
+    scheduler = None
+
+
+def get_session():
+    """ returns the HTTP session shared by all the requests to the API
+        Connections are kept alive in a pool of http_pool_params['pool_size']
+        and failed requests are retried with exponential backoff.
+        Throttled requests (429, 503) are retried by api_request()
+    """
+    global session
+    if not session:
+        retries = CountingRetry(
+                total=http_pool_params['retries'],
+                backoff_factor=http_pool_params['backoff_factor'],
+                status_forcelist=(500, 502, 504),
+                respect_retry_after_header=False,   # throttling is handled by api_request()
+                allowed_methods=('GET',),
+                raise_on_status=False)  # last response is checked by response_is_ok()
+        adapter = HTTPAdapter(
+                pool_connections=http_pool_params['pool_size'],
+                pool_maxsize=http_pool_params['pool_size'],
+                max_retries=retries)
+        new_session = requests.Session()
+        new_session.mount('http://', adapter)
+        new_session.mount('https://', adapter)
+        session = new_session
+    return session
+
+
+def configure_scheduler(**params):
+    """ updates the scheduler_params with the given params
+        The shared scheduler is rebuilt on next get_scheduler()
+    """
+    global scheduler
+    unknown = set(params) - set(scheduler_params)
+    if unknown:
+        raise ValueError('Unknown scheduler params: %s' % ', '.join(sorted(unknown)))
+    scheduler_params.update(params)
+    scheduler = None
+
+
+def get_scheduler():
+    """ returns the shoplimit.RequestScheduler shared by all the requests to the API """
+    global scheduler
+    if not scheduler:
+        scheduler = shoplimit.RequestScheduler(
+                max_window=scheduler_params['max_in_flight'] or http_pool_params['pool_size'],
+                rate=scheduler_params['rate'],
+                burst=scheduler_params['burst'],
+                host_limits=scheduler_params['host_limits'])
+    return scheduler
+
+
+def parse_rate(text):
+    """ returns the positive requests per second of the text
+
+        >>> parse_rate('2.5')
+        2.5
+    """
+    try:
+        rate = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('rate must be a number of requests per second: %s' % text)
+    if not rate > 0 or rate == float('inf'):
+        raise argparse.ArgumentTypeError('rate must be positive: %s' % text)
+    return rate
+
+
+def get_throttling_pause(response, attempt):
+    """ returns the seconds to wait before retrying a throttled request:
+        its Retry-After or else the exponential backoff of the attempt """
+    retry_after = shoplimit.parse_retry_after(response.headers.get('retry-after'))
+    if retry_after is not None:
+        return retry_after
+    return http_pool_params['backoff_factor'] * 2 ** attempt
+
+
+def get_http_stats():
+    """ returns a dict with the counters of the HTTP activity
+        - requests: number of requests sent to the API
+        - retries: number of retries
+        - errors: number of requests failing after the retries
+        - connections: number of connections opened
+        - reused_connections: number of requests sent through an already open connection
+        - in_flight, queued: requests being sent and waiting for the scheduler
+        - throttled: number of responses throttling the requests (429, 503)
+    """
+    with http_stats_lock:
+        stats = dict(http_stats)
+    connections = 0
+    pool_requests = 0
+    if session:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+    stats['connections'] = connections
+    stats['reused_connections'] = pool_requests - connections
+    scheduler_stats = scheduler.get_stats() if scheduler else {}
+    for name in ('in_flight', 'queued', 'throttled'):
+        stats[name] = scheduler_stats.get(name, 0)
+    return stats
+
+
+# Persistent cache of the API responses. See configure_response_cache()
+response_cache = None
+
+
+class CachedResponse:
+    """ response to a request served from the response_cache """
+
+    status_code = 200
+
+    def __init__(self, entry):
+        self.headers = { 'content-type': entry.content_type }
+        self.content = entry.body
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+def configure_response_cache(filename=None, **params):
+    """ enables the persistent cache of the API responses stored at filename
+        params are passed to shopcache.ResponseCache (max_bytes, ttl)
+        Without filename the cache is disabled.
+    """
+    global response_cache
+    if response_cache:
+        response_cache.close()
+    response_cache = shopcache.ResponseCache(filename, **params) if filename else None
+
+
+def period_is_closed(params):
+    """ returns True when the query params refer to an already finished period
+
+        >>> period_is_closed({ 'dateEnd': datetime.date(2019, 7, 1) })
+        True
+        >>> period_is_closed(None)
+        False
+    """
+    date_end = (params or {}).get('dateEnd')
+    return date_end is not None and date_end <= datetime.date.today()
+
+
+def hold_ticket_while_streaming(response, host, ticket):
+    """ keeps the scheduler ticket of a streamed response until its body
+        is iterated to the end, so the requests in flight bound the bodies
+        being received. The response gets a release_ticket() to release
+        it sooner, e.g. when the body won't be iterated """
+    released = threading.Lock()
+
+    def release_ticket():
+        if released.acquire(blocking=False):
+            get_scheduler().release(host, ticket)
+
+    iter_content = response.iter_content
+
+    def iter_content_releasing(*args, **kwargs):
+        try:
+            yield from iter_content(*args, **kwargs)
+        finally:
+            release_ticket()
+
+    response.iter_content = iter_content_releasing
+    response.release_ticket = release_ticket
+
+
+def api_request(url, params=None, stream=False):
+    """ sends a GET request to the API through the shared session
+        When the response_cache is enabled, the cached responses are
+        returned while fresh, and revalidated with the API once expired.
+        Requests are sent when the scheduler allows it and the throttled
+        ones are retried.
+        returns the response or None when the request could not be completed
+
+        :param stream: when True, the body of the response is not
+                       downloaded until it is iterated. Streamed responses
+                       are not stored in the response_cache, and they count
+                       as in flight until their body is iterated to the end
+                       or their release_ticket() is called
+    """
+    headers = dict(get_api_params()['headers'])
+    entry = None
+    if response_cache:
+        key = shopcache.compose_key(url, params)
+        entry, fresh = response_cache.get(key)
+        if fresh:
+            return CachedResponse(entry)
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+    count_http_stat('requests')
+    host = urllib.parse.urlsplit(url).netloc
+    for attempt in itertools.count():
+        ticket = get_scheduler().acquire(host)
+        try:
+            response = get_session().request("GET", url,
+                    headers=headers,
+                    params=params,
+                    timeout=http_pool_params['timeout'],
+                    stream=stream)
+        except requests.RequestException as e:
+            get_scheduler().release(host, ticket)
+            count_http_stat('errors')
+            logging.warning("\tRequest to %s failed: %s", url, e, extra=shoplog.RATE_LIMITED)
+            return None
+        throttled = response.status_code in shoplimit.THROTTLING_STATUS_CODES
+        if stream and not throttled:
+            hold_ticket_while_streaming(response, host, ticket)
+            break
+        pause = get_throttling_pause(response, attempt) if throttled else None
+        get_scheduler().release(host, ticket, throttled=throttled, pause=pause)
+        if not throttled or attempt >= http_pool_params['retries']:
+            break
+        response.close()
+        count_http_stat('retries')
+        logging.info("\tRequest to %s throttled (%s). Retrying after %.2fs", url, response.status_code, pause, extra=shoplog.RATE_LIMITED)
+    if response_cache:
+        if response.status_code == 304 and entry:
+            if stream:
+                response.release_ticket()
+            response_cache.refresh(key, closed=period_is_closed(params))
+            return CachedResponse(entry)
+        if response.status_code == 200 and not stream:
+            response_cache.put(key, response.content, response.headers, closed=period_is_closed(params))
+    return response
+
+
+def get_nodepoint_specs():
+    """ Loads the nodepoint specs of nodepoint_specs_filename
+        It raises ValueError when some spec is not valid """
+    global nodepoint_specs
+    if nodepoint_specs is None:
+        nodepoint_specs = shopspecs.load_specs(nodepoint_specs_filename)
+    return nodepoint_specs
+
+
 def get_api_params(filename=api_params_filename):
     """ Loads connection params """
     global api_params
@@ -158,192 +500,565 @@ def get_api_params(filename=api_params_filename):
     return api_params
 
 
+# name of the JSON decoder of the responses. See shopjson.get_decoder()
+json_decoder = 'auto'
+
+# function decoding the responses. See decode_json()
+json_decode_function = None
+
+
+def configure_json_decoder(name='auto'):
+    """ sets the JSON decoder of the responses: 'json', 'orjson' or
+        'auto' (orjson when installed) """
+    global json_decoder, json_decode_function
+    json_decode_function = shopjson.get_decoder(name)
+    json_decoder = name
+
+
+def decode_json(content):
+    """ parses the bytes of a response with the configured JSON decoder """
+    global json_decode_function
+    if json_decode_function is None:
+        json_decode_function = shopjson.get_decoder(json_decoder)
+    return json_decode_function(content)
+
+
+def get_decode_throughput():
+    """ returns a dict nodepoint -> MB per second decoded """
+    throughput = {}
+    for labels, decoded_bytes in metrics.collect()['decoded_bytes']:
+        nodepoint = dict(labels)['nodepoint']
+        seconds = metrics.get('decode_seconds', nodepoint=nodepoint)
+        if seconds is not None and seconds.sum > 0:
+            throughput[nodepoint] = decoded_bytes / seconds.sum / 1024 ** 2
+    return throughput
+
+
 def get_shops():
     """ Returns the list of available shops as a tuple
         (chain_id, shop_id, name)
     """
-    api_params = get_api_params()
-    url_base = api_params['url_base']
-    headers = api_params['headers']
-    url = '%s/user/accessible-resources' % url_base
-    logging.info("get_shops() loading shops from node %s" % url)
-    response = requests.request("GET", url, headers=headers)
-    if not response_is_ok(response):
-        return []
-    chains = json.loads(response.text, encoding = 'utf-8')
-    shops = []
-    for chain in chains:
-        if 'id' not in chain:
-            logging.warning('chain_id not found in accessible-resources %s' , chain)
-            continue
-        chain_id = chain['id']
-        shops += [ (chain_id, shop['id'], shop['name']) for shop in chain.get('shops') ]
-    logging.info("\tshops: %s" % shops)
-    return shops
-
-
-def get_nodepoint_entries(chain_id, shop_id, nodepoint):
+    with metrics.timer('stage_seconds', stage='get_shops'):
+        api_params = get_api_params()
+        url_base = api_params['url_base']
+        url = '%s/user/accessible-resources' % url_base
+        logging.info("get_shops() loading shops from node %s", url)
+        response = api_request(url)
+        if not response_is_ok(response):
+            return []
+        chains = decode_json(response.content)
+        shops = []
+        for chain in chains:
+            if 'id' not in chain:
+                logging.warning('chain_id not found in accessible-resources %s' , chain)
+                continue
+            chain_id = chain['id']
+            shops += [ (chain_id, shop['id'], shop['name']) for shop in chain.get('shops') ]
+        logging.info("\tshops: %s", shoplog.Payload(shops))
+        return shops
+
+
+def parse_shard(text):
+    """ returns the tuple (i, N) of the shard i of N shards given as i/N,
+        with 1 <= i <= N
+
+        >>> parse_shard('2/4')
+        (2, 4)
+    """
+    try:
+        shard, nshards = map(int, text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard must be given as i/N: %s' % text)
+    if not 1 <= shard <= nshards:
+        raise argparse.ArgumentTypeError('shard must be between 1 and %s: %s' % (nshards, text))
+    return shard, nshards
+
+
+def get_shop_shard(chain_id, shop_id, nshards):
+    """ returns the shard (1 to nshards) of the shop. It only depends on
+        the shop, so the shards are the same in every node and run """
+    digest = hashlib.blake2b(('%s/%s' % (chain_id, shop_id)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % nshards + 1
+
+
+def select_shard(shops, shard):
+    """ given the shops as returned by get_shops() and a shard (i, N)
+        it returns the tuple
+        - positions: position in shops of each shop of the shard
+        - the shops of the shard
+    """
+    shard, nshards = shard
+    selected = [ (position, shop) for position, shop in enumerate(shops)
+                 if get_shop_shard(shop[0], shop[1], nshards) == shard ]
+    return [ position for position, _ in selected ], [ shop for _, shop in selected ]
+
+
+def compose_nodepoint_params(period=None, params=None):
+    """ returns the query params of the period, by default the current
+        one, with the extra params of a nodepoint spec """
+    querystring = compose_querystring(period) if period else get_querystring()
+    return dict(querystring, **params) if params else querystring
+
+
+def get_nodepoint_entries(chain_id, shop_id, nodepoint, period=None, params=None):
     """ given a chain, a shop and a nodepoint
-        it calls the API to get the corresponding entries.
+        it calls the API to get the corresponding entries
+        of the period. By default, the current period.
         It returns the tuple
         - result: the result of the call: 'ok', 'error'
         - the contents as a list. Empty on error
+
+        :param params: extra query params of the request
     """
     nodepoint_url = '/chains/%s/shops/%s/%s' % (chain_id, shop_id, nodepoint)
     api_params = get_api_params()
     url_base = api_params['url_base']
-    headers = api_params['headers']
     url = '%s%s' % (url_base, nodepoint_url)
-    logging.info('Requesting: %s' % url)
-    response = requests.request("GET", url, headers=headers, params=get_querystring())
+    logging.info('Requesting: %s', url)
+    with metrics.timer('request_seconds', nodepoint=nodepoint):
+        response = api_request(url, params=compose_nodepoint_params(period, params))
     if not response_is_ok(response):
         return ('error', [])
-    resultat = json.loads(response.text, encoding = 'utf-8')
-    logging.info('\tresultat: %s' % resultat)
+    content = response.content
+    metrics.observe('response_bytes', len(content), nodepoint=nodepoint)
+    with metrics.timer('decode_seconds', nodepoint=nodepoint):
+        resultat = decode_json(content)
+    metrics.increment('decoded_bytes', len(content), nodepoint=nodepoint)
+    logging.debug('\tresultat: %s', shoplog.Payload(resultat))
     return ('ok', resultat)
 
 
-def get_nodepoint_counters(chain_id, shop_id, nodepoint_spec):
-    """ Computes the counters of a given nodepoint and returns them as a tuple """
-    nodepoint_name = nodepoint_spec['name']
-    (result, entries) = get_nodepoint_entries(chain_id, shop_id, nodepoint_name)
+# size of the chunks read from the streamed responses
+stream_chunk_size = 64 * 1024
+
+# entries of the streamed responses processed at once
+stream_batch_size = 256
+
+
+def get_nodepoint_entries_stream(chain_id, shop_id, nodepoint, period=None, params=None):
+    """ like get_nodepoint_entries() but the contents are an iterator
+        over the entries, parsed while the response is received.
+        The iteration raises requests.RequestException when the connection
+        fails, and ValueError when the contents are not a JSON array
+    """
+    nodepoint_url = '/chains/%s/shops/%s/%s' % (chain_id, shop_id, nodepoint)
+    url = '%s%s' % (get_api_params()['url_base'], nodepoint_url)
+    logging.info('Requesting (streaming): %s', url)
+    with metrics.timer('request_seconds', nodepoint=nodepoint):
+        response = api_request(url, params=compose_nodepoint_params(period, params), stream=True)
+    if not response_is_ok(response):
+        if response is not None and hasattr(response, 'release_ticket'):
+            response.release_ticket()
+        return ('error', iter([]))
+    chunks = count_response_bytes(response.iter_content(chunk_size=stream_chunk_size), nodepoint)
+    return ('ok', shopjson.iter_json_array(chunks))
+
+
+def count_response_bytes(chunks, nodepoint):
+    """ yields the chunks of a streamed response and observes their
+        total size in the response_bytes metric once received """
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.observe('response_bytes', size, nodepoint=nodepoint)
+
+
+def log_nodepoint_summary(chain_id, shop_id, nodepoint_spec, nentries, counters):
+    """ logs a single line with the counters of a nodepoint of a shop,
+        as a warning when some of its entries are malformed """
+    counter, malformed = counters[0], counters[2]
+    level = logging.WARNING if malformed else logging.INFO
+    logging.log(level, "Nodepoint %s of %s/%s: %s entries, %s counted, %s malformed",
+                nodepoint_spec['name'], chain_id, shop_id, nentries, counter, malformed)
+
+
+def get_endpoint_counters(chain_id, shop_id, compiled_specs, streaming=False, sketches=None, period=None,
+                          malformed_samples=None):
+    """ Computes the counters of nodepoints sharing their endpoint and
+        params with a single request, whose entries are processed by each
+        of them. It returns a list with the counters tuple of each
+        nodepoint. See get_nodepoint_counters()
+
+        :param compiled_specs: list with the shopspecs.CompiledSpec of each
+                               nodepoint
+        :param sketches: list with the sketch (or None) of each nodepoint
+        :param malformed_samples: list with the malformed sample (or None)
+                                  of each nodepoint
+    """
+    compiled = compiled_specs
+    endpoint, params = compiled[0].endpoint, compiled[0].params
+    sketches = sketches or [ None ] * len(compiled)
+    malformed_samples = malformed_samples or [ None ] * len(compiled)
+    accumulators = [ spec.accumulator(malformed_sample=malformed_sample, sketch=sketch)
+                     for spec, sketch, malformed_sample in zip(compiled, sketches, malformed_samples) ]
+    compute_seconds = [ 0.0 ] * len(compiled)
+
+    def feed(batch):
+        for position, accumulator in enumerate(accumulators):
+            start = time.perf_counter()
+            accumulator.update(batch)
+            compute_seconds[position] += time.perf_counter() - start
+
+    nentries = 0
+    if streaming:
+        (result, entries) = get_nodepoint_entries_stream(chain_id, shop_id, endpoint, period, params)
+        try:
+            while True:
+                batch = list(itertools.islice(entries, stream_batch_size))
+                if not batch:
+                    break
+                feed(batch)
+                nentries += len(batch)
+        except (requests.RequestException, ValueError) as e:
+            result = 'error'
+            entries = e
+            logging.warning("\tStreaming of endpoint %s failed: %s", endpoint, e, extra=shoplog.RATE_LIMITED)
+    else:
+        (result, entries) = get_nodepoint_entries(chain_id, shop_id, endpoint, period, params)
+        if result == 'ok':
+            feed(entries)
+            nentries = len(entries)
     if result == 'error':
-        logging.warning("get_nodepoint_counters(chain_id: %s, shop_id: %s, nodepoint: %s) An error was found with result '%s'" % (chain_id, shop_id, nodepoint_spec, entries))
-        return (np.nan, np.nan, np.nan)
-    return entries_processors[nodepoint_spec['type']](nodepoint_spec, entries)
+        logging.warning("get_endpoint_counters(chain_id: %s, shop_id: %s, nodepoints: %s) An error was found with result '%s'",
+                        chain_id, shop_id, [ spec.name for spec in compiled ], shoplog.Payload(entries), extra=shoplog.RATE_LIMITED)
+        for spec in compiled:
+            metrics.increment('errors', nodepoint=spec.name)
+        return [ (np.nan,) * len(compose_nodepoint_column(spec.spec)) for spec in compiled ]
+    all_counters = []
+    for spec, accumulator, seconds in zip(compiled, accumulators, compute_seconds):
+        metrics.increment('entries', nentries, nodepoint=spec.name)
+        metrics.observe('compute_seconds', seconds, nodepoint=spec.name)
+        counters = accumulator.counters()
+        log_nodepoint_summary(chain_id, shop_id, spec.spec, nentries, counters)
+        all_counters.append(counters)
+    return all_counters
+
+
+def get_nodepoint_counters(chain_id, shop_id, nodepoint_spec, streaming=False, sketch=None, period=None,
+                           malformed_sample=None):
+    """ Computes the counters of a given nodepoint and returns them as a tuple
+
+        :param streaming: when True, the entries are processed while they're
+                          received, in batches of stream_batch_size entries
+        :param sketch: a shopsketch.HyperLogLog where the identity values of
+                       a raw nodepoint are added
+        :param period: first day of the month to be computed. By default,
+                       the current period
+        :param malformed_sample: shopmalformed.MalformedSample where the
+                                 malformed entries are added
+    """
+    return get_endpoint_counters(chain_id, shop_id, [ shopspecs.compile_spec(nodepoint_spec) ], streaming=streaming,
+                                 sketches=[ sketch ], period=period, malformed_samples=[ malformed_sample ])[0]
+
+
+# nodepoints computed, requests sent for them and requests saved by
+# sharing them among the nodepoints of the same endpoint
+fetch_stats = { 'nodepoints': 0, 'requests': 0, 'deduplicated': 0 }
+
+
+def count_fetch_stats(stats):
+    """ adds the stats of a fetch plan to fetch_stats """
+    for name, value in stats.items():
+        fetch_stats[name] += value
+    metrics.increment('deduplicated_requests', stats['deduplicated'])
+
+
+def plan_fetches(units):
+    """ given a list of (period, chain_id, shop_id, compiled_spec) units,
+        where compiled_spec is a shopspecs.CompiledSpec,
+        it groups them by the request fetching their entries: the same
+        shop, period, endpoint and params. It returns the tuple
+        - the list of fetches, each a list with the positions of its units,
+          in the order of their first unit
+        - a dict of stats: nodepoints, requests and deduplicated requests
+
+        >>> specs = [ { 'name': 'tickets', 'type': 'raw', 'equality_key': 'id', 'column_suffix': 'distinct' },
+        ...           { 'name': 'tickets/sales', 'endpoint': 'tickets', 'type': 'aggregation',
+        ...             'aggregation_key': 'billing', 'column_suffix': 'billing' } ]
+        >>> compiled = shopspecs.compile_specs(specs)
+        >>> plan_fetches([ (None, 'chain_1', shop_id, spec) for shop_id in ('shop_1', 'shop_2') for spec in compiled ])
+        ([[0, 1], [2, 3]], {'nodepoints': 4, 'requests': 2, 'deduplicated': 2})
+    """
+    fetches = {}
+    for position, (period, chain_id, shop_id, compiled_spec) in enumerate(units):
+        key = (period, chain_id, shop_id) + compiled_spec.fetch_key
+        fetches.setdefault(key, []).append(position)
+    stats = { 'nodepoints': len(units), 'requests': len(fetches), 'deduplicated': len(units) - len(fetches) }
+    return list(fetches.values()), stats
 
 
 def compose_nodepoint_column(nodepoint_spec):
     """ Composes a list of column names for this nodepoint
         It generates three columns 'count', column_suffix, and 'malformed', prefixed
-        by the nodepoint name
+        by the nodepoint name, followed by a column for each extra aggregation
 
         >>> compose_nodepoint_column( { "name": "sellers", "column_suffix": "distinct" })
         ['sellers_count', 'sellers_distinct', 'sellers_malformed']
+        >>> compose_nodepoint_column( { "name": "sales", "column_suffix": "billing", "aggregations": [ "max" ] })
+        ['sales_count', 'sales_billing', 'sales_malformed', 'sales_billing_max']
     """
     nodepoint_name = nodepoint_spec['name']
     column_suffix = nodepoint_spec['column_suffix']
-    return [ '%s_%s' % (nodepoint_name, column) for column in ('count', column_suffix, 'malformed') ]
+    columns = [ '%s_%s' % (nodepoint_name, column) for column in ('count', column_suffix, 'malformed') ]
+    return columns + [ '%s_%s_%s' % (nodepoint_name, column_suffix, aggregation)
+                       for aggregation in nodepoint_spec.get('aggregations', ()) ]
 
 
-def generate_dataframe(nodepoints_specs):
+def generate_dataframe(nodepoints_specs, workers=1, streaming=False,
+                       sketches=None, sketch_error=0.01, period=None, shops=None, journal=None,
+                       malformed=None, malformed_sample_size=shopmalformed.DEFAULT_SAMPLE_SIZE):
     """ given a list with nodepoints specs
         it generates a dataframe containing
         a row for each shop of the chain and
         for each raw nodepoint: three columns (count, distinct, malformed)
+
+        :param nodepoints_specs: list of nodepoint specs to be computed
+        :param workers: number of requests to the API running concurrently.
+                        With 1 worker the nodepoints are requested one after
+                        the other.
+        :param streaming: when True, the entries are processed while they're
+                          received, with constant memory for each request
+        :param sketches: when a dict is given, it is filled with a
+                         shopsketch.HyperLogLog of the identity values for each
+                         (chain_id, shop_id, nodepoint) of the raw nodepoints
+        :param sketch_error: expected relative error of the sketches
+        :param period: first day of the month to be computed. By default,
+                       the current period
+        :param shops: list of shops as returned by get_shops(). By default,
+                      they're requested to the API
+        :param journal: shopjournal.Journal where the counters of each
+                        nodepoint are written once computed. The nodepoints
+                        already in the journal are not requested again
+        :param malformed: when a dict is given, it is filled with a
+                          shopmalformed.MalformedSample of the malformed
+                          entries for each (chain_id, shop_id, nodepoint)
+                          having them
+        :param malformed_sample_size: malformed entries kept in each sample
+    """
+    period = period or get_current_period()
+    periods_sketches = None if sketches is None else {}
+    periods_malformed = None if malformed is None else {}
+    dataframes = generate_dataframes(nodepoints_specs, [ period ], workers=workers,
+                                     streaming=streaming,
+                                     sketches=periods_sketches, sketch_error=sketch_error,
+                                     shops=shops, journal=journal,
+                                     malformed=periods_malformed, malformed_sample_size=malformed_sample_size)
+    if sketches is not None:
+        sketches.update(periods_sketches[period])
+    if malformed is not None:
+        malformed.update(periods_malformed[period])
+    return dataframes[period]
+
+
+def generate_dataframes(nodepoints_specs, periods, workers=1, streaming=False,
+                        sketches=None, sketch_error=0.01, shops=None, journal=None,
+                        malformed=None, malformed_sample_size=shopmalformed.DEFAULT_SAMPLE_SIZE):
+    """ given a list with nodepoints specs and a list of periods
+        it generates the dataframe of generate_dataframe() for each period.
+        The shops are requested once and the periods are computed
+        concurrently by the same workers.
+        It returns a dict period -> DataFrame
+
+        :param sketches: when a dict is given, it is filled with a dict of
+                         sketches for each period. See generate_dataframe()
+        :param journal: shopjournal.Journal of the computed nodepoints. Failed
+                        requests are not written, so they're retried on resume
+        :param malformed: when a dict is given, it is filled with a dict of
+                          malformed samples for each period. The nodepoints
+                          read from the journal have no samples
+        See generate_dataframe() for the rest of params
     """
 
 
-    def build_dataframe(shops, nodepoint_specs):
-        initial_data = [ { 'chain_id': chain_id, 'shop_id': shop_id, 'shop_name': shop_name} for chain_id, shop_id, shop_name in shops ]
+    def compose_columns(nodepoint_specs):
         columns = [ 'chain_id', 'shop_id', 'shop_name' ]
         for nodepoint_spec in nodepoint_specs:
             columns += compose_nodepoint_column(nodepoint_spec)
-        df = pd.DataFrame(initial_data, columns = columns, dtype=np.int64)
-        return df
-
-
-    def populate_counters(df, nodepoint_specs, shops):
-        for chain_id, shop_id, _ in shops:
-            for nodepoint_spec in nodepoint_specs:
-                counters = get_nodepoint_counters(chain_id, shop_id, nodepoint_spec)
-                # add counters of current nodepoint
-                df.loc[df['shop_id'] == shop_id, compose_nodepoint_column(nodepoint_spec)] = counters
-
-    shops = get_shops()
-    df = build_dataframe(shops, nodepoints_specs)
-    populate_counters(df, nodepoints_specs, shops)
-
-    return df
+        return columns
+
+
+    def compute_counters(units, workers):
+        """ returns the counters of each (period, chain_id, shop_id, compiled_spec)
+            unit in the same order as units. The units not in the journal
+            are grouped by plan_fetches() so each request is sent once """
+        def with_sketch(compiled_spec):
+            return sketches is not None and compiled_spec.type == 'raw'
+
+        def read_journal(unit):
+            period, chain_id, shop_id, compiled_spec = unit
+            journaled = journal.get(period, chain_id, shop_id, compiled_spec.name, compiled_spec.digest) if journal is not None else None
+            if journaled is None or (journaled[1] is None and with_sketch(compiled_spec)):
+                return None
+            counters, sketch = journaled
+            if with_sketch(compiled_spec):
+                sketches[period][(chain_id, shop_id, compiled_spec.name)] = sketch
+            return counters
+
+        def compute(fetch_units):
+            period, chain_id, shop_id, _ = fetch_units[0]
+            compiled_specs = [ compiled_spec for _, _, _, compiled_spec in fetch_units ]
+            fetch_sketches = [ shopsketch.HyperLogLog(error=sketch_error) if with_sketch(compiled_spec) else None
+                               for compiled_spec in compiled_specs ]
+            malformed_samples = [ shopmalformed.MalformedSample(size=malformed_sample_size) if malformed is not None else None
+                                  for _ in compiled_specs ]
+            start = time.perf_counter()
+            all_counters = get_endpoint_counters(chain_id, shop_id, compiled_specs,
+                                                 streaming=streaming, sketches=fetch_sketches,
+                                                 period=period, malformed_samples=malformed_samples)
+            metrics.increment('shop_seconds', time.perf_counter() - start, chain_id=chain_id, shop_id=shop_id)
+            for compiled_spec, counters, sketch, malformed_sample in zip(compiled_specs, all_counters,
+                                                                         fetch_sketches, malformed_samples):
+                key = (chain_id, shop_id, compiled_spec.name)
+                if journal is not None and not np.isnan(counters[0]):
+                    journal.write(period, chain_id, shop_id, compiled_spec.name, counters, sketch,
+                                  spec_digest=compiled_spec.digest)
+                if sketch is not None and not np.isnan(counters[0]):
+                    sketches[period][key] = sketch
+                if malformed_sample is not None and malformed_sample.count:
+                    malformed[period][key] = malformed_sample
+            return all_counters
+
+        all_counters = [ read_journal(unit) for unit in units ]
+        pending = [ position for position, counters in enumerate(all_counters) if counters is None ]
+        fetches, stats = plan_fetches([ units[position] for position in pending ])
+        fetches = [ [ pending[position] for position in fetch ] for fetch in fetches ]
+        count_fetch_stats(stats)
+        if stats['deduplicated']:
+            logging.info('Fetch plan: %(nodepoints)s nodepoints with %(requests)s requests '
+                         '(%(deduplicated)s deduplicated)', stats)
+        fetches_units = [ [ units[position] for position in fetch ] for fetch in fetches ]
+        if workers <= 1:
+            results = [ compute(fetch_units) for fetch_units in fetches_units ]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(compute, fetches_units))
+        for fetch, fetch_counters in zip(fetches, results):
+            for position, counters in zip(fetch, fetch_counters):
+                all_counters[position] = counters
+        return all_counters
+
+
+    def collect_rows(compiled_specs, periods, shops, workers):
+        """ returns a dict period -> rows. There is a row for each shop
+            containing its identity followed by the counters of each nodepoint """
+        units = [ (period, chain_id, shop_id, compiled_spec)
+                  for period in periods
+                  for chain_id, shop_id, _ in shops
+                  for compiled_spec in compiled_specs ]
+        all_counters = iter(compute_counters(units, workers))
+        periods_rows = {}
+        for period in periods:
+            rows = []
+            for chain_id, shop_id, shop_name in shops:
+                row = [ chain_id, shop_id, shop_name ]
+                for _ in compiled_specs:
+                    row.extend(next(all_counters))
+                rows.append(row)
+            periods_rows[period] = rows
+        return periods_rows
+
+    # compiled once, and raises ValueError before any request
+    compiled_specs = shopspecs.compile_specs(nodepoints_specs)
+    if shops is None:
+        shops = get_shops()
+    if sketches is not None:
+        sketches.update({ period: {} for period in periods })
+    if malformed is not None:
+        malformed.update({ period: {} for period in periods })
+    columns = compose_columns(nodepoints_specs)
+    periods_rows = collect_rows(compiled_specs, periods, shops, workers)
+    return { period: pd.DataFrame(rows, columns=columns) for period, rows in periods_rows.items() }
+
+
+def combine_periods(dataframes):
+    """ given a dict period -> DataFrame as returned by generate_dataframes()
+        it returns a single DataFrame with the rows of all the periods,
+        identified by a leading 'period' column (YYYYMM)
+    """
+    combined = [ df.assign(period=period.strftime('%Y%m')) for period, df in sorted(dataframes.items()) ]
+    if not combined:
+        return pd.DataFrame(columns=[ 'period' ])
+    df = pd.concat(combined, ignore_index=True)
+    return df[[ 'period' ] + [ column for column in df.columns if column != 'period' ]]
 
 
 def sort_columns(df):
     """ returns the dataframe with the columns sorted as:
         - chain_id, shop_id, shop_name
         - *_billing
+        - the extra aggregations of each *_billing: mean, min, quantiles,
+          max and the rest (see shopspecs.aggregation_order())
         - rest
         - *_malformed
     """
-    identity_columns = [ 'chain_id', 'shop_id', 'shop_name' ]
-    billing_columns = [ column for column in df.columns if column.endswith('_billing') ]
-    malformed_columns = [ column for column in df.columns if column.endswith('_malformed') ]
-    rest_columns = [ column for column in df.columns if column not in identity_columns + billing_columns + malformed_columns ]
-    return df[identity_columns + billing_columns + rest_columns + malformed_columns]
-
-
-def save_malformed_stats_chart(shopstats, filename, date_title = get_current_month_as_title()):
-    """ given the shop stats DataFrame,
-        it saves a png with the malformed stats
+    with metrics.timer('stage_seconds', stage='sort_columns'):
+        identity_columns = [ 'chain_id', 'shop_id', 'shop_name' ]
+        billing_columns = [ column for column in df.columns if column.endswith('_billing') ]
+        aggregation_columns = []
+        for billing_column in billing_columns:
+            aggregations = [ column[len(billing_column) + 1:] for column in df.columns
+                             if column.startswith(billing_column + '_') ]
+            aggregation_columns += [ '%s_%s' % (billing_column, aggregation)
+                                     for aggregation in sorted(aggregations, key=shopspecs.aggregation_order) ]
+        malformed_columns = [ column for column in df.columns if column.endswith('_malformed') ]
+        sorted_columns = identity_columns + billing_columns + aggregation_columns
+        rest_columns = [ column for column in df.columns if column not in sorted_columns + malformed_columns ]
+        return df[sorted_columns + rest_columns + malformed_columns]
+
+
+def import_plotting():
+    """ returns the plotting modules (matplotlib.pyplot, seaborn)
+        They're imported when the first chart is rendered, so importing
+        shopstats for the data only doesn't load them
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
 
-        :param shopstats: DataFrame containing the data generated by shopstats
-        :param filename:  the name of the file where the generated chart will be saved
-        :param date_title:  description of the period included in the chart
 
-        What does it shows:
-        - number of malformed entries for each nodepoint
-        - non zero cells are highlighted
+def compose_shop_index(shopstats):
+    """ returns the chain_id/shop_id labels of the rows of the charts """
+    return pd.Index(shopstats['chain_id'].astype(str) + '/' + shopstats['shop_id'].astype(str), name='index')
 
 
-        TODO: there's some code redundancy with other functions that
-        save different charts. Consider some refactoring
+def prepare_malformed_data(shopstats):
+    """ returns the tuple (base, values) of the malformed chart
+        - values: number of malformed entries of each nodepoint
+        - base: 1.0 for the cells to be highlighted (some malformed entry)
     """
-    def prepare_data(shopstats):
-        columns = [ column[:-len('_malformed')]
-                              for column in shopstats 
-                              if column.endswith('_malformed')]
+    columns = [ column[:-len('_malformed')]
+                          for column in shopstats
+                          if column.endswith('_malformed')]
 
-        values = pd.DataFrame(columns=['index'] + columns)
-        values['index'] = shopstats.apply(lambda row: "%s/%s" % (row.chain_id, row.shop_id), axis=1)
-        values[columns] = shopstats[
-                [ '%s_malformed'%nodepoint
-                  for nodepoint in columns ]]
-        values = values.set_index(['index'])
-        values = values.astype('int')
+    values = pd.DataFrame(shopstats[[ '%s_malformed' % nodepoint for nodepoint in columns ]].to_numpy(),
+                          index=compose_shop_index(shopstats), columns=columns)
+    values = values.astype('int')
 
-        # fake data for testing
-        # comment the following lines out to get some wrong billings
-        #values.loc['DEMO/zqrvxircdzczvg', 'products'] += 1
-        return values
+    # fake data for testing
+    # comment the following lines out to get some wrong billings
+    #values.loc['DEMO/zqrvxircdzczvg', 'products'] += 1
+    base = (values > 0).astype('float')
+    return base, values
 
-    def compose_chart(values, title):
-        sns.set()
-        f, ax = plt.subplots(figsize=(15, 6))
-        sns.heatmap(values,
-                annot=True, fmt='d',        # show values
-                linewidths=.5,
-                cmap='bwr',
-                vmax=1,
-                cbar=False                  # hide scale bar
-                )
-        ax.xaxis.set_ticks_position('top')  # x labels to top
-        plt.xlabel('')
-        plt.ylabel('')
-        plt.title(title)
-        plt.xticks(rotation=25)
-        f.tight_layout()
-
-    values = prepare_data(shopstats)
-    title = 'malformed entries - %s' % date_title
-    compose_chart(values, title)
-    plt.savefig(filename)
 
+# billing columns shown first in the billing chart, the rest follow
+sales_chart_order = ('sales', 'products/sales', 'sellers/sales', 'customers/sales', 'product-categories/sales')
 
-def save_sales_stats_chart(shopstats: pd.DataFrame,
-                           filename: str,
-                           date_title:str = get_current_month_as_title()):
-    """ given the shop stats DataFrame,
-        it saves a png with the sales stats.
+# billings highlighted when they're different to the shop sales
+sales_equal_checks = ('products/sales', 'sellers/sales')
 
-        :param shopstats: DataFrame containing the data generated by shopstats
-        :param filename:  the name of the file where the generated chart will be saved
-        :param date_title:  description of the period included in the chart
+# billings highlighted when they sum over the shop sales
+sales_bounded_checks = ('product-categories/sales', 'customers/sales')
 
-        What does it shows:
-        - sales: the billing of each shop
-        - products/sales and sellers/sales: the billing for products and
-          sellers. When different to the shop sales they're highlighted
-        - product-categories/sales and customers/sales: the billing for these
-          nodepoints. When they sum over the shop sales they're highlighted
+
+def prepare_sales_data(shopstats):
+    """ returns the tuple (base, values) of the billing chart
+        - values: the billing of each sales nodepoint
+        - base: 1.0 for the potentially problematic cells to be highlighted.
+          Only the checks of the nodepoints in shopstats are highlighted
     """
 
     def prepare_data_to_display(shopstats):
@@ -351,15 +1066,11 @@ def save_sales_stats_chart(shopstats: pd.DataFrame,
         columns = [ column[:-len('_billing')]
                     for column in shopstats
                     if column.endswith('_billing')]
-        values = pd.DataFrame(columns=['index'] + columns)
-        values['index'] = shopstats.apply(lambda row: "%s/%s" % (row.chain_id, row.shop_id), axis=1)
-        values[columns] = shopstats[
-                ['%s_billing' % nodepoint
-                 for nodepoint in columns]]
-        values = values.set_index(['index'])
-
         # Columns are sorted for readability
-        values = values[['sales', 'products/sales', 'sellers/sales', 'customers/sales', 'product-categories/sales']]
+        columns = [ column for column in sales_chart_order if column in columns ] + \
+                  [ column for column in columns if column not in sales_chart_order ]
+        values = pd.DataFrame(shopstats[[ '%s_billing' % nodepoint for nodepoint in columns ]].to_numpy(dtype='float'),
+                              index=compose_shop_index(shopstats), columns=columns)
 
         # fake data for testing
         # comment the following lines out to get some wrong billings
@@ -372,115 +1083,617 @@ def save_sales_stats_chart(shopstats: pd.DataFrame,
     def prepare_data_to_highlight(values):
         """ data to be used by the heatmap to highlight potentially
             problematic cells """
-        base = values.copy()
-        base[["sales"]] = 0.0
-        base["sellers/sales"] = np.logical_not(np.isclose(values['sellers/sales'], values['sales'])).astype('float')
-        base["products/sales"] = np.logical_not(np.isclose(values['products/sales'], values['sales'])).astype('float')
-        base["product-categories/sales"] = (values['product-categories/sales'] > values['sales'] + 0.000001).astype('float')
-        base["customers/sales"] = (values['customers/sales'] > values['sales'] + 0.000001).astype('float')
+        base = pd.DataFrame(0.0, index=values.index, columns=values.columns)
+        if 'sales' not in values:
+            return base
+        for column in sales_equal_checks:
+            if column in values:
+                base[column] = np.logical_not(np.isclose(values[column], values['sales'])).astype('float')
+        for column in sales_bounded_checks:
+            if column in values:
+                base[column] = (values[column] > values['sales'] + 0.000001).astype('float')
         return base
 
-    def compose_chart(base, values, title):
-        sns.set()
-        f, ax = plt.subplots(figsize=(15, 6))
-        sns.heatmap(base,
-                annot=values,
-                fmt='.2f',        # show values
-                linewidths=.5,
-                cmap='bwr',
-                cbar=False                  # hide scale bar
-                )
-        ax.xaxis.set_ticks_position('top')  # x labels to top
-        plt.xlabel('')
-        plt.ylabel('')
-        plt.title(title)
-        plt.xticks(rotation=25)
-        f.tight_layout()
-
     values = prepare_data_to_display(shopstats)
-    base = prepare_data_to_highlight(values)
-    title = 'billing entries - %s' % date_title
-    compose_chart(base, values, title)
-    plt.savefig(filename)
+    return prepare_data_to_highlight(values), values
+
+
+def prepare_duplicated_data(shopstats):
+    """ returns the tuple (base, values) of the distinct chart
+        - values: the pair distinct/count of each raw nodepoint
+        - base: 1.0 for the cells to be highlighted (count > distinct)
+    """
+    # fake data for testing
+    # comment the following lines out to get some dups
+    #shopstats.loc[0, 'products_count'] += 1
+    #shopstats.loc[1, 'customers_count'] += 10
+
+    # raw nodepoints have a column ending with _distinct
+    raw_nodepoints = [ column[:-len('_distinct')] for column in shopstats.columns if column.endswith('_distinct')]
+
+    # prepare data to be shown
+    #   values: contents to be shown in the cells
+    #   base:   contents to be considered to decide highlighting the cell
+    index = compose_shop_index(shopstats)
+    values = pd.DataFrame(index=index, columns=raw_nodepoints, dtype='object')
+    base = pd.DataFrame(index=index, columns=raw_nodepoints, dtype='float')
+    for nodepoint in raw_nodepoints:
+        values[nodepoint] = (shopstats['%s_distinct' % nodepoint].astype('int').astype("str") + '/' + shopstats['%s_count' % nodepoint].astype('int').astype("str")).to_numpy()
+        base[nodepoint] = (shopstats['%s_count' % nodepoint] != shopstats['%s_distinct' % nodepoint]).astype('float').to_numpy()
+    return base, values
+
+
+def select_flagged(base, values, max_rows=None):
+    """ returns the tuple (base, values, flagged shops) with the rows of
+        the chart having some highlighted cell, the rows with more
+        highlighted cells first
+
+        :param max_rows: the most flagged rows kept. By default, all of them
+
+        >>> base = pd.DataFrame({ 'a': [ 0., 1., 0. ], 'b': [ 0., 1., 1. ] }, index=[ 'x', 'y', 'z' ])
+        >>> base, values, flagged = select_flagged(base, base * 10, max_rows=1)
+        >>> values
+              a     b
+        y  10.0  10.0
+        >>> flagged
+        2
+    """
+    flagged_per_row = (base.to_numpy(dtype='float') > 0).sum(axis=1)
+    rows = np.flatnonzero(flagged_per_row)
+    selected = rows[np.argsort(-flagged_per_row[rows], kind='stable')][:max_rows]
+    return base.iloc[selected], values.iloc[selected], len(rows)
+
+
+def compose_heatmap(base, values, title, fmt):
+    """ returns the figure of a heatmap with a row for each shop, whose
+        cells are highlighted by base and annotated with values """
+    plt, sns = import_plotting()
+    sns.set()
+    f, ax = plt.subplots(figsize=(15, max(6, 2 + 0.25 * len(base))))
+    sns.heatmap(base,
+            annot=values,
+            fmt=fmt,                    # show values
+            linewidths=.5,
+            cmap='bwr',
+            vmin=0, vmax=1,
+            cbar=False                  # hide scale bar
+            )
+    ax.xaxis.set_ticks_position('top')  # x labels to top
+    plt.xlabel('')
+    plt.ylabel('')
+    plt.title(title)
+    plt.xticks(rotation=25)
+    f.tight_layout()
+    return f
+
+
+def compose_empty_chart(title):
+    """ returns the figure of a chart without cells to be shown """
+    plt, _ = import_plotting()
+    f, ax = plt.subplots(figsize=(15, 2))
+    ax.axis('off')
+    ax.text(0.5, 0.5, 'No flagged shops', ha='center', va='center')
+    plt.title(title)
+    f.tight_layout()
+    return f
+
+
+# most flagged shops shown in the summary charts
+summary_max_rows = 100
+
+
+def save_heatmap_chart(base, values, filename, title, fmt, flagged_only=False):
+    """ saves the heatmap of the chart data as a png
+
+        :param flagged_only: when True, only the shops having some
+                             highlighted cell are shown, up to
+                             summary_max_rows shops, so the rendering
+                             depends on the flagged shops, not on all of them
+    """
+    plt, _ = import_plotting()
+    if flagged_only:
+        nshops = len(base)
+        base, values, flagged = select_flagged(base, values, max_rows=summary_max_rows)
+        shown = '%s of %s' % (len(base), flagged) if flagged > len(base) else flagged
+        title = '%s - %s flagged shops of %s' % (title, shown, nshops)
+    if base.empty:
+        figure = compose_empty_chart(title)
+    else:
+        figure = compose_heatmap(base, values, title, fmt)
+    figure.savefig(filename)
+    plt.close(figure)
+
+
+def save_malformed_stats_chart(shopstats, filename, date_title = None, flagged_only=False):
+    """ given the shop stats DataFrame,
+        it saves a png with the malformed stats
+
+        :param shopstats: DataFrame containing the data generated by shopstats
+        :param filename:  the name of the file where the generated chart will be saved
+        :param date_title:  description of the period included in the chart.
+                            By default, the current month
+        :param flagged_only: when True, only the shops with highlighted
+                             cells are shown. See save_heatmap_chart()
+
+        What does it shows:
+        - number of malformed entries for each nodepoint
+        - non zero cells are highlighted
+    """
+    base, values = prepare_malformed_data(shopstats)
+    title = 'malformed entries - %s' % (date_title or get_current_month_as_title())
+    save_heatmap_chart(base, values, filename, title, 'd', flagged_only=flagged_only)
+
+
+def save_sales_stats_chart(shopstats: pd.DataFrame,
+                           filename: str,
+                           date_title:str = None,
+                           flagged_only: bool = False):
+    """ given the shop stats DataFrame,
+        it saves a png with the sales stats.
+
+        :param shopstats: DataFrame containing the data generated by shopstats
+        :param filename:  the name of the file where the generated chart will be saved
+        :param date_title:  description of the period included in the chart.
+                            By default, the current month
+        :param flagged_only: when True, only the shops with highlighted
+                             cells are shown. See save_heatmap_chart()
+
+        What does it shows:
+        - sales: the billing of each shop
+        - products/sales and sellers/sales: the billing for products and
+          sellers. When different to the shop sales they're highlighted
+        - product-categories/sales and customers/sales: the billing for these
+          nodepoints. When they sum over the shop sales they're highlighted
+    """
+    base, values = prepare_sales_data(shopstats)
+    title = 'billing entries - %s' % (date_title or get_current_month_as_title())
+    save_heatmap_chart(base, values, filename, title, '.2f', flagged_only=flagged_only)
 
 
 def save_duplicated_stats_chart(shopstats: pd.DataFrame,
                            filename: str,
-                           date_title:str = get_current_month_as_title()):
+                           date_title:str = None,
+                           flagged_only: bool = False):
     """ given the shop stats DataFrame,
         it saves a png with the duplicated stats.
 
         :param shopstats: DataFrame containing the data generated by shopstats
         :param filename:  the name of the file where the generated chart will be saved
-        :param date_title:  description of the period included in the chart
+        :param date_title:  description of the period included in the chart.
+                            By default, the current month
+        :param flagged_only: when True, only the shops with highlighted
+                             cells are shown. See save_heatmap_chart()
 
         What does it shows:
         - a column for each raw nodepont
         - for each cell, it shows a pair (counter/unique)
         - when counter > unique the cell is highlighted
     """
+    base, values = prepare_duplicated_data(shopstats)
+    title = 'distinct entries - %s' % (date_title or get_current_month_as_title())
+    save_heatmap_chart(base, values, filename, title, 's', flagged_only=flagged_only)
 
-    def prepare_data(shopstats):
-        # fake data for testing
-        # comment the following lines out to get some dups
-        #shopstats.loc[0, 'products_count'] += 1
-        #shopstats.loc[1, 'customers_count'] += 10
-
-        # raw nodepoints have a column ending with _distinct
-        raw_nodepoints = [ column[:-len('_distinct')] for column in shopstats.columns if column.endswith('_distinct')]
-
-        # prepare data to be shown
-        #   values: contents to be shown in the cells
-        #   base:   contents to be considered to decide highlighting the cell
-        values = pd.DataFrame(columns=['index'] + raw_nodepoints)
-        values['index'] = shopstats.apply(lambda row: "%s/%s" % (row.chain_id, row.shop_id), axis=1)
-        base = values.copy()
-        for nodepoint in raw_nodepoints:
-            values[nodepoint] = shopstats['%s_distinct' % nodepoint].astype('int').astype("str") + '/' + shopstats['%s_count' % nodepoint].astype('int').astype("str")
-            base[nodepoint] = (shopstats['%s_count' % nodepoint] != shopstats['%s_distinct' % nodepoint]).astype('float')
-        values = values.set_index(['index'])
-        base = base.set_index(['index'])
-        return base, values
-
-    def compose_chart(base, values, title):
-        sns.set()
-        f, ax = plt.subplots(figsize=(15, 6))
-        sns.heatmap(base,
-                annot=values,
-                fmt='s',                    # string values
-                linewidths=.5,
-                cmap='bwr',
-                cbar=False                  # hide scale bar
-                )
-        ax.xaxis.set_ticks_position('top')  # x labels to top
-        plt.xlabel('')
-        plt.ylabel('')
-        plt.title(title)
-        plt.xticks(rotation=25)
-        f.tight_layout()
-
-    base, values = prepare_data(shopstats)
-    title = 'distinct entries - %s' % date_title
-    compose_chart(base, values, title)
-    plt.savefig(filename)
 
+# Charts generated for each period by their filename_templates key
+chart_functions = {
+        'malformed_chart': save_malformed_stats_chart,
+        'billing_chart': save_sales_stats_chart,
+        'dup_chart': save_duplicated_stats_chart,
+        }
 
-if __name__ == "__main__":
-    logging.basicConfig(filename='%s.log'%sys.argv[0],level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
-    logging.info('\n'*3)
-    # obtain results
-    df = generate_dataframe(nodepoint_specs)
-    # Store results
-    df = sort_columns(df)
-    df.to_csv(get_filename('csv'))
-    print("Output saved at %s" % get_filename('csv'))
-    save_malformed_stats_chart(df, get_filename('malformed_chart'))
-    print("Malformed stats chart saved at %s" % get_filename('malformed_chart'))
-    save_sales_stats_chart(df, get_filename('billing_chart'))
-    print("Sales stats chart saved at %s" % get_filename('billing_chart'))
 
-    save_duplicated_stats_chart(df, get_filename('dup_chart'))
-    print("Duplicated stats chart saved at %s" % get_filename('dup_chart'))
+def use_non_interactive_backend():
+    """ renders the charts without any display """
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def get_peak_rss():
+    """ returns the peak resident memory of this process in MB since it
+        started, not only while rendering. ru_maxrss is in bytes on macOS
+        and in KB elsewhere """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 ** 2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def render_chart(chart, df, filename, date_title, options=None):
+    """ renders a chart of chart_functions
+        returns the tuple (filename, seconds, peak RSS in MB of the process,
+        growth in MB of that peak while rendering the chart)
+
+        :param options: keyword arguments of the chart function
+    """
+    start = time.perf_counter()
+    start_rss = get_peak_rss()
+    chart_functions[chart](df, filename, date_title, **(options or {}))
+    peak_rss = get_peak_rss()
+    return filename, time.perf_counter() - start, peak_rss, peak_rss - start_rss
+
+
+def render_charts(jobs, processes=None):
+    """ renders the charts in a pool of processes
+        :param jobs: list of (chart, df, filename, date_title) where chart is
+                     a key of chart_functions, optionally followed by the
+                     options of render_chart()
+        :param processes: number of processes. By default, one per CPU.
+                          With 1, the charts are rendered by this process
+        returns a dict with
+        - wall_seconds: the time spent rendering all the charts
+        - chart_seconds: dict filename -> time spent rendering the chart
+        - peak_rss_mb: the peak resident memory of the processes rendering
+          charts, including what they used before (e.g. this process with 1)
+        - chart_rss_growth_mb: the largest growth of that peak while
+          rendering a chart, an estimate of the memory used by the charts
+    """
+    start = time.perf_counter()
+    if processes == 1:
+        use_non_interactive_backend()
+        results = [ render_chart(*job) for job in jobs ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                    initializer=use_non_interactive_backend) as executor:
+            futures = [ executor.submit(render_chart, *job) for job in jobs ]
+            results = [ future.result() for future in futures ]
+    for job, (_, seconds, _, _) in zip(jobs, results):
+        metrics.observe('chart_seconds', seconds, chart=job[0])
+    metrics.observe('stage_seconds', time.perf_counter() - start, stage='render_charts')
+    return {
+            'wall_seconds': time.perf_counter() - start,
+            'chart_seconds': { filename: seconds for filename, seconds, _, _ in results },
+            'peak_rss_mb': max([ rss for _, _, rss, _ in results ], default=0),
+            'chart_rss_growth_mb': max([ growth for _, _, _, growth in results ], default=0),
+            }
+
+
+# data (base, values) of each chart of chart_functions
+chart_data_functions = {
+        'malformed_chart': prepare_malformed_data,
+        'billing_chart': prepare_sales_data,
+        'dup_chart': prepare_duplicated_data,
+        }
+
+# shops of each tile of the charts. Charts of more shops are rendered as
+# a summary of the flagged shops and tiles of all of them. With 0, the
+# charts are rendered in a single image whatever the shops
+chart_tile_rows = 50
+
+
+def compose_tile_filename(filename, tile):
+    """ returns the filename of a tile (or 'summary') of a chart
+
+        >>> compose_tile_filename('billing_201906.png', 3)
+        'billing_201906_tile003.png'
+        >>> compose_tile_filename('billing_201906.png', 'summary')
+        'billing_201906_summary.png'
+    """
+    base, extension = os.path.splitext(filename)
+    suffix = tile if isinstance(tile, str) else 'tile%03d' % tile
+    return '%s_%s%s' % (base, suffix, extension)
+
+
+def compose_chart_jobs(chart, df, filename, date_title, tile_rows=None):
+    """ returns the tuple
+        - the render_charts() jobs of a chart of df: the chart itself when
+          df has at most tile_rows shops. Otherwise, a summary with its
+          flagged shops and tiles with tile_rows shops each
+        - None for a single chart. Otherwise, a dict describing the summary
+          and the tiles for save_chart_index()
+
+        :param tile_rows: shops of each tile. By default, chart_tile_rows
+    """
+    tile_rows = chart_tile_rows if tile_rows is None else tile_rows
+    if not tile_rows or len(df) <= tile_rows:
+        return [ (chart, df, filename, date_title) ], None
+    date_title = date_title or get_current_month_as_title()
+    base, _ = chart_data_functions[chart](df)
+    flagged = (base.to_numpy(dtype='float') > 0).any(axis=1)
+    summary_filename = compose_tile_filename(filename, 'summary')
+    jobs = [ (chart, df, summary_filename, date_title, { 'flagged_only': True }) ]
+    tiles = []
+    for tile, start in enumerate(range(0, len(df), tile_rows), 1):
+        stop = min(start + tile_rows, len(df))
+        tile_filename = compose_tile_filename(filename, tile)
+        tile_title = '%s - shops %s to %s of %s' % (date_title, start + 1, stop, len(df))
+        jobs.append((chart, df.iloc[start:stop], tile_filename, tile_title))
+        tiles.append({ 'filename': tile_filename, 'first': start + 1, 'last': stop,
+                       'flagged': int(flagged[start:stop].sum()) })
+    return jobs, { 'chart': chart, 'summary': summary_filename, 'shops': len(df),
+                   'flagged': int(flagged.sum()), 'tiles': tiles }
+
+
+def save_chart_index(filename, date_title, charts):
+    """ saves an html page with the summary of each tiled chart and the
+        links to its tiles, marking those with flagged shops
+
+        :param charts: list of the dicts of compose_chart_jobs()
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+
+    def link(path):
+        return html.escape(os.path.relpath(os.path.abspath(path), directory))
 
+    lines = [ '<!DOCTYPE html>', '<html><head><meta charset="utf-8">',
+              '<title>shopstats charts - %s</title></head><body>' % html.escape(date_title),
+              '<h1>shopstats charts - %s</h1>' % html.escape(date_title) ]
+    for chart in charts:
+        lines.append('<h2>%s: %s flagged shops of %s</h2>' % (html.escape(chart['chart']), chart['flagged'], chart['shops']))
+        lines.append('<p><img src="%s" alt="%s summary"></p>' % (link(chart['summary']), html.escape(chart['chart'])))
+        lines.append('<ul>')
+        for tile in chart['tiles']:
+            flagged = ' (<strong>%s flagged</strong>)' % tile['flagged'] if tile['flagged'] else ''
+            lines.append('<li><a href="%s">shops %s to %s</a>%s</li>' % (link(tile['filename']), tile['first'], tile['last'], flagged))
+        lines.append('</ul>')
+    lines.append('</body></html>')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
 
 
+# formats of the stats outputs. The columnar ones (feather, parquet) require pyarrow
+stats_formats = ('csv', 'feather', 'parquet')
+
+# suffixes of the stats columns containing integer counters
+counter_suffixes = ('_count', '_distinct', '_malformed', '_refunds', '_zeros')
+
+
+def columnar_formats_available():
+    """ returns True when the columnar stats_formats can be saved """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def apply_stats_schema(df):
+    """ returns the stats with the schema of the columnar outputs
+        - categorical period, chain_id, shop_id and shop_name
+        - nullable integer counters (columns ending with counter_suffixes)
+        - float for the rest of columns, e.g. billing
+    """
+    dtypes = {}
+    for column in df.columns:
+        if column in ('period', 'chain_id', 'shop_id', 'shop_name'):
+            dtypes[column] = 'category'
+        elif column.endswith(counter_suffixes):
+            dtypes[column] = 'Int64'
+        else:
+            dtypes[column] = 'float64'
+    return df.astype(dtypes)
+
+
+def write_stats(df, filename, stats_format, index=True):
+    """ writes the stats in one of the stats_formats
+        :param index: whether the csv includes the index of df. The columnar
+                      formats only include a named index, as a column
+    """
+    if stats_format == 'csv':
+        df.to_csv(filename, index=index)
+    elif stats_format == 'feather':
+        # uncompressed, so it's loaded without decompressing it
+        apply_stats_schema(df).reset_index(drop=df.index.name is None).to_feather(filename, compression='uncompressed')
+    elif stats_format == 'parquet':
+        apply_stats_schema(df).reset_index(drop=df.index.name is None).to_parquet(filename, index=False)
+    else:
+        raise ValueError('Unknown stats format %s' % stats_format)
+
+
+def save_stats(df, label, formats=('csv',), index=True):
+    """ saves the stats in each of the formats at filename_templates[format] % label
+        See write_stats()
+        returns the list of saved filenames
+    """
+    filenames = []
+    for stats_format in formats:
+        filename = filename_templates[stats_format] % label
+        with metrics.timer('stage_seconds', stage='write_%s' % stats_format):
+            write_stats(df, filename, stats_format, index=index)
+        filenames.append(filename)
+    return filenames
+
+
+def get_shard_label(period, shard):
+    """ returns the label of the outputs of a shard (i, N) of a period
+
+        >>> get_shard_label(datetime.date(2019, 6, 1), (2, 4))
+        '201906_shard2of4'
+    """
+    return '%s_shard%sof%s' % ((period.strftime('%Y%m'),) + tuple(shard))
+
+
+def save_period_outputs(df, period, sketches=None, formats=('csv',), shard=None, malformed=None, tile_rows=None):
+    """ saves the sorted stats of a period in the given formats and,
+        when given, its sketches and their rollup, and the samples of its
+        malformed entries
+        returns the chart jobs of the period for render_charts()
+
+        :param shard: (i, N) when df contains a shard of the shops. Its
+                      outputs are labelled with the shard and it has no
+                      charts: they're rendered once the shards are merged
+                      by shopmerge.py
+        :param tile_rows: shops of each tile of the charts. When they're
+                          tiled, their index is saved. See compose_chart_jobs()
+    """
+    label = get_shard_label(period, shard) if shard else period.strftime('%Y%m')
+    for filename in save_stats(df, label, formats):
+        print("Output saved at %s" % filename)
+    if sketches is not None:
+        shopsketch.save_sketches(filename_templates['sketches'] % label, sketches)
+        print("Sketches saved at %s" % filename_templates['sketches'] % label)
+        if not shard:
+            shopsketch.rollup(sketches).to_csv(get_filename('rollup_csv', period), index=False)
+            print("Distinct rollup saved at %s" % get_filename('rollup_csv', period))
+    if malformed is not None:
+        shopmalformed.save_samples(filename_templates['malformed_entries'] % label, malformed)
+        print("Malformed entries saved at %s" % filename_templates['malformed_entries'] % label)
+    if shard:
+        return []
+    date_title = get_period_title(period)
+    jobs = []
+    tiled_charts = []
+    for chart in chart_functions:
+        chart_jobs, tiled = compose_chart_jobs(chart, df, get_filename(chart, period), date_title, tile_rows)
+        jobs += chart_jobs
+        if tiled:
+            tiled_charts.append(tiled)
+    if tiled_charts:
+        save_chart_index(get_filename('chart_index', period), date_title, tiled_charts)
+        print("Chart index saved at %s" % get_filename('chart_index', period))
+    return jobs
+
+
+def parse_arguments(argv=None):
+    """ parses the command line arguments """
+    parser = argparse.ArgumentParser(description='Extracts the shop stats from the Bitphy API')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of concurrent requests to the API (default: 1)')
+    parser.add_argument('--backfill', nargs=2, type=parse_period, metavar=('FIRST', 'LAST'),
+                        help='computes each month from FIRST to LAST (YYYYMM) instead of the current month')
+    parser.add_argument('--combined', action='store_true',
+                        help='also saves the stats of all the months in a single table with a period column')
+    parser.add_argument('--format', nargs='+', choices=stats_formats, default=['csv'], dest='formats',
+                        help='formats of the stats outputs (default: csv). feather and parquet require pyarrow')
+    parser.add_argument('--chart-processes', type=int, metavar='N',
+                        help='number of processes rendering the charts (default: one per CPU)')
+    parser.add_argument('--chart-tile-rows', type=int, default=chart_tile_rows, metavar='N',
+                        help='charts of more than N shops are rendered as a summary of the flagged shops '
+                             'and tiles of N shops, 0 for single charts (default: %(default)s)')
+    parser.add_argument('--retries', type=int, default=http_pool_params['retries'],
+                        help='retries of a request on 5xx, timeouts and connection resets (default: %(default)s)')
+    parser.add_argument('--max-in-flight', type=int, metavar='N',
+                        help='maximum requests in flight to each host. It is decreased while the API throttles '
+                             '(default: the number of workers)')
+    parser.add_argument('--rate', type=parse_rate, metavar='REQUESTS',
+                        help='maximum requests per second to each host (default: unlimited)')
+    parser.add_argument('--host-rate', nargs=2, action='append', default=[], metavar=('HOST', 'REQUESTS'),
+                        help='maximum requests per second to the given host[:port], overriding --rate')
+    parser.add_argument('--json-decoder', choices=[ 'auto' ] + list(shopjson.decoders), default='auto',
+                        help='JSON decoder of the responses. auto is orjson when installed (default: %(default)s)')
+    parser.add_argument('--nodepoints', metavar='FILENAME', default=nodepoint_specs_filename,
+                        help='JSON file of the nodepoint specs (default: nodepoints.json)')
+    parser.add_argument('--stream', action='store_true',
+                        help='process the entries while they are received, with constant memory')
+    parser.add_argument('--sketch-error', type=float, metavar='ERROR',
+                        help='saves mergeable sketches of the raw nodepoints with the given relative error '
+                             '(e.g. 0.01) and the distinct estimates of each chain')
+    parser.add_argument('--malformed-sample', type=int, default=shopmalformed.DEFAULT_SAMPLE_SIZE, metavar='N',
+                        help='malformed entries kept for each nodepoint of each shop, saved with the count of '
+                             'their missing keys at malformed_entries_YYYYMM.jsonl. 0 to disable (default: %(default)s)')
+    parser.add_argument('--cache', metavar='FILENAME',
+                        help='file of the persistent cache of the API responses (default: no cache)')
+    parser.add_argument('--cache-ttl', type=int, default=shopcache.DEFAULT_TTL,
+                        help='seconds before a cached response of the current month is revalidated (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=shopcache.DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help='size limit in MB of the persistent cache (default: %(default)s)')
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help='only processes the shops of the shard i of N. See shopmerge.py')
+    parser.add_argument('--journal', metavar='FILENAME',
+                        help='file where the counters of each nodepoint are written once computed')
+    parser.add_argument('--resume', action='store_true',
+                        help='skips the nodepoints already in the --journal of an interrupted run')
+    parser.add_argument('--metrics-json', metavar='FILENAME',
+                        help='saves the metrics of the stages of the run as JSON')
+    parser.add_argument('--metrics-prom', metavar='FILENAME',
+                        help='saves the metrics of the stages of the run as a Prometheus textfile')
+    parser.add_argument('--store', metavar='FILENAME',
+                        help='sqlite file of the historical store where the stats of each period are appended')
+    parser.add_argument('--log-level', choices=[ 'DEBUG', 'INFO', 'WARNING', 'ERROR' ], default='INFO',
+                        help='level of the logged messages (default: %(default)s)')
+    parser.add_argument('--log-burst', type=int, default=10, metavar='N',
+                        help='repeated messages (malformed entries, failed requests...) logged per interval '
+                             '(default: %(default)s)')
+    parser.add_argument('--log-interval', type=float, default=60, metavar='SECONDS',
+                        help='interval of the rate limit of the repeated messages (default: %(default)s)')
+    arguments = parser.parse_args(argv)
+    if arguments.backfill and arguments.backfill[0] > arguments.backfill[1]:
+        parser.error('--backfill FIRST must not be after LAST')
+    try:
+        arguments.host_rate = [ (host, parse_rate(rate)) for host, rate in arguments.host_rate ]
+    except argparse.ArgumentTypeError as e:
+        parser.error('argument --host-rate: %s' % e)
+    if arguments.resume and not arguments.journal:
+        parser.error('--resume requires --journal')
+    if arguments.shard and arguments.combined:
+        parser.error('--combined is not available with --shard')
+    return arguments
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if set(arguments.formats) - { 'csv' } and not columnar_formats_available():
+        sys.exit("pyarrow is required to save the stats as %s" % ' and '.join(arguments.formats))
+    logging.basicConfig(filename='%s.log'%sys.argv[0],level=arguments.log_level, format="%(asctime)s %(levelname)s: %(message)s")
+    rate_limit = shoplog.install_rate_limit(interval=arguments.log_interval, burst=arguments.log_burst)
+    logging.info('\n'*3)
+    configure_session(pool_size=max(arguments.workers, 1), retries=arguments.retries)
+    try:
+        configure_json_decoder(arguments.json_decoder)
+    except ValueError as e:
+        sys.exit(str(e))
+    configure_scheduler(max_in_flight=arguments.max_in_flight, rate=arguments.rate,
+                        host_limits={ host: { 'rate': rate } for host, rate in arguments.host_rate })
+    configure_response_cache(arguments.cache, ttl=arguments.cache_ttl, max_bytes=arguments.cache_size * 1024 ** 2)
+    try:
+        nodepoint_specs = shopspecs.load_specs(arguments.nodepoints)
+    except (OSError, ValueError) as e:
+        sys.exit('Invalid nodepoint specs %s: %s' % (arguments.nodepoints, e))
+    if arguments.backfill:
+        periods = list(iter_periods(*arguments.backfill))
+    else:
+        periods = [ get_current_period() ]
+    # obtain results
+    sketches = {} if arguments.sketch_error else None
+    malformed = {} if arguments.malformed_sample > 0 else None
+    shops = None
+    if arguments.shard:
+        positions, shops = select_shard(get_shops(), arguments.shard)
+        logging.info('Shard %s of %s: %s shops', *arguments.shard, len(shops))
+    journal = None
+    if arguments.journal:
+        journal = shopjournal.Journal(arguments.journal, resume=arguments.resume)
+        if arguments.resume:
+            logging.info('Resuming with %s nodepoints of the journal %s', len(journal), arguments.journal)
+    dataframes = generate_dataframes(nodepoint_specs, periods, workers=arguments.workers,
+                                     streaming=arguments.stream,
+                                     sketches=sketches, sketch_error=arguments.sketch_error,
+                                     shops=shops, journal=journal,
+                                     malformed=malformed, malformed_sample_size=arguments.malformed_sample)
+    if journal:
+        journal.close()
+    logging.info('HTTP stats: %s', get_http_stats())
+    logging.info('Fetch stats: %s', fetch_stats)
+    logging.info('Scheduler stats: %s', get_scheduler().get_stats())
+    logging.info('JSON decoding with %s (MB/s): %s', json_decoder, get_decode_throughput())
+    if response_cache:
+        logging.info('Response cache stats: %s', response_cache.get_stats())
+    # Store results
+    dataframes = { period: sort_columns(df) for period, df in dataframes.items() }
+    if arguments.shard:
+        # the position of each shop in a single node run, to merge the shards
+        for df in dataframes.values():
+            df.index = pd.Index(positions, name='shop_position')
+    chart_jobs = []
+    for period, df in dataframes.items():
+        chart_jobs += save_period_outputs(df, period, sketches[period] if sketches is not None else None,
+                                          formats=arguments.formats, shard=arguments.shard,
+                                          malformed=malformed[period] if malformed is not None else None,
+                                          tile_rows=arguments.chart_tile_rows)
+    if arguments.combined:
+        combined_label = '%s_%s' % (periods[0].strftime('%Y%m'), periods[-1].strftime('%Y%m'))
+        for filename in save_stats(combine_periods(dataframes), combined_label, arguments.formats, index=False):
+            print("Combined output saved at %s" % filename)
+    if arguments.store:
+        store = shopstore.StatsStore(arguments.store)
+        for period, df in dataframes.items():
+            appended = store.append(period, df, shard=bool(arguments.shard))
+            logging.info('%s values of %s appended to the store %s', appended, period, arguments.store)
+        store.close()
+        print("Stats appended to the store %s" % arguments.store)
+    rendering = render_charts(chart_jobs, processes=arguments.chart_processes)
+    for filename, seconds in rendering['chart_seconds'].items():
+        print("Chart saved at %s (%.2fs)" % (filename, seconds))
+    print("Charts rendered in %.2fs with a peak RSS of %.0f MB (grown %.0f MB while rendering)"
+          % (rendering['wall_seconds'], rendering['peak_rss_mb'], rendering['chart_rss_growth_mb']))
+    logging.info('Chart rendering: %s', rendering)
+    logging.info('Log messages suppressed by the rate limit: %s', rate_limit.suppressed)
+    if arguments.metrics_json:
+        metrics.save_json(arguments.metrics_json)
+        print("Metrics saved at %s" % arguments.metrics_json)
+    if arguments.metrics_prom:
+        metrics.save_prometheus(arguments.metrics_prom)
+        print("Metrics saved at %s" % arguments.metrics_prom)
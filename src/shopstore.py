@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+"""
+    Historical store of the shopstats results
+
+    The stats of each period are appended to a sqlite file in long
+    format: one row per (period, chain_id, shop_id, column). Appending
+    the same period again replaces all its values, or those of the
+    appended shops for a shard, so runs can be repeated.
+
+    When run as a script, it prints the time series of a column for a
+    shop, or for all the shops when no shop is given.
+"""
+import sqlite3
+import sys
+import pandas as pd
+
+identity_columns = ( 'chain_id', 'shop_id', 'shop_name' )
+
+
+def format_period(period):
+    """ returns the period as stored: YYYYMM
+
+        >>> import datetime
+        >>> format_period(datetime.date(2019, 6, 1))
+        '201906'
+        >>> format_period('201906')
+        '201906'
+    """
+    return period if isinstance(period, str) else period.strftime('%Y%m')
+
+
+def upper_bound(prefix):
+    """ returns the smallest string greater than any string starting with prefix """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class StatsStore:
+    """ sqlite store of the stats of many periods """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS stats (
+                    period TEXT NOT NULL,
+                    chain_id TEXT NOT NULL,
+                    shop_id TEXT NOT NULL,
+                    "column" TEXT NOT NULL,
+                    value REAL,
+                    PRIMARY KEY (chain_id, shop_id, "column", period)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS stats_periods ON stats (period, chain_id, shop_id);
+                CREATE TABLE IF NOT EXISTS shops (
+                    chain_id TEXT NOT NULL,
+                    shop_id TEXT NOT NULL,
+                    shop_name TEXT,
+                    PRIMARY KEY (chain_id, shop_id));''')
+
+    def append(self, period, df, shard=False):
+        """ stores the stats DataFrame of a period, as generated by
+            shopstats.generate_dataframe(). The values already stored for
+            the period are replaced
+            returns the number of stored values
+
+            :param shard: when True, df only has some shops of the period
+                          and only the values of its shops are replaced
+        """
+        period = format_period(period)
+        columns = [ column for column in df.columns if column not in identity_columns ]
+        long_df = df.astype({ 'chain_id': str, 'shop_id': str }).melt(
+                id_vars=[ 'chain_id', 'shop_id' ], value_vars=columns, var_name='column')
+        long_df['value'] = long_df['value'].astype(float)
+        long_df = long_df.sort_values([ 'chain_id', 'shop_id', 'column' ])     # order of the primary key
+        values = [ (period, chain_id, shop_id, column, None if value != value else value)
+                   for chain_id, shop_id, column, value in zip(*(long_df[name].tolist() for name in long_df.columns)) ]
+        shops = [ (str(chain_id), str(shop_id), shop_name)
+                  for chain_id, shop_id, shop_name in df[list(identity_columns)].itertuples(index=False) ]
+        with self.connection:
+            if shard:
+                self.connection.executemany('DELETE FROM stats WHERE period = ? AND chain_id = ? AND shop_id = ?',
+                                            [ (period, chain_id, shop_id) for chain_id, shop_id, _ in shops ])
+            else:
+                self.connection.execute('DELETE FROM stats WHERE period = ?', (period,))
+            self.connection.executemany('INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?)', values)
+            self.connection.executemany('INSERT OR REPLACE INTO shops VALUES (?, ?, ?)', shops)
+        return len(values)
+
+    def periods(self):
+        """ returns the sorted list of stored periods """
+        return [ period for (period,) in self.connection.execute('SELECT DISTINCT period FROM stats ORDER BY period') ]
+
+    def shop_series(self, chain_id, shop_id, columns=None, first_period=None, last_period=None):
+        """ returns the time series of a shop as a DataFrame with a row
+            for each period and a column for each of the given columns
+            (all of them by default)
+        """
+        query = 'SELECT period, "column", value FROM stats WHERE chain_id = ? AND shop_id = ?'
+        params = [ chain_id, shop_id ]
+        query, params = self.restrict_periods(query, params, first_period, last_period)
+        if columns:
+            query += ' AND "column" IN (%s)' % ', '.join('?' * len(columns))
+            params += list(columns)
+        series = pd.DataFrame(self.connection.execute(query, params).fetchall(), columns=[ 'period', 'column', 'value' ])
+        series = series.pivot(index='period', columns='column', values='value').sort_index()
+        series.columns.name = None
+        return series.reindex(columns=list(columns)) if columns else series
+
+    def nodepoint_series(self, nodepoint, chain_id=None, shop_id=None, first_period=None, last_period=None):
+        """ returns the time series of the columns of a nodepoint
+            (<nodepoint>_count, ...) as a long DataFrame with the columns
+            period, chain_id, shop_id, column and value
+        """
+        prefix = '%s_' % nodepoint
+        query = 'SELECT period, chain_id, shop_id, "column", value FROM stats WHERE "column" >= ? AND "column" < ?'
+        params = [ prefix, upper_bound(prefix) ]
+        for name, value in (('chain_id', chain_id), ('shop_id', shop_id)):
+            if value is not None:
+                query += ' AND %s = ?' % name
+                params.append(value)
+        query, params = self.restrict_periods(query, params, first_period, last_period)
+        query += ' ORDER BY chain_id, shop_id, "column", period'
+        return pd.DataFrame(self.connection.execute(query, params).fetchall(),
+                            columns=[ 'period', 'chain_id', 'shop_id', 'column', 'value' ])
+
+    @staticmethod
+    def restrict_periods(query, params, first_period, last_period):
+        if first_period is not None:
+            query += ' AND period >= ?'
+            params = params + [ format_period(first_period) ]
+        if last_period is not None:
+            query += ' AND period <= ?'
+            params = params + [ format_period(last_period) ]
+        return query, params
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 5):
+        print("Usage: %s «store filename» «column» [«chain_id» «shop_id»]" % sys.argv[0])
+        sys.exit(1)
+    store = StatsStore(sys.argv[1])
+    column = sys.argv[2]
+    if len(sys.argv) == 5:
+        print(store.shop_series(sys.argv[3], sys.argv[4], [ column ]).to_string())
+    else:
+        series = store.connection.execute(
+                'SELECT period, chain_id, shop_id, value FROM stats WHERE "column" = ? ORDER BY period',
+                (column,)).fetchall()
+        df = pd.DataFrame(series, columns=[ 'period', 'chain_id', 'shop_id', 'value' ])
+        print(df.pivot(index=['chain_id', 'shop_id'], columns='period', values='value').to_string())
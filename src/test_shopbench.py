@@ -0,0 +1,32 @@
+"""
+    Unitary Testing for the shopbench
+"""
+import json
+import shopstats
+import shopbench
+
+
+def test_synthetic_payloads_have_malformed_and_duplicated_entries():
+    payloads = shopbench.synthetic_payloads(10000, malformed_ratio=0.05, distinct_ratio=0.5)
+    assert set(payloads) == { spec['name'] for spec in shopstats.get_nodepoint_specs() }
+    for spec in shopstats.get_nodepoint_specs():
+        entries = json.loads(payloads[spec['name']])
+        counters = shopbench.entries_processors[spec['type']](spec, entries)
+        count, _, malformed = counters
+        assert count + malformed == 10000
+        assert 300 < malformed < 800
+        if spec['type'] == 'raw':
+            assert counters[1] < count
+
+
+def test_bench_load_times_every_stage():
+    found = shopbench.bench_load_scenarios([ (3, 30) ])
+    assert set(found['3x30']) == { 'generate_dataframe', 'processor_raw', 'processor_aggregation',
+                                   'sort_columns' } | set(shopstats.chart_functions)
+
+
+def test_find_regressions():
+    baseline = { '10x1000': { 'generate_dataframe': 1.0, 'sort_columns': 0.001, 'processor_raw': 0.5 } }
+    results = { '10x1000': { 'generate_dataframe': 1.3, 'sort_columns': 0.005, 'processor_raw': 0.55, 'dup_chart': 2 },
+                '100x1000': { 'generate_dataframe': 10 } }
+    assert shopbench.find_regressions(results, baseline, tolerance=0.2) == [ ('10x1000', 'generate_dataframe', 1.0, 1.3) ]
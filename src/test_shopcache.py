@@ -0,0 +1,60 @@
+"""
+    Unitary Testing for the shopcache
+"""
+import time
+import shopcache
+
+
+def test_compose_key_when_params_differ():
+    url = 'http://api/chains/chain_1/shops/shop_1/sales'
+    assert shopcache.compose_key(url, { 'dateStart': '2019-06-01' }) != shopcache.compose_key(url, { 'dateStart': '2019-07-01' })
+    assert shopcache.compose_key(url) == shopcache.compose_key(url, {})
+
+
+def test_get_when_missing(tmp_path):
+    cache = shopcache.ResponseCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.get('missing') == (None, False)
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_put_and_get_are_persistent(tmp_path):
+    filename = str(tmp_path / 'cache.sqlite')
+    cache = shopcache.ResponseCache(filename)
+    cache.put('key', b'[1, 2, 3]', { 'content-type': 'application/json', 'etag': '"e"' }, closed=True)
+    cache.close()
+    entry, fresh = shopcache.ResponseCache(filename).get('key')
+    assert fresh
+    assert (entry.body, entry.content_type, entry.etag, entry.expires) == (b'[1, 2, 3]', 'application/json', '"e"', None)
+
+
+def test_get_when_expired(tmp_path):
+    cache = shopcache.ResponseCache(str(tmp_path / 'cache.sqlite'), ttl=10)
+    cache.put('key', b'[]', {})
+    now = time.time()
+    cache.clock = lambda: now + 11
+    entry, fresh = cache.get('key')
+    assert entry.body == b'[]' and not fresh
+    cache.refresh('key')
+    assert cache.get('key')[1]
+
+
+def test_put_when_compressed(tmp_path):
+    cache = shopcache.ResponseCache(str(tmp_path / 'cache.sqlite'))
+    body = b'[' + b'{"billing": 1},' * 10000 + b'{}]'
+    cache.put('key', body, {})
+    assert cache.size() < len(body) / 10
+    assert cache.get('key')[0].body == body
+
+
+def test_put_evicts_least_recently_used(tmp_path):
+    clock = iter(range(100))
+    cache = shopcache.ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=20)
+    cache.clock = lambda: next(clock)
+    cache.put('a', b'a', {})
+    cache.put('b', b'b', {})
+    cache.get('a')                  # b becomes the least recently used
+    cache.put('c', b'c', {})
+    assert cache.get('b') == (None, False)
+    assert cache.get('a')[0] and cache.get('c')[0]
+    assert cache.get_stats()['evictions'] == 1
+    assert cache.size() <= 20
@@ -0,0 +1,46 @@
+"""
+    Unitary Testing for the shopcharts
+"""
+import pytest
+import numpy as np
+import pandas as pd
+import shopstats
+import shopcharts
+
+
+def sample_stats():
+    return pd.DataFrame([
+        [ 'chain_1', 'shop_1', 'shopname_1', 10.5, 3, 2, 1 ],
+        [ 'chain_1', 'shop_2', 'shopname_2', np.nan, np.nan, np.nan, np.nan ],
+        ],
+        columns = [ 'chain_id', 'shop_id', 'shop_name', 'sales_billing',
+                    'customers_count', 'customers_distinct', 'customers_malformed' ])
+
+
+def test_load_shopstats_when_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filenames = shopstats.save_stats(sample_stats(), '201906', [ 'csv' ])
+    found = shopcharts.load_shopstats(filenames[0])
+    assert shopcharts.detect_format(filenames[0]) == 'csv'
+    assert found['shop_id'].dtype == 'category'
+    assert found['customers_count'].tolist()[0] == 3
+
+
+@pytest.mark.parametrize('stats_format', [ 'feather', 'parquet' ])
+def test_load_shopstats_when_columnar(tmp_path, monkeypatch, stats_format):
+    monkeypatch.chdir(tmp_path)
+    pytest.importorskip('pyarrow')
+    filenames = shopstats.save_stats(sample_stats(), '201906', [ stats_format ])
+    assert shopcharts.detect_format(filenames[0]) == stats_format
+    found = shopcharts.load_shopstats(filenames[0])
+    assert found['chain_id'].dtype == 'category'
+    assert found['customers_count'].dtype == 'Int64'
+    assert found['sales_billing'].dtype == 'float64'
+    assert found['customers_distinct'].tolist()[0] == 2
+    assert found['customers_distinct'].isna().tolist() == [ False, True ]
+    pd.testing.assert_frame_equal(found, shopstats.apply_stats_schema(sample_stats()))
+
+
+def test_get_data_context_from_filename_when_columnar():
+    assert shopcharts.get_data_context_from_filename('shopstats_201906.feather') == 'June 2019'
+    assert shopcharts.get_data_context_from_filename('shopstats_201906.parquet') == 'June 2019'
@@ -0,0 +1,90 @@
+"""
+    Unitary Testing for the shopfakeapi
+"""
+import datetime
+import random
+import pytest
+import requests
+import shopstats
+import shopfakeapi
+
+
+specs = [
+        { 'name': 'tickets', 'type': 'raw', 'equality_key': 'originalId', 'column_suffix': 'distinct' },
+        { 'name': 'products/sales', 'type': 'aggregation', 'aggregation_key': 'billing', 'subkey': 'productSales', 'column_suffix': 'billing' },
+        { 'name': 'sales', 'type': 'aggregation', 'aggregation_key': 'billing', 'subkey': None, 'column_suffix': 'billing' },
+        ]
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """ returns a function starting a FakeBitphyApi, pointed by shopstats """
+    monkeypatch.setattr(shopstats, 'http_pool_params', dict(shopstats.http_pool_params))
+    shopstats.configure_session(backoff_factor=0)
+    apis = []
+
+
+    def start(**params):
+        api = shopfakeapi.FakeBitphyApi(nodepoint_specs=specs, **params).start()
+        apis.append(api)
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': api.url_base, 'headers': {} })
+        return api
+
+    yield start
+    for api in apis:
+        api.stop()
+    shopstats.configure_session()
+
+
+def test_generate_dataframe_is_deterministic(fake_api):
+    period = datetime.date(2019, 6, 1)
+    fake_api(nshops=4, nchains=2, lines=200, malformed_ratio=0.1, seed=1)
+    first = shopstats.generate_dataframe(specs, workers=2, period=period)
+    fake_api(nshops=4, nchains=2, lines=200, malformed_ratio=0.1, seed=1)
+    second = shopstats.generate_dataframe(specs, workers=2, period=period)
+    assert first.equals(second)
+    assert first['shop_id'].tolist() == [ 'shop_0', 'shop_2', 'shop_1', 'shop_3' ]
+    assert (first['tickets_count'] + first['tickets_malformed']).between(100, 300).all()
+    assert (first['tickets_distinct'] < first['tickets_count']).all()
+    assert (first['sales_malformed'] > 0).all()
+    fake_api(nshops=4, nchains=2, lines=200, malformed_ratio=0.1, seed=1)
+    next_period = shopstats.generate_dataframe(specs, period=datetime.date(2019, 7, 1))
+    assert not first.equals(next_period)
+
+
+def test_errors_and_throttling(fake_api):
+    shopstats.configure_session(retries=0)
+    api = fake_api(nshops=2, error_rate=1, clock=lambda: 0)
+    assert shopstats.get_shops() == []
+    api.error_rate = 0
+    api.rate = 1    # both next requests are in the same second of the clock
+    shops = shopstats.get_shops()
+    assert len(shops) == 2
+    assert shopstats.get_nodepoint_entries(shops[0][0], shops[0][1], 'sales', datetime.date(2019, 6, 1))[0] == 'error'
+    stats = api.get_stats()
+    assert stats['errors'] == 1 and stats['throttled'] == 1 and stats['ok'] == 1
+
+
+def test_required_dates_and_unknown_endpoints(fake_api):
+    api = fake_api(nshops=1)
+    assert requests.get('%s/chains/chain_0/shops/shop_0/sales' % api.url_base).status_code == 400
+    assert requests.get('%s/chains/chain_0/shops/shop_9/sales' % api.url_base, params={ 'dateStart': 1, 'dateEnd': 2 }).status_code == 404
+    assert requests.get('%s/unknown' % api.url_base).status_code == 404
+
+
+def test_revalidated_by_response_cache(fake_api, tmp_path):
+    api = fake_api(nshops=1, lines=10)
+    shopstats.configure_response_cache(str(tmp_path / 'cache.sqlite'), ttl=0)
+    try:
+        first = shopstats.get_nodepoint_entries('chain_0', 'shop_0', 'tickets')
+        second = shopstats.get_nodepoint_entries('chain_0', 'shop_0', 'tickets')
+    finally:
+        shopstats.configure_response_cache()
+    assert first == second and first[0] == 'ok'
+    assert api.get_stats()['not_modified'] == 1
+
+
+def test_parse_latency():
+    with pytest.raises(ValueError):
+        shopfakeapi.parse_latency('normal:1')
+    assert 0.5 <= shopfakeapi.parse_latency('uniform:0.5:1')(random.Random(0)) <= 1
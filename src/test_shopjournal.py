@@ -0,0 +1,59 @@
+"""
+    Unitary Testing for the shopjournal
+"""
+import datetime
+import numpy as np
+import shopjournal
+from shopsketch import HyperLogLog
+
+
+def test_write_and_resume(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    sketch = HyperLogLog(precision=4)
+    sketch.update([ 'oid1', 'oid2' ])
+    journal = shopjournal.Journal(filename)
+    journal.write(datetime.date(2019, 6, 1), 'chain_1', 'shop_1', 'products', (np.int64(3), 2, 0), sketch)
+    journal.write(datetime.date(2019, 6, 1), 'chain_1', 'shop_1', 'sales', (2, 10.5, np.nan))
+    journal.close()
+    resumed = shopjournal.Journal(filename, resume=True)
+    counters, found_sketch = resumed.get(datetime.date(2019, 6, 1), 'chain_1', 'shop_1', 'products')
+    assert counters == (3, 2, 0)
+    assert found_sketch.count() == 2
+    counters, found_sketch = resumed.get('201906', 'chain_1', 'shop_1', 'sales')
+    assert counters[:2] == (2, 10.5) and np.isnan(counters[2]) and found_sketch is None
+    assert resumed.get('201907', 'chain_1', 'shop_1', 'sales') is None
+
+
+def test_without_resume_truncates(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    journal = shopjournal.Journal(filename)
+    journal.write('201906', 'chain_1', 'shop_1', 'products', (1, 1, 0))
+    journal.close()
+    shopjournal.Journal(filename).close()
+    assert len(shopjournal.Journal(filename, resume=True)) == 0
+
+
+def test_resume_when_incomplete_last_line(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    journal = shopjournal.Journal(filename)
+    journal.write('201906', 'chain_1', 'shop_1', 'products', (1, 1, 0))
+    journal.close()
+    with open(filename, 'a') as f:
+        f.write('{"period": "2019')
+    journal = shopjournal.Journal(filename, resume=True)
+    assert len(journal) == 1
+    journal.write('201906', 'chain_1', 'shop_2', 'products', (2, 2, 0))
+    journal.close()
+    assert len(shopjournal.Journal(filename, resume=True)) == 2
+
+
+def test_get_when_spec_digest_differs(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    journal = shopjournal.Journal(filename)
+    journal.write('201906', 'chain_1', 'shop_1', 'sales', (1, 1, 0), spec_digest='abc')
+    journal.write('201906', 'chain_1', 'shop_2', 'sales', (2, 2, 0))
+    journal.close()
+    resumed = shopjournal.Journal(filename, resume=True)
+    assert resumed.get('201906', 'chain_1', 'shop_1', 'sales', 'abc') == ((1, 1, 0), None)
+    assert resumed.get('201906', 'chain_1', 'shop_1', 'sales', 'def') is None
+    assert resumed.get('201906', 'chain_1', 'shop_2', 'sales', 'abc') is None
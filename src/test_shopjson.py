@@ -0,0 +1,47 @@
+"""
+    Unitary Testing for the shopjson
+"""
+import pytest
+import shopjson
+
+
+documents = [
+        b'[ { "originalId": "oid1", "name": "caf\\u00e9" }, { "billing": 10.25 }, { "billing": -0.1 } ]',
+        '[ { "name": "café ☃" }, { "billing": 1e-7 } ]'.encode('utf-8'),
+        '[ { "billing": 1 } ]'.encode('utf-16'),
+        b'[ { "billing": 123456789012345678901234567890 } ]',      # beyond 64 bits
+        b'[ { "billing": NaN } ]',
+        b'[ { "a": 1, "a": 2 } ]',
+        b'[]',
+        ]
+
+
+@pytest.mark.parametrize('document', documents)
+def test_decoders_give_identical_results(document):
+    expected = shopjson.get_decoder('json')(document)
+    for name in shopjson.available_decoders():
+        found = shopjson.get_decoder(name)(document)
+        assert repr(found) == repr(expected), name
+
+
+def test_decoders_raise_value_error_when_invalid():
+    for name in shopjson.available_decoders():
+        with pytest.raises(ValueError):
+            shopjson.get_decoder(name)(b'[ { "billing": 1 }, ')
+
+
+def test_get_decoder_when_unknown():
+    with pytest.raises(ValueError):
+        shopjson.get_decoder('simdjson')
+    assert shopjson.get_decoder('auto') is shopjson.decoders[shopjson.available_decoders()[-1]]
+
+
+def test_orjson_falls_back_only_on_big_integers(monkeypatch):
+    pytest.importorskip('orjson')
+    monkeypatch.setattr(shopjson, 'fallbacks', { 'not_accepted': 0, 'big_integers': 0 })
+    found = shopjson.loads_orjson(b'[ { "ean": "12345678901234567890", "billing": 12345678901234567890123 } ]')
+    assert found == [ { 'ean': '12345678901234567890', 'billing': 12345678901234567890123 } ]
+    assert shopjson.fallbacks == { 'not_accepted': 0, 'big_integers': 1 }
+    assert shopjson.loads_orjson(b'[ { "ean": "12345678901234567890" } ]') == [ { 'ean': '12345678901234567890' } ]
+    shopjson.loads_orjson(b'[ { "billing": NaN } ]')
+    assert shopjson.fallbacks == { 'not_accepted': 1, 'big_integers': 1 }
@@ -0,0 +1,61 @@
+"""
+    Unitary Testing for the shoplimit
+"""
+import threading
+import pytest
+import shoplimit
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_waits_beyond_burst():
+    clock = FakeClock()
+    bucket = shoplimit.TokenBucket(rate=10, burst=2, clock=clock)
+    assert [ bucket.reserve() for _ in range(4) ] == pytest.approx([ 0, 0, 0.1, 0.2 ])
+    clock.now += 1
+    assert bucket.reserve() == 0
+
+
+def test_window_decreases_once_per_epoch_and_increases_additively():
+    limiter = shoplimit.HostLimiter(max_window=8, clock=FakeClock())
+    tickets = [ limiter.acquire() for _ in range(8) ]
+    for ticket in tickets[:4]:
+        limiter.release(ticket, throttled=True)
+    assert limiter.window == 4
+    assert limiter.get_stats()['throttled'] == 4 and limiter.get_stats()['decreases'] == 1
+    for ticket in tickets[4:]:
+        limiter.release(ticket)
+    assert 4.9 < limiter.window < 5
+    limiter.release(limiter.acquire(), throttled=True)
+    assert limiter.window < 4
+
+
+def test_window_limits_in_flight():
+    limiter = shoplimit.HostLimiter(max_window=2)
+    tickets = [ limiter.acquire(), limiter.acquire() ]
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.1)
+    assert limiter.get_stats()['queued'] == 1
+    limiter.release(tickets[0])
+    assert acquired.wait(1)
+    thread.join()
+    assert limiter.get_stats()['in_flight'] == 2
+
+
+def test_scheduler_host_limits():
+    scheduler = shoplimit.RequestScheduler(max_window=4, host_limits={ 'slow:80': { 'max_window': 1 } })
+    assert scheduler.get_limiter('slow:80').max_window == 1
+    assert scheduler.get_limiter('fast:80').max_window == 4
+    scheduler.release('fast:80', scheduler.acquire('fast:80'), throttled=True)
+    stats = scheduler.get_stats()
+    assert stats['requests'] == 1 and stats['throttled'] == 1 and stats['in_flight'] == 0
+    assert stats['hosts']['fast:80']['window'] == 2
@@ -0,0 +1,72 @@
+"""
+    Unitary Testing for the shoplog
+"""
+import logging
+import shoplog
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Unprintable:
+    def __repr__(self):
+        raise AssertionError('payload formatted')
+
+
+def build_record(msg, *args, rate_limited=True, level=logging.WARNING):
+    record = logging.LogRecord('root', level, __file__, 1, msg, args, None)
+    if rate_limited:
+        record.rate_limited = True
+    return record
+
+
+def test_payload_when_large_is_truncated():
+    entries = [ { 'originalId': 'oid%s' % i, 'name': 'x' * 1000 } for i in range(100000) ]
+    text = str(shoplog.Payload(entries, max_chars=200))
+    assert len(text) <= 200
+    assert text.startswith('list of 100000: [')
+
+
+def test_payload_when_bytes_has_digest():
+    text = str(shoplog.Payload(b'[' + b'1,' * 10000 + b'1]', max_chars=100))
+    assert len(text) <= 100
+    assert text.startswith('bytes of 20003 (blake2b ')
+
+
+def test_payload_when_level_disabled_is_not_formatted(caplog):
+    with caplog.at_level(logging.INFO):
+        logging.debug('entries: %s', shoplog.Payload(Unprintable()))
+    assert caplog.records == []
+
+
+def test_rate_limit_filter_when_repeated():
+    clock = FakeClock()
+    rate_limit = shoplog.RateLimitFilter(interval=60, burst=2, clock=clock)
+    passed = [ rate_limit.filter(build_record('Request to %s failed', i)) for i in range(5) ]
+    assert passed == [ True, True, False, False, False ]
+    assert rate_limit.suppressed == 3
+    clock.now = 60
+    record = build_record('Request to %s failed', 5)
+    assert rate_limit.filter(record)
+    assert record.getMessage() == 'Request to 5 failed (3 similar messages suppressed)'
+    assert rate_limit.filter(build_record('Request to %s failed', 6))
+    assert not rate_limit.filter(build_record('Request to %s failed', 7))
+
+
+def test_rate_limit_filter_when_different_messages():
+    rate_limit = shoplog.RateLimitFilter(interval=60, burst=1, clock=FakeClock())
+    assert rate_limit.filter(build_record('Request to %s failed', 1))
+    assert rate_limit.filter(build_record('Request to %s failed', 1, level=logging.ERROR))
+    assert rate_limit.filter(build_record('Entry %s malformed', 1))
+    assert not rate_limit.filter(build_record('Entry %s malformed', 2))
+
+
+def test_rate_limit_filter_when_not_rate_limited():
+    rate_limit = shoplog.RateLimitFilter(interval=60, burst=1, clock=FakeClock())
+    assert all(rate_limit.filter(build_record('Nodepoint %s', i, rate_limited=False)) for i in range(5))
+    assert rate_limit.suppressed == 0
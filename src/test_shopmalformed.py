@@ -0,0 +1,78 @@
+"""
+    Unitary Testing for the shopmalformed
+"""
+import shopmalformed
+
+
+def test_malformed_sample_when_many_entries_is_bounded():
+    sample = shopmalformed.MalformedSample(size=5)
+    sample.update(({ 'id': i } for i in range(100000)), 'billing')
+    sample.update(({ 'id': i } for i in range(10)), 'sales')
+    assert sample.count == 100010
+    assert len(sample.entries) == 5
+    assert sample.missing_keys == { 'billing': 100000, 'sales': 10 }
+
+
+def test_malformed_sample_when_few_entries_keeps_them_all():
+    sample = shopmalformed.MalformedSample(size=5)
+    sample.update([ { 'id': 1 }, { 'id': 2 } ], 'originalId')
+    assert sample.entries == [ { 'id': 1 }, { 'id': 2 } ]
+
+
+def test_malformed_sample_is_uniform():
+    kept = [ 0 ] * 10
+    for seed in range(2000):
+        sample = shopmalformed.MalformedSample(size=2, seed=seed)
+        sample.update(({ 'id': i } for i in range(10)), 'billing')
+        for entry in sample.entries:
+            kept[entry['id']] += 1
+    # each entry is kept with probability 2/10
+    assert all(300 < count < 500 for count in kept), kept
+
+
+def test_malformed_sample_when_merged_is_weighted_by_count():
+    kept = { 'small': 0, 'large': 0 }
+    for seed in range(200):
+        small = shopmalformed.MalformedSample(size=10, seed=seed)
+        small.update(({ 'sample': 'small' } for _ in range(10)), 'billing')
+        large = shopmalformed.MalformedSample(size=10, seed=seed)
+        large.update(({ 'sample': 'large' } for _ in range(90)), 'billing')
+        small.merge(large)
+        assert small.count == 100 and len(small.entries) == 10
+        for entry in small.entries:
+            kept[entry['sample']] += 1
+    # each entry is kept with probability 10/100, whatever its sample
+    assert 1700 < kept['large'] < 1900, kept
+
+
+def test_malformed_sample_when_large_entry_is_truncated():
+    sample = shopmalformed.MalformedSample(size=1, max_chars=50)
+    sample.add({ 'sales': [ { 'nobilling': i } for i in range(1000) ] }, 'billing')
+    assert isinstance(sample.entries[0], str) and len(sample.entries[0]) == 50
+
+
+def test_save_and_load_samples(tmp_path):
+    filename = str(tmp_path / 'malformed_entries_201906.jsonl')
+    samples = {}
+    for shop_id, nodepoint, missing_key, count in (('shop_1', 'products', 'originalId', 3),
+                                                   ('shop_2', 'products', 'originalId', 1),
+                                                   ('shop_2', 'sales', 'billing', 7)):
+        samples[('chain_1', shop_id, nodepoint)] = sample = shopmalformed.MalformedSample(size=2)
+        sample.update(({ 'id': i } for i in range(count)), missing_key)
+    shopmalformed.save_samples(filename, samples)
+    loaded = shopmalformed.load_samples(filename)
+    assert { key: sample.to_dict() for key, sample in loaded.items() } == \
+           { key: sample.to_dict() for key, sample in samples.items() }
+    summary = shopmalformed.summarize(loaded)
+    assert summary.values.tolist() == [ [ 'sales', 'billing', 7, 1 ], [ 'products', 'originalId', 4, 2 ] ]
+
+
+def test_load_samples_when_repeated_merges_them(tmp_path):
+    filename = str(tmp_path / 'malformed_entries_201906.jsonl')
+    sample = shopmalformed.MalformedSample(size=2)
+    sample.update(({ 'id': i } for i in range(3)), 'billing')
+    shopmalformed.save_samples(filename, { ('chain_1', 'shop_1', 'sales'): sample })
+    samples = shopmalformed.load_samples(filename)
+    shopmalformed.load_samples(filename, samples)
+    merged = samples[('chain_1', 'shop_1', 'sales')]
+    assert merged.count == 6 and merged.missing_keys == { 'billing': 6 } and len(merged.entries) == 2
@@ -0,0 +1,101 @@
+"""
+    Unitary Testing for the shopmerge
+"""
+import datetime
+import pytest
+import numpy as np
+import pandas as pd
+import shopstats
+import shopmerge
+
+
+def sample_stats(nshops=20):
+    rows = [ [ 'chain_%s' % (i % 3), '%03d' % i, 'shopname_%s' % i, i * 1.5, i, i // 2, np.nan if i == 5 else 1 ]
+             for i in range(nshops) ]
+    return pd.DataFrame(rows, columns=[ 'chain_id', 'shop_id', 'shop_name', 'sales_billing',
+                                        'customers_count', 'customers_distinct', 'customers_malformed' ])
+
+
+def save_shards(df, nshards, formats, sketches=None, malformed=None):
+    """ saves the outputs of each shard of df as shopstats.py --shard does """
+    shops = list(df[[ 'chain_id', 'shop_id', 'shop_name' ]].itertuples(index=False, name=None))
+    filenames = []
+    for shard in range(1, nshards + 1):
+        positions, shard_shops = shopstats.select_shard(shops, (shard, nshards))
+        shard_df = df.iloc[positions].copy()
+        shard_df.index = pd.Index(positions, name='shop_position')
+        shard_keys = { shop[:2] for shop in shard_shops }
+        shard_sketches = shard_malformed = None
+        if sketches is not None:
+            shard_sketches = { key: sketch for key, sketch in sketches.items() if key[:2] in shard_keys }
+        if malformed is not None:
+            shard_malformed = { key: sample for key, sample in malformed.items() if key[:2] in shard_keys }
+        assert shopstats.save_period_outputs(shard_df, datetime.date(2019, 6, 1), formats=formats,
+                                             shard=(shard, nshards), sketches=shard_sketches,
+                                             malformed=shard_malformed) == []
+        filenames += [ shopstats.filename_templates[stats_format] % shopstats.get_shard_label(datetime.date(2019, 6, 1), (shard, nshards))
+                       for stats_format in formats ]
+    return filenames
+
+
+@pytest.mark.parametrize('stats_format', [ 'csv', 'feather', 'parquet' ])
+def test_merge_shards_same_as_single_node(tmp_path, monkeypatch, stats_format):
+    if stats_format != 'csv':
+        pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    expected = shopstats.sort_columns(sample_stats())
+    filenames = save_shards(expected, 3, [ stats_format ])
+    assert shopmerge.check_shards(filenames) == datetime.date(2019, 6, 1)
+    found = shopmerge.merge_shards([ shopmerge.load_shard(filename) for filename in filenames ])
+    pd.testing.assert_frame_equal(expected, found, check_dtype=False)
+
+
+def test_merge_shards_when_duplicated_shop(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filenames = save_shards(sample_stats(), 2, [ 'csv' ])
+    with pytest.raises(ValueError):
+        shopmerge.merge_shards([ shopmerge.load_shard(filename) for filename in filenames + filenames[:1] ])
+
+
+def test_check_shards_when_missing_shard():
+    with pytest.raises(ValueError):
+        shopmerge.check_shards([ 'shopstats_201906_shard1of3.csv', 'shopstats_201906_shard3of3.csv' ])
+    with pytest.raises(ValueError):
+        shopmerge.check_shards([ 'shopstats_201906_shard1of2.csv', 'shopstats_201907_shard2of2.csv' ])
+
+
+def test_load_shard_sketches_same_rollup_as_single_node(tmp_path, monkeypatch):
+    import shopsketch
+    monkeypatch.chdir(tmp_path)
+    df = sample_stats()
+    sketches = {}
+    for chain_id, shop_id in df[[ 'chain_id', 'shop_id' ]].itertuples(index=False):
+        sketches[(chain_id, shop_id, 'customers')] = sketch = shopsketch.HyperLogLog(precision=8)
+        sketch.update([ 'oid%s' % i for i in range(int(shop_id)) ])
+    filenames = save_shards(df, 3, [ 'csv' ], sketches)
+    found = shopmerge.load_shard_sketches(filenames)
+    assert { key: sketch.to_dict() for key, sketch in found.items() } == \
+           { key: sketch.to_dict() for key, sketch in sketches.items() }
+    pd.testing.assert_frame_equal(shopsketch.rollup(found), shopsketch.rollup(sketches))
+    (tmp_path / shopmerge.compose_sketches_filename(filenames[1])).unlink()
+    with pytest.raises(ValueError, match='Missing sketches'):
+        shopmerge.load_shard_sketches(filenames)
+    assert shopmerge.load_shard_sketches([ 'shopstats_201906_shard1of1.csv' ]) is None
+
+
+def test_load_shard_malformed_same_as_single_node(tmp_path, monkeypatch):
+    import shopmalformed
+    monkeypatch.chdir(tmp_path)
+    df = sample_stats()
+    malformed = {}
+    for chain_id, shop_id in df[[ 'chain_id', 'shop_id' ]].itertuples(index=False):
+        malformed[(chain_id, shop_id, 'customers')] = sample = shopmalformed.MalformedSample(size=2)
+        sample.update(({ 'id': i } for i in range(int(shop_id) % 4)), 'originalId')
+    filenames = save_shards(df, 3, [ 'csv' ], malformed=malformed)
+    found = shopmerge.load_shard_malformed(filenames)
+    assert { key: sample.to_dict() for key, sample in found.items() } == \
+           { key: sample.to_dict() for key, sample in malformed.items() }
+    (tmp_path / shopmerge.compose_shard_filename(filenames[1], 'malformed_entries')).unlink()
+    with pytest.raises(ValueError, match='Missing malformed entries'):
+        shopmerge.load_shard_malformed(filenames)
+    assert shopmerge.load_shard_malformed([ 'shopstats_201906_shard1of1.csv' ]) is None
@@ -0,0 +1,64 @@
+"""
+    Unitary Testing for the shopmetrics
+"""
+import json
+import pytest
+import shopmetrics
+
+
+def sample_metrics():
+    metrics = shopmetrics.Metrics(prefix='test')
+    metrics.define('request_seconds', 'histogram', 'Request seconds', buckets=(0.1, 1))
+    metrics.define('errors', 'counter', 'Errors')
+    metrics.define('shop_seconds', 'counter', 'Seconds of the slowest shops', top=2)
+    return metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = shopmetrics.Histogram((0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [ (0.1, 2), (1, 3), (float('inf'), 4) ]
+    found = histogram.to_dict()
+    assert found['count'] == 4 and found['sum'] == pytest.approx(2.65)
+    assert found['min'] == 0.05 and found['max'] == 2
+    assert found['buckets'] == { '0.1': 2, '1': 3, '+Inf': 4 }
+
+
+def test_to_prometheus():
+    metrics = sample_metrics()
+    metrics.observe('request_seconds', 0.5, nodepoint='products')
+    metrics.increment('errors', nodepoint='sales')
+    metrics.increment('errors', 2, nodepoint='sales')
+    found = metrics.to_prometheus().splitlines()
+    assert found[:7] == [
+            '# HELP test_request_seconds Request seconds',
+            '# TYPE test_request_seconds histogram',
+            'test_request_seconds_bucket{nodepoint="products",le="0.1"} 0',
+            'test_request_seconds_bucket{nodepoint="products",le="1"} 1',
+            'test_request_seconds_bucket{nodepoint="products",le="+Inf"} 1',
+            'test_request_seconds_sum{nodepoint="products"} 0.5',
+            'test_request_seconds_count{nodepoint="products"} 1',
+            ]
+    assert 'test_errors{nodepoint="sales"} 3' in found
+
+
+def test_top_exports_the_largest_series(tmp_path):
+    metrics = sample_metrics()
+    for shop_id, seconds in (('shop_1', 1), ('shop_2', 5), ('shop_3', 3)):
+        metrics.increment('shop_seconds', seconds, shop_id=shop_id)
+    metrics.save_json(str(tmp_path / 'metrics.json'))
+    with open(tmp_path / 'metrics.json') as f:
+        found = json.load(f)['shop_seconds']['series']
+    assert found == [ { 'labels': { 'shop_id': 'shop_2' }, 'value': 5 }, { 'labels': { 'shop_id': 'shop_3' }, 'value': 3 } ]
+    metrics.save_prometheus(str(tmp_path / 'metrics.prom'))
+    assert 'shop_1' not in (tmp_path / 'metrics.prom').read_text()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [ 'metrics.json', 'metrics.prom' ]
+
+
+def test_timer_observes_when_exception():
+    metrics = sample_metrics()
+    with pytest.raises(KeyError):
+        with metrics.timer('request_seconds', nodepoint='products'):
+            raise KeyError()
+    assert metrics.get('request_seconds', nodepoint='products').count == 1
@@ -0,0 +1,92 @@
+"""
+    Unitary Testing for the shopsketch
+"""
+import pytest
+import numpy as np
+import shopsketch
+from shopsketch import HyperLogLog
+
+
+def sketch_of(values, error=0.01):
+    sketch = HyperLogLog(error=error)
+    sketch.update(values)
+    return sketch
+
+
+@pytest.mark.parametrize('ndistinct', [0, 1, 100, 10000, 200000])
+def test_count_within_error(ndistinct):
+    sketch = sketch_of('oid%s' % (i % ndistinct) for i in range(2 * ndistinct))
+    assert abs(sketch.count() - ndistinct) <= 3 * 0.01 * ndistinct + 1
+
+
+def test_precision_when_error():
+    assert HyperLogLog(error=0.01).precision == 14
+    assert HyperLogLog(error=0.05).precision == 9
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=30)
+
+
+def test_merge_same_as_union():
+    first = sketch_of('oid%s' % i for i in range(0, 6000))
+    second = sketch_of('oid%s' % i for i in range(4000, 10000))
+    union = sketch_of('oid%s' % i for i in range(0, 10000))
+    first.merge(second)
+    assert np.array_equal(first.registers, union.registers)
+
+
+def test_merge_when_different_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=10).merge(HyperLogLog(precision=11))
+
+
+def test_save_and_load_sketches(tmp_path):
+    filename = str(tmp_path / 'sketches.jsonl')
+    sketches = {
+            ('chain_1', 'shop_1', 'customers'): sketch_of([ 'a', 'b' ]),
+            ('chain_1', 'shop_2', 'customers'): sketch_of([ 'b', 'c' ]),
+            }
+    shopsketch.save_sketches(filename, sketches)
+    loaded = shopsketch.load_sketches(filename)
+    assert loaded.keys() == sketches.keys()
+    for key, sketch in sketches.items():
+        assert np.array_equal(loaded[key].registers, sketch.registers)
+    merged = shopsketch.load_sketches(filename, shopsketch.load_sketches(filename))
+    assert merged[('chain_1', 'shop_1', 'customers')].count() == 2
+
+
+def test_rollup():
+    sketches = {
+            ('chain_1', 'shop_1', 'customers'): sketch_of([ 'a', 'b' ]),
+            ('chain_1', 'shop_2', 'customers'): sketch_of([ 'b', 'c' ]),
+            ('chain_2', 'shop_1', 'customers'): sketch_of([ 'c', 'd' ]),
+            ('chain_2', 'shop_1', 'products'): sketch_of([ 'p' ]),
+            }
+    found = shopsketch.rollup(sketches)
+    assert list(found.columns) == [ 'chain_id', 'customers_distinct_estimate', 'products_distinct_estimate' ]
+    assert found.values.tolist()[0][:2] == [ 'chain_1', 3 ]
+    assert found.values.tolist()[1] == [ 'chain_2', 2, 1 ]
+    assert found.values.tolist()[2] == [ shopsketch.ALL_CHAINS, 4, 1 ]
+    assert np.isnan(found.values.tolist()[0][2])
+
+
+@pytest.mark.parametrize('distribution', [ 'uniform', 'lognormal' ])
+def test_tdigest_quantiles_have_small_rank_error(distribution):
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-10, 500, 100000) if distribution == 'uniform' else rng.lognormal(3, 1, 100000)
+    digest = shopsketch.TDigest()
+    for chunk in np.array_split(values, 77):
+        digest.update(chunk)
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        rank = np.mean(values < digest.quantile(q))
+        assert abs(rank - q) < 0.005, (q, rank)
+    assert digest.quantile(0) == values.min() and digest.quantile(1) == values.max()
+    assert len(digest.means) <= digest.compression
+
+
+def test_tdigest_when_few_values():
+    digest = shopsketch.TDigest()
+    assert np.isnan(digest.quantile(0.5))
+    digest.update([ 3 ])
+    assert digest.quantile(0.5) == 3
+    digest.update([ 1, 2 ])
+    assert digest.quantile(0.5) == 2
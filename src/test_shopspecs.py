@@ -0,0 +1,136 @@
+"""
+    Unitary Testing for the shopspecs
+"""
+import json
+import math
+import logging
+import pytest
+import shopbench
+import shopmalformed
+import shopspecs
+
+raw_spec = { 'name': 'test', 'type': 'raw', 'equality_key': 'originalId', 'column_suffix': 'distinct' }
+aggregation_spec = { 'name': 'test', 'type': 'aggregation', 'aggregation_key': 'billing', 'column_suffix': 'billing', 'subkey': 'sales' }
+aggregation_no_subkey_spec = dict(aggregation_spec, subkey=None)
+
+
+@pytest.mark.parametrize('nodepoint_spec, entries', [
+    (raw_spec, []),
+    (raw_spec, [ { 'originalId': 'oid1' }, { 'originalId': 'oid1' }, { 'id': 'bad' }, { 'originalId': 2 } ]),
+    (raw_spec, [ { 'originalId': 1 }, { 'originalId': 1.0 }, { 'originalId': True }, { 'originalId': None } ]),
+    (raw_spec, [ { 'originalId': -1 }, { 'originalId': -2 }, { 'originalId': 'a' }, { 'originalId': 2 ** 64 - 1 } ]),
+    (aggregation_spec, []),
+    (aggregation_spec, [ { 'sales': [ { 'billing': 1 }, { 'nobilling': 2 } ] }, { 'other': [] }, { 'sales': [] } ]),
+    (aggregation_spec, [ { 'sales': [ { 'billing': 1e16 }, { 'billing': 1 }, { 'billing': -1e16 }, { 'billing': 0.1 } ] } ]),
+    (aggregation_no_subkey_spec, [ { 'billing': 0.1 }, { 'billing': 0.2 }, { 'billing': 3 }, { 'billing': -0.3 } ]),
+    (aggregation_no_subkey_spec, [ { 'billing': 2 ** 62 }, { 'billing': 2 ** 62 }, { 'billing': 1 } ]),
+    ])
+def test_compiled_spec_same_as_entries_processors(nodepoint_spec, entries):
+    expected_sample = shopmalformed.MalformedSample()
+    expected = shopbench.entries_processors[nodepoint_spec['type']](nodepoint_spec, entries, malformed_sample=expected_sample)
+    found_sample = shopmalformed.MalformedSample()
+    found = shopspecs.compile_spec(nodepoint_spec).process(entries, malformed_sample=found_sample)
+    assert expected == found
+    assert [ type(value) for value in expected ] == [ type(value) for value in found ]
+    assert expected_sample.to_dict() == found_sample.to_dict()
+
+
+@pytest.mark.parametrize('nodepoint_spec', [ raw_spec, aggregation_spec ])
+def test_accumulator_when_updated_in_batches_same_as_process(nodepoint_spec):
+    entries = [ { 'originalId': i % 7, 'sales': [ { 'billing': i * 0.1 }, { 'nobilling': 1 } ] } for i in range(100) ] + \
+              [ { 'id': 1 } ] + [ { 'originalId': 1, 'sales': [ { 'billing': 3 } ] } ] * 10
+    compiled = shopspecs.compile_spec(dict(nodepoint_spec, aggregations=[ 'min', 'max', 'sum_squares' ])
+                                      if nodepoint_spec['type'] == 'aggregation' else nodepoint_spec)
+    accumulator = compiled.accumulator()
+    for start in range(0, len(entries), 7):
+        accumulator.update(entries[start:start + 7])
+    assert accumulator.counters() == compiled.process(entries)
+
+
+def test_compiled_spec_when_nested_paths():
+    spec = { 'name': 'tickets', 'type': 'aggregation', 'subkey': 'detail.lines', 'aggregation_key': 'amounts.billing',
+             'column_suffix': 'billing' }
+    entries = [
+            { 'detail': { 'lines': [ { 'amounts': { 'billing': 1 } }, { 'amounts': { 'billing': 2 } }, { 'amounts': 3 } ] } },
+            { 'detail': [] },
+            { 'lines': [] },
+            ]
+    sample = shopmalformed.MalformedSample()
+    assert shopspecs.compile_spec(spec).process(entries, malformed_sample=sample) == (2, 3, 3)
+    assert sample.missing_keys == { 'detail.lines': 2, 'amounts.billing': 1 }
+
+
+def test_compiled_spec_logs_malformed_entries_in_debug(caplog):
+    entries = [ { 'sales': [ { 'billing': 1 }, { 'nobilling': 2 } ] }, { 'other': [] } ]
+    compiled = shopspecs.compile_spec(aggregation_spec)
+    with caplog.at_level(logging.INFO):
+        compiled.process(entries)
+    assert caplog.records == []
+    with caplog.at_level(logging.DEBUG):
+        compiled.process(entries)
+    assert [ record.getMessage() for record in caplog.records ] == [
+            "Entry of nodepoint test doesn't contain sales: dict of 1: {'other': []}",
+            "Entry of nodepoint test doesn't contain billing: dict of 1: {'nobilling': 2}",
+            ]
+    raw = { 'name': 'customers', 'type': 'raw', 'equality_key': 'ids.original', 'column_suffix': 'distinct' }
+    entries = [ { 'ids': { 'original': 'a' } }, { 'ids': { 'original': 'a' } }, { 'ids': { 'other': 'b' } } ]
+    assert shopspecs.compile_spec(raw).process(entries) == (2, 1, 1)
+
+
+def test_compiled_spec_when_extra_aggregations():
+    spec = dict(aggregation_no_subkey_spec, aggregations=[ 'max', 'min', 'sum_squares' ])
+    entries = [ { 'billing': 2 }, { 'billing': -1 }, { 'billing': 3 }, { 'nobilling': 9 } ]
+    assert shopspecs.compile_spec(spec).process(entries) == (3, 4, 1, 3, -1, 14)
+    empty = shopspecs.compile_spec(spec).process([])
+    assert empty[:3] == (0, 0, 0) and math.isnan(empty[3]) and math.isnan(empty[4]) and empty[5] == 0
+
+
+def test_compiled_spec_when_statistics():
+    spec = dict(aggregation_spec, aggregations=[ 'mean', 'p50', 'refunds', 'zeros', 'p99.9' ])
+    entries = [ { 'sales': [ { 'billing': value } for value in (-5, 0, 0, 10, 20) ] }, { 'sales': [ { 'nobilling': 1 } ] } ]
+    assert shopspecs.compile_spec(spec).process(entries) == (5, 25, 1, 5, 0, 1, 2, pytest.approx(20))
+    empty = shopspecs.compile_spec(spec).process([])
+    assert empty[:3] == (0, 0, 0) and math.isnan(empty[3]) and math.isnan(empty[4]) and empty[5:7] == (0, 0)
+
+
+def test_compiled_spec_when_quantiles_of_many_values():
+    spec = dict(aggregation_no_subkey_spec, aggregations=[ 'p10', 'p50', 'p90' ])
+    entries = [ { 'billing': i } for i in range(1, 100001) ]
+    _, _, _, p10, p50, p90 = shopspecs.compile_spec(spec).process(entries)
+    assert p10 == pytest.approx(10000, rel=0.01)
+    assert p50 == pytest.approx(50000, rel=0.01)
+    assert p90 == pytest.approx(90000, rel=0.01)
+
+
+@pytest.mark.parametrize('spec, message', [
+    ({ 'type': 'raw', 'equality_key': 'id', 'column_suffix': 'distinct' }, 'without name'),
+    (dict(raw_spec, type='sum'), 'type must be'),
+    (dict(raw_spec, column_suffix=None), 'column_suffix'),
+    ({ 'name': 'test', 'type': 'raw', 'column_suffix': 'distinct' }, 'equality_key is required'),
+    (dict(aggregation_spec, aggregation_key='amounts..billing'), 'Invalid key path'),
+    (dict(aggregation_spec, aggregations=[ 'median' ]), 'aggregations must be'),
+    (dict(aggregation_spec, aggregations=[ 'min', 'min' ]), 'aggregations must be'),
+    (dict(aggregation_spec, aggregations=[ 'p100' ]), 'aggregations must be'),
+    (dict(raw_spec, aggregations=[ 'min' ]), 'only aggregation'),
+    (dict(raw_spec, endpoint=''), 'endpoint'),
+    (dict(raw_spec, params=[ 'detail' ]), 'params'),
+    (dict(raw_spec, params={ 'dateStart': '2019-01-01' }), 'period params dateStart'),
+    ])
+def test_compile_spec_when_invalid(spec, message):
+    with pytest.raises(ValueError, match=message):
+        shopspecs.compile_spec(spec)
+
+
+def test_compile_specs_when_repeated_names():
+    with pytest.raises(ValueError, match='Repeated'):
+        shopspecs.compile_specs([ raw_spec, aggregation_spec ])
+
+
+def test_load_specs(tmp_path):
+    assert [ spec['name'] for spec in shopspecs.load_specs() ][:2] == [ 'customers', 'product-categories' ]
+    filename = tmp_path / 'nodepoints.json'
+    filename.write_text(json.dumps([ raw_spec, dict(aggregation_spec, name='sales') ]))
+    assert shopspecs.load_specs(str(filename)) == [ raw_spec, dict(aggregation_spec, name='sales') ]
+    filename.write_text(json.dumps([ dict(raw_spec, type='other') ]))
+    with pytest.raises(ValueError):
+        shopspecs.load_specs(str(filename))
@@ -1,9 +1,21 @@
 """
     Unitary Testing for the shop_raw_df
 """
+import pytest
 import requests
+import threading
+import time
+import argparse
+import datetime
+import itertools
+import logging
+import tracemalloc
+import http.server
 import numpy as np
 import pandas as pd
+import shopjson
+import shopspecs
+import shopstats
 from shopstats import response_is_ok, get_shops, \
         get_nodepoint_entries, generate_dataframe
 
@@ -11,10 +23,24 @@ from shopstats import response_is_ok, get_shops, \
 class MockResponse:
 
 
-    def __init__(self, status_code=200, headers=None, text=''):
+    def __init__(self, status_code=200, headers=None, text='', chunks=None):
         self.status_code = status_code
         self.headers = headers if headers else { 'content-type': 'application/json; charset=utf-8' }
         self.text = text
+        self.chunks = chunks
+
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        """ yields the given chunks, or the text in chunks of chunk_size """
+        if self.chunks is not None:
+            yield from self.chunks
+            return
+        content = self.content
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
 
 
 def build_mock_request(contents):
@@ -34,6 +60,78 @@ def build_mock_request(contents):
     return mock_request
 
 
+def build_mock_url_request(contents, delay=0):
+    """ given a dict url ending -> contents (str or MockResponse)
+        it returns a function that will deliver the contents whose key
+        ends the requested url. It doesn't depend on the order of the
+        requests so it can be used with concurrent requests. """
+
+
+    def mock_request(session, method, url, *args, **kwargs):
+        time.sleep(delay)
+        for ending, content in contents.items():
+            if url.endswith(ending):
+                return content if isinstance(content, MockResponse) else MockResponse(text=content)
+        raise AssertionError('Unexpected url %s' % url)
+    return mock_request
+
+
+class StandInServer:
+    """ local HTTP server for the tests requiring an actual connection
+        handler_function(request) returns the tuple (status_code, body)
+        or (status_code, body, headers) """
+
+
+    def __init__(self, handler_function):
+
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # keep-alive
+
+            def do_GET(self):
+                status_code, body, *headers = handler_function(self)
+                body = body.encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('content-type', 'application/json; charset=utf-8')
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url_base = 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fresh_session(monkeypatch):
+    """ provides a new shared session with clean http stats """
+    monkeypatch.setattr(shopstats, 'http_pool_params', dict(shopstats.http_pool_params))
+    monkeypatch.setattr(shopstats, 'http_stats', { 'requests': 0, 'retries': 0, 'errors': 0 })
+    shopstats.configure_session(backoff_factor=0)
+    yield
+    shopstats.configure_session()
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    """ enables the persistent response cache during the test """
+    shopstats.configure_response_cache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    yield shopstats.response_cache
+    shopstats.configure_response_cache()
+
+
 # Tests
 
 def test_response_is_ok_when_status_code_401():
@@ -54,7 +152,7 @@ def test_response_is_ok_when_everything_is_ok():
 def test_get_shops_when_none(monkeypatch):
     content_list = ['[{ "id": "anychain", "shops": [] }]']
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
     expected = []
     found = get_shops()
     assert expected == found
@@ -63,7 +161,7 @@ def test_get_shops_when_none(monkeypatch):
 def test_get_shops_when_one(monkeypatch):
     content_list = ['[{ "id": "chain_1", "shops": [ {"id": "shop_id_1", "name":"shop_name_1"} ] }]']
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
     expected = [ ('chain_1', 'shop_id_1', 'shop_name_1') ]
     found = get_shops()
     assert expected == found
@@ -78,7 +176,7 @@ def test_get_shops_when_some(monkeypatch):
 
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = [ ('chain_1', 'shop_id_1', 'shop_name_1'),
                  ('chain_1', 'shop_id_2', 'shop_name_2'),
@@ -97,7 +195,7 @@ def test_get_shops_when_two_chains(monkeypatch):
 
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
     expected = [ ('chain_1', 'shop_id_1', 'shop_name_1'),
                  ('chain_1', 'shop_id_2', 'shop_name_2'),
                  ('chain_2', 'shop_id_3', 'shop_name_3') ]
@@ -111,7 +209,7 @@ def test_generate_dataframe_when_response_error(monkeypatch):
     def mock_request(*args, **kwargs):
         return MockResponse(status_code=400)
 
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
     nodepoint_specs = [
             { "name": "products", "type": "raw", "column_suffix": "distinct", "equality_key": "originalId" },
             { "name": "sellers", "type": "raw", "column_suffix": "distinct", "equality_key": "originalId" },
@@ -134,7 +232,7 @@ def test_generate_dataframe_when_no_chain(monkeypatch):
         ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame(columns=[
         'chain_id', 'shop_id', 'shop_name',
@@ -154,7 +252,7 @@ def test_generate_dataframe_when_badformed_response(monkeypatch):
         ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame(columns=[
         'chain_id', 'shop_id', 'shop_name',
@@ -178,7 +276,7 @@ def test_generate_dataframe_when_no_shops(monkeypatch):
 
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame(columns=[
         'chain_id', 'shop_id', 'shop_name',
@@ -202,7 +300,7 @@ def test_generate_dataframe_when_one_shop_one_nodepoint(monkeypatch):
     nodepoint_specs = [ { "name": "sellers", "type": "raw", "column_suffix": "distinct", "equality_key": "originalId" }, ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([['chain_1', 'shop_id_1', 'shop_name_1', 3, 2, 1]],
             columns = ['chain_id', 'shop_id', 'shop_name',
@@ -245,7 +343,7 @@ def test_generate_dataframe_when_many_shop_many_nodepoint(monkeypatch):
 
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_id_1', 'shop_name_1', 3, 2, 0, 3, 2, 1],
@@ -275,7 +373,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_one_entry_no_subkey(monke
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 1, 111, 0],
@@ -302,7 +400,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_many_entries_no_subkey(mo
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 2, 333, 0],
@@ -328,7 +426,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_one_entry_with_subkey(mon
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 1, 111, 0],
@@ -358,7 +456,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_with_many_entries_same_su
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 3, 666, 0],
@@ -398,7 +496,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_with_many_entries_differe
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 9, 666, 0],
@@ -438,7 +536,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_with_malformed_entry_no_s
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 6, 660, 1],
@@ -478,7 +576,7 @@ def test_generate_dataframe_when_aggregation_nodepoint_with_malformed_entry_no_a
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 6, 345, 3],
@@ -528,7 +626,7 @@ def test_generate_dataframe_when_aggregation_mani_nodepoints_same_shop(monkeypat
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 3, 111, 0, 2, 202, 0, 2, 333, 1],
@@ -614,7 +712,7 @@ def test_generate_dataframe_when_aggregation_many_nodepoints_many_shops_and_chai
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 3, 111, 0, 2, 202, 0, 2, 333, 1],
@@ -698,7 +796,7 @@ def test_generate_dataframe_when_raw_and_aggregation_many_nodepoints_many_shops_
             ]
 
     mock_request = build_mock_request(content_list)
-    monkeypatch.setattr(requests, 'request', mock_request)
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
 
     expected = pd.DataFrame([
         ['chain_1', 'shop_1', 'shopname_1', 3, 111, 0,   3, 2, 1, 2, 333, 1],
@@ -724,3 +822,652 @@ def test_generate_dataframe_when_raw_and_aggregation_many_nodepoints_many_shops_
 
 
 
+
+
+concurrent_contents = {
+        '/user/accessible-resources': '''[
+                { "id": "chain_1", "shops": [
+                    {"id": "shop_1", "name": "shopname_1"},
+                    {"id": "shop_2", "name": "shopname_2"} ] },
+                { "id": "chain_2", "shops": [
+                    {"id": "shop_3", "name": "shopname_3"} ] } ]''',
+        '/chains/chain_1/shops/shop_1/test_1': '[ { "sales": [ { "billing": 1 }, { "billing": 10 } ] }, { "other": [] } ]',
+        '/chains/chain_1/shops/shop_1/test_2': '[ { "originalId": "oid1" }, { "originalId": "oid1" }, { "id": "bad" } ]',
+        '/chains/chain_1/shops/shop_2/test_1': '[ { "sales": [ { "billing": 1000 } ] } ]',
+        '/chains/chain_1/shops/shop_2/test_2': MockResponse(status_code=500),
+        '/chains/chain_2/shops/shop_3/test_1': '[ { "sales": [ { "billing": 10000 }, { "nobilling": 1 } ] } ]',
+        '/chains/chain_2/shops/shop_3/test_2': '[ { "originalId": "oid3" } ]',
+        }
+
+concurrent_specs = [
+        { 'name': 'test_1', 'type': 'aggregation', 'aggregation_key': 'billing', 'column_suffix': 'billing', 'subkey': 'sales' },
+        { 'name': 'test_2', 'type': 'raw', 'equality_key': 'originalId', 'column_suffix': 'distinct' },
+        ]
+
+
+raw_spec = { 'name': 'test', 'type': 'raw', 'equality_key': 'originalId', 'column_suffix': 'distinct' }
+aggregation_spec = { 'name': 'test', 'type': 'aggregation', 'aggregation_key': 'billing', 'column_suffix': 'billing', 'subkey': 'sales' }
+aggregation_no_subkey_spec = dict(aggregation_spec, subkey=None)
+
+
+def test_generate_dataframe_when_concurrent_same_as_serial(monkeypatch):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    serial = generate_dataframe(concurrent_specs)
+    concurrent = generate_dataframe(concurrent_specs, workers=4)
+    pd.testing.assert_frame_equal(serial, concurrent)
+
+
+def test_generate_dataframe_when_concurrent_keeps_errors_as_nan(monkeypatch):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    expected = pd.DataFrame([
+        ['chain_1', 'shop_1', 'shopname_1', 2, 11, 1, 2, 1, 1],
+        ['chain_1', 'shop_2', 'shopname_2', 1, 1000, 0, np.nan, np.nan, np.nan],
+        ['chain_2', 'shop_3', 'shopname_3', 1, 10000, 1, 1, 1, 0],
+        ],
+        columns = [ 'chain_id', 'shop_id', 'shop_name',
+            'test_1_count', 'test_1_billing', 'test_1_malformed',
+            'test_2_count', 'test_2_distinct', 'test_2_malformed',
+            ])
+    found = generate_dataframe(concurrent_specs, workers=3)
+    pd.testing.assert_frame_equal(expected, found, check_dtype=False)
+
+
+@pytest.mark.parametrize('streaming', [ False, True ])
+def test_generate_dataframe_logs_a_summary_per_nodepoint(monkeypatch, caplog, streaming):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    with caplog.at_level(logging.INFO):
+        generate_dataframe(concurrent_specs, streaming=streaming)
+    summaries = [ record.getMessage() for record in caplog.records if record.getMessage().startswith('Nodepoint ') ]
+    assert summaries == [
+            'Nodepoint test_1 of chain_1/shop_1: 2 entries, 2 counted, 1 malformed',
+            'Nodepoint test_2 of chain_1/shop_1: 3 entries, 2 counted, 1 malformed',
+            'Nodepoint test_1 of chain_1/shop_2: 1 entries, 1 counted, 0 malformed',
+            'Nodepoint test_1 of chain_2/shop_3: 1 entries, 1 counted, 1 malformed',
+            'Nodepoint test_2 of chain_2/shop_3: 1 entries, 1 counted, 0 malformed',
+            ]
+    # entries are only logged in debug
+    assert not any('nobilling' in record.getMessage() for record in caplog.records)
+
+
+@pytest.mark.parametrize('streaming', [ False, True ])
+def test_generate_dataframe_when_malformed_keeps_samples(monkeypatch, streaming):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    malformed = {}
+    generate_dataframe(concurrent_specs, streaming=streaming, malformed=malformed)
+    found = { key: sample.to_dict() for key, sample in malformed.items() }
+    assert found == {
+            ('chain_1', 'shop_1', 'test_1'): { 'malformed': 1, 'missing_keys': { 'sales': 1 }, 'entries': [ { 'other': [] } ] },
+            ('chain_1', 'shop_1', 'test_2'): { 'malformed': 1, 'missing_keys': { 'originalId': 1 }, 'entries': [ { 'id': 'bad' } ] },
+            ('chain_2', 'shop_3', 'test_1'): { 'malformed': 1, 'missing_keys': { 'billing': 1 }, 'entries': [ { 'nobilling': 1 } ] },
+            }
+
+
+def test_sort_columns_when_extra_aggregations():
+    columns = [ 'chain_id', 'shop_id', 'shop_name', 'customers_count', 'customers_distinct', 'customers_malformed',
+                'sales_count', 'sales_billing', 'sales_malformed', 'sales_billing_zeros', 'sales_billing_p90',
+                'sales_billing_max', 'sales_billing_p50', 'sales_billing_mean', 'sales_billing_min' ]
+    found = shopstats.sort_columns(pd.DataFrame([ [ 0 ] * len(columns) ], columns=columns))
+    assert list(found.columns) == [ 'chain_id', 'shop_id', 'shop_name', 'sales_billing',
+                                    'sales_billing_mean', 'sales_billing_min', 'sales_billing_p50', 'sales_billing_p90',
+                                    'sales_billing_max', 'sales_billing_zeros',
+                                    'customers_count', 'customers_distinct', 'sales_count',
+                                    'customers_malformed', 'sales_malformed' ]
+
+
+@pytest.mark.parametrize('streaming', [ False, True ])
+def test_generate_dataframe_when_extra_aggregations(monkeypatch, streaming):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    specs = [ dict(concurrent_specs[0], aggregations=[ 'min', 'max' ]), concurrent_specs[1] ]
+    found = generate_dataframe(specs, streaming=streaming)
+    assert list(found.columns[3:8]) == [ 'test_1_count', 'test_1_billing', 'test_1_malformed', 'test_1_billing_min', 'test_1_billing_max' ]
+    assert found[[ 'test_1_billing_min', 'test_1_billing_max' ]].values.tolist() == [ [ 1, 10 ], [ 1000, 1000 ], [ 10000, 10000 ] ]
+    assert np.isnan(found.loc[1, 'test_2_count'])
+
+
+def test_generate_dataframe_when_concurrent_requests_overlap(monkeypatch):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    mock_request = build_mock_url_request(concurrent_contents, delay=0.05)
+
+
+    def counting_request(*args, **kwargs):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        try:
+            return mock_request(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight -= 1
+
+    monkeypatch.setattr(requests.Session, 'request', counting_request)
+    generate_dataframe(concurrent_specs, workers=3)
+    assert 1 < max_in_flight <= 3
+
+
+@pytest.mark.parametrize('streaming, workers', [ (False, 1), (False, 3), (True, 1), (True, 3) ])
+def test_generate_dataframe_when_specs_share_endpoint_requests_it_once(monkeypatch, streaming, workers):
+    shared_specs = concurrent_specs + [
+            { 'name': 'test_1_max', 'endpoint': 'test_1', 'type': 'aggregation', 'aggregation_key': 'billing',
+              'column_suffix': 'billing', 'subkey': 'sales', 'aggregations': [ 'max' ] },
+            { 'name': 'test_1_zeros', 'endpoint': 'test_1', 'type': 'aggregation', 'aggregation_key': 'billing',
+              'column_suffix': 'billing', 'subkey': 'sales', 'aggregations': [ 'zeros' ] },
+            ]
+    separate_specs = [ { key: value for key, value in spec.items() if key != 'endpoint' } for spec in shared_specs ]
+    separate_contents = dict(concurrent_contents)
+    for shop in ('chain_1/shops/shop_1', 'chain_1/shops/shop_2', 'chain_2/shops/shop_3'):
+        for name in ('test_1_max', 'test_1_zeros'):
+            separate_contents['/chains/%s/%s' % (shop, name)] = concurrent_contents['/chains/%s/test_1' % shop]
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(separate_contents))
+    expected = generate_dataframe(separate_specs)
+    requested = []
+    mock_request = build_mock_url_request(concurrent_contents)
+
+
+    def counting_mock_request(session, method, url, *args, **kwargs):
+        requested.append(url)
+        return mock_request(session, method, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'request', counting_mock_request)
+    monkeypatch.setattr(shopstats, 'fetch_stats', { 'nodepoints': 0, 'requests': 0, 'deduplicated': 0 })
+    found = generate_dataframe(shared_specs, workers=workers, streaming=streaming)
+    pd.testing.assert_frame_equal(expected, found)
+    # the shops and one request for each endpoint of each shop
+    assert len(requested) == 1 + 3 * 2
+    assert len(set(requested)) == len(requested)
+    assert shopstats.fetch_stats == { 'nodepoints': 12, 'requests': 6, 'deduplicated': 6 }
+
+
+def test_plan_fetches_when_params_differ():
+    specs = [ dict(concurrent_specs[0], params={ 'detail': 'full' }),
+              dict(concurrent_specs[0], name='test_1_copy'),
+              dict(concurrent_specs[0], name='test_1_full', endpoint='test_1', params={ 'detail': 'full' }) ]
+    units = [ (period, 'chain_1', 'shop_1', spec) for period in (None, datetime.date(2019, 6, 1))
+              for spec in shopspecs.compile_specs(specs) ]
+    fetches, stats = shopstats.plan_fetches(units)
+    assert fetches == [ [ 0, 2 ], [ 1 ], [ 3, 5 ], [ 4 ] ]
+    assert stats == { 'nodepoints': 6, 'requests': 4, 'deduplicated': 2 }
+
+
+def test_get_nodepoint_entries_when_transient_errors_are_retried(monkeypatch, fresh_session):
+    calls = 0
+
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        return (503, '{}') if calls <= 2 else (200, '[ { "originalId": "oid1" } ]')
+
+    with StandInServer(handler) as server:
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': server.url_base, 'headers': {} })
+        found = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+    assert found == ('ok', [ { 'originalId': 'oid1' } ])
+    assert shopstats.get_http_stats()['retries'] == 2
+
+
+def test_get_nodepoint_entries_when_errors_exceed_retries(monkeypatch, fresh_session):
+    shopstats.configure_session(retries=1)
+    with StandInServer(lambda request: (500, '{}')) as server:
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': server.url_base, 'headers': {} })
+        found = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+    assert found == ('error', [])
+    assert shopstats.get_http_stats()['retries'] == 1
+
+
+def test_get_nodepoint_entries_when_connection_refused(monkeypatch, fresh_session):
+    shopstats.configure_session(retries=0)
+    with StandInServer(lambda request: (200, '[]')) as server:
+        url_base = server.url_base
+    monkeypatch.setattr(shopstats, 'api_params', { 'url_base': url_base, 'headers': {} })
+    assert get_nodepoint_entries('chain_1', 'shop_1', 'sellers') == ('error', [])
+    assert shopstats.get_http_stats()['errors'] == 1
+
+
+def test_session_reuses_connections(monkeypatch, fresh_session):
+    with StandInServer(lambda request: (200, '[]')) as server:
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': server.url_base, 'headers': {} })
+        for _ in range(5):
+            get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+    stats = shopstats.get_http_stats()
+    assert stats['requests'] == 5
+    assert stats['connections'] == 1
+    assert stats['reused_connections'] == 4
+
+
+def test_generate_dataframe_when_throttled_converges_without_errors(monkeypatch, fresh_session):
+    shopstats.configure_session(pool_size=8, retries=5)
+    shops = ', '.join('{"id": "shop_%s", "name": "shopname_%s"}' % (i, i) for i in range(60))
+    limit = 3
+    active = 0
+    statuses = []
+    lock = threading.Lock()
+
+
+    def handler(request):
+        nonlocal active
+        if request.path.endswith('/user/accessible-resources'):
+            return (200, '[ { "id": "chain_1", "shops": [ %s ] } ]' % shops)
+        with lock:
+            active += 1
+            throttled = active > limit
+            statuses.append(429 if throttled else 200)
+        try:
+            if throttled:
+                return (429, '{}', { 'Retry-After': '0' })
+            time.sleep(0.01)
+            return (200, '[ { "originalId": "oid1" } ]')
+        finally:
+            with lock:
+                active -= 1
+
+    with StandInServer(handler) as server:
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': server.url_base, 'headers': {} })
+        found = generate_dataframe([ raw_spec ], workers=8)
+    assert found['test_count'].tolist() == [ 1 ] * 60
+    stats = shopstats.get_http_stats()
+    assert stats['errors'] == 0 and stats['in_flight'] == 0 and stats['queued'] == 0
+    assert stats['throttled'] == statuses.count(429) > 0
+    # once the window converges to the limit of the server, few requests are throttled
+    assert statuses[len(statuses) // 2:].count(429) <= len(statuses) // 8
+
+
+def test_generate_dataframe_when_same_shop_id_in_different_chains(monkeypatch):
+    contents = {
+            '/user/accessible-resources': '''[
+                { "id": "chain_1", "shops": [ {"id": "shop_1", "name": "shopname_1"} ] },
+                { "id": "chain_2", "shops": [ {"id": "shop_1", "name": "shopname_2"} ] } ]''',
+            '/chains/chain_1/shops/shop_1/test_2': '[ { "originalId": "oid1" } ]',
+            '/chains/chain_2/shops/shop_1/test_2': '[ { "originalId": "oid1" }, { "originalId": "oid2" }, { "id": "bad" } ]',
+            }
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(contents))
+    expected = pd.DataFrame([
+        ['chain_1', 'shop_1', 'shopname_1', 1, 1, 0],
+        ['chain_2', 'shop_1', 'shopname_2', 2, 2, 1],
+        ],
+        columns = [ 'chain_id', 'shop_id', 'shop_name',
+            'test_2_count', 'test_2_distinct', 'test_2_malformed' ])
+    found = generate_dataframe(concurrent_specs[1:])
+    pd.testing.assert_frame_equal(expected, found, check_dtype=False)
+
+
+def test_get_nodepoint_entries_when_closed_period_is_cached(monkeypatch, fresh_session, response_cache):
+    calls = 0
+
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        return (200, '[ { "originalId": "oid%s" } ]' % calls)
+
+    monkeypatch.setattr(shopstats, 'querystring', { 'dateStart': datetime.date(2019, 6, 1), 'dateEnd': datetime.date(2019, 7, 1), 'dateRange': '3' })
+    with StandInServer(handler) as server:
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': server.url_base, 'headers': {} })
+        first = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+        response_cache.clock = lambda: 10 ** 12     # far future: only open periods expire
+        second = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+        other_shop = get_nodepoint_entries('chain_1', 'shop_2', 'sellers')
+    assert first == second == ('ok', [ { 'originalId': 'oid1' } ])
+    assert other_shop == ('ok', [ { 'originalId': 'oid2' } ])
+    assert calls == 2
+    assert response_cache.get_stats()['hits'] == 1
+
+
+def test_get_nodepoint_entries_when_current_period_is_revalidated(monkeypatch, fresh_session, response_cache):
+    requested_etags = []
+
+
+    def handler(request):
+        requested_etags.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return (304, '')
+        return (200, '[ { "originalId": "oid1" } ]', { 'ETag': '"v1"' })
+
+    with StandInServer(handler) as server:
+        monkeypatch.setattr(shopstats, 'api_params', { 'url_base': server.url_base, 'headers': {} })
+        first = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+        fresh = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+        now = time.time()
+        response_cache.clock = lambda: now + 120    # after the ttl
+        revalidated = get_nodepoint_entries('chain_1', 'shop_1', 'sellers')
+    assert first == fresh == revalidated == ('ok', [ { 'originalId': 'oid1' } ])
+    assert requested_etags == [ None, '"v1"' ]
+    stats = response_cache.get_stats()
+    assert (stats['hits'], stats['stale'], stats['revalidated']) == (1, 1, 1)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_generate_dataframe_when_streaming_same_as_not_streaming(monkeypatch, workers):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    monkeypatch.setattr(shopstats, 'stream_chunk_size', 7)
+    expected = generate_dataframe(concurrent_specs)
+    found = generate_dataframe(concurrent_specs, workers=workers, streaming=True)
+    pd.testing.assert_frame_equal(expected, found)
+
+
+def test_generate_dataframe_when_streaming_max_in_flight_bounds_bodies(monkeypatch):
+    lock = threading.Lock()
+    receiving = 0
+    max_receiving = 0
+    mock_request = build_mock_url_request(concurrent_contents)
+
+
+    def slow_body(text):
+        nonlocal receiving, max_receiving
+        with lock:
+            receiving += 1
+            max_receiving = max(max_receiving, receiving)
+        try:
+            for character in text:
+                time.sleep(0.001)
+                yield character.encode('utf-8')
+        finally:
+            with lock:
+                receiving -= 1
+
+
+    def streaming_request(*args, **kwargs):
+        response = mock_request(*args, **kwargs)
+        return MockResponse(response.status_code, text=response.text, chunks=slow_body(response.text))
+
+    monkeypatch.setattr(requests.Session, 'request', streaming_request)
+    monkeypatch.setattr(shopstats, 'scheduler_params', dict(shopstats.scheduler_params, max_in_flight=1))
+    monkeypatch.setattr(shopstats, 'scheduler', None)
+    expected = generate_dataframe(concurrent_specs)
+    found = generate_dataframe(concurrent_specs, workers=3, streaming=True)
+    pd.testing.assert_frame_equal(expected, found)
+    assert max_receiving == 1
+    assert shopstats.get_http_stats()['in_flight'] == 0
+
+
+@pytest.mark.parametrize('decoder', shopjson.available_decoders())
+def test_generate_dataframe_when_json_decoder_same_as_stdlib(monkeypatch, decoder):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    # restored after the test, as configure_json_decoder() changes them
+    monkeypatch.setattr(shopstats, 'json_decoder', shopstats.json_decoder)
+    monkeypatch.setattr(shopstats, 'json_decode_function', None)
+    shopstats.configure_json_decoder('json')
+    expected = generate_dataframe(concurrent_specs)
+    shopstats.configure_json_decoder(decoder)
+    found = generate_dataframe(concurrent_specs)
+    pd.testing.assert_frame_equal(expected, found)
+    assert shopstats.get_decode_throughput()['test_1'] > 0
+
+
+def test_get_nodepoint_counters_when_streaming_invalid_json(monkeypatch):
+    monkeypatch.setattr(requests.Session, 'request', lambda *args, **kwargs: MockResponse(text='[ { "billing": 1 }, '))
+    found = shopstats.get_nodepoint_counters('chain_1', 'shop_1', concurrent_specs[0], streaming=True)
+    assert np.isnan(found).all()
+
+
+def test_get_nodepoint_counters_when_streaming_memory_is_independent_of_payload_size(monkeypatch):
+
+
+    def sales_chunks(nentries, entries_per_chunk=1000):
+        """ yields the payload of nentries sales without keeping it in memory """
+        yield b'['
+        for start in range(0, nentries, entries_per_chunk):
+            yield ','.join('{ "id": "%s", "sales": [ { "billing": 1 }, { "billing": 2 } ] }' % i
+                           for i in range(start, start + entries_per_chunk)).encode('utf-8')
+            if start + entries_per_chunk < nentries:
+                yield b','
+        yield b']'
+
+
+    def peak_memory(nentries):
+        monkeypatch.setattr(requests.Session, 'request',
+                lambda *args, **kwargs: MockResponse(chunks=sales_chunks(nentries)))
+        tracemalloc.start()
+        try:
+            counters = shopstats.get_nodepoint_counters('chain_1', 'shop_1', concurrent_specs[0], streaming=True)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert counters == (2 * nentries, 3 * nentries, 0)
+        return peak
+
+    small = peak_memory(10000)
+    large = peak_memory(100000)     # ~6MB of payload
+    assert large < 1.5 * small
+    assert large < 1024 ** 2
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_generate_dataframe_when_sketches(monkeypatch, streaming):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    sketches = {}
+    generate_dataframe(concurrent_specs, workers=2, streaming=streaming, sketches=sketches)
+    # shop_2 test_2 is an error and test_1 is not a raw nodepoint
+    assert set(sketches) == { ('chain_1', 'shop_1', 'test_2'), ('chain_2', 'shop_3', 'test_2') }
+    assert sketches[('chain_1', 'shop_1', 'test_2')].count() == 1
+
+
+def test_generate_dataframe_when_resuming_journal(monkeypatch, tmp_path):
+    import shopjournal
+    filename = str(tmp_path / 'journal.jsonl')
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    journal = shopjournal.Journal(filename)
+    expected = generate_dataframe(concurrent_specs, workers=2, sketches={}, journal=journal)
+    journal.close()
+    with open(filename) as f:
+        lines = f.readlines()
+    assert len(lines) == 5       # the failed nodepoint is not journaled
+    # the process died while writing the fourth unit
+    with open(filename, 'w') as f:
+        f.writelines(lines[:3] + [ lines[3][:10] ])
+    requested = []
+    mock_request = build_mock_url_request(concurrent_contents)
+
+
+    def counting_mock_request(session, method, url, *args, **kwargs):
+        requested.append(url)
+        return mock_request(session, method, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'request', counting_mock_request)
+    journal = shopjournal.Journal(filename, resume=True)
+    sketches = {}
+    found = generate_dataframe(concurrent_specs, workers=2, sketches=sketches, journal=journal)
+    journal.close()
+    pd.testing.assert_frame_equal(expected, found)
+    assert set(sketches) == { ('chain_1', 'shop_1', 'test_2'), ('chain_2', 'shop_3', 'test_2') }
+    # the shops, the 2 units not in the journal and the failed one
+    assert len(requested) == 4
+    assert len(shopjournal.Journal(filename, resume=True)) == 5
+
+
+def test_generate_dataframe_when_resuming_journal_of_changed_spec(monkeypatch, tmp_path):
+    import shopjournal
+    filename = str(tmp_path / 'journal.jsonl')
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    journal = shopjournal.Journal(filename)
+    generate_dataframe(concurrent_specs, journal=journal)
+    journal.close()
+    specs = [ dict(concurrent_specs[0], aggregations=[ 'max' ]), concurrent_specs[1] ]
+    journal = shopjournal.Journal(filename, resume=True)
+    found = generate_dataframe(specs, journal=journal)
+    journal.close()
+    assert found['test_1_billing_max'].tolist() == [ 10, 1000, 10000 ]
+
+
+def test_select_shard_partitions_shops():
+    shops = [ ('chain_%s' % (i % 4), 'shop_%s' % i, 'shopname_%s' % i) for i in range(200) ]
+    shards = [ shopstats.select_shard(shops, (shard, 4)) for shard in range(1, 5) ]
+    positions = sorted(itertools.chain.from_iterable(positions for positions, _ in shards))
+    assert positions == list(range(200))
+    assert all(30 < len(shard_shops) < 70 for _, shard_shops in shards)
+    # stable across runs and shop lists
+    assert shopstats.select_shard(shops[::-1], (2, 4))[1] == shards[1][1][::-1]
+    assert shopstats.get_shop_shard('chain_1', 'shop_1', 4) == 2
+
+
+@pytest.mark.parametrize('text', [ '0/4', '5/4', '2', 'a/b' ])
+def test_parse_shard_when_invalid(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        shopstats.parse_shard(text)
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_generate_dataframe_records_metrics(monkeypatch, streaming):
+    monkeypatch.setattr(requests.Session, 'request', build_mock_url_request(concurrent_contents))
+    shopstats.metrics.reset()
+    generate_dataframe(concurrent_specs, workers=2, streaming=streaming)
+    metrics = shopstats.metrics
+    assert metrics.get('stage_seconds', stage='get_shops').count == 1
+    assert metrics.get('request_seconds', nodepoint='test_1').count == 3
+    assert metrics.get('response_bytes', nodepoint='test_2').count == 2      # shop_2 test_2 is an error
+    assert metrics.get('compute_seconds', nodepoint='test_1').count == 3
+    assert metrics.get('entries', nodepoint='test_2') == 4
+    assert metrics.get('errors', nodepoint='test_2') == 1
+    assert metrics.get('shop_seconds', chain_id='chain_1', shop_id='shop_2') > 0
+    if not streaming:
+        assert metrics.get('decode_seconds', nodepoint='test_1').count == 3
+
+
+def test_compose_querystring_when_december():
+    found = shopstats.compose_querystring(datetime.date(2019, 12, 15))
+    assert found == { 'dateStart': datetime.date(2019, 12, 1), 'dateEnd': datetime.date(2020, 1, 1), 'dateRange': '3' }
+
+
+def test_iter_periods_across_years():
+    found = list(shopstats.iter_periods(datetime.date(2019, 11, 1), datetime.date(2020, 1, 1)))
+    assert found == [ datetime.date(2019, 11, 1), datetime.date(2019, 12, 1), datetime.date(2020, 1, 1) ]
+    assert list(shopstats.iter_periods(datetime.date(2020, 1, 1), datetime.date(2019, 11, 1))) == []
+
+
+def test_parse_arguments_when_backfill_first_after_last():
+    assert shopstats.parse_arguments([ '--backfill', '2019-01', '2019-06' ]).backfill == \
+            [ datetime.date(2019, 1, 1), datetime.date(2019, 6, 1) ]
+    with pytest.raises(SystemExit):
+        shopstats.parse_arguments([ '--backfill', '2019-06', '2019-01', '--combined' ])
+
+
+def test_generate_dataframes_when_many_periods(monkeypatch):
+    requested = []
+
+
+    def mock_request(session, method, url, params=None, **kwargs):
+        requested.append(url)
+        if url.endswith('/user/accessible-resources'):
+            return MockResponse(text='[ { "id": "chain_1", "shops": [ {"id": "shop_1", "name": "shopname_1"} ] } ]')
+        # as many entries as the month of the period
+        return MockResponse(text='[%s]' % ', '.join([ '{ "billing": 1 }' ] * params['dateStart'].month))
+
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
+    periods = list(shopstats.iter_periods(datetime.date(2019, 11, 1), datetime.date(2020, 2, 1)))
+    found = shopstats.generate_dataframes([ aggregation_no_subkey_spec ], periods, workers=3)
+    assert list(found) == periods
+    assert [ df['test_count'].tolist() for df in found.values() ] == [ [11], [12], [1], [2] ]
+    assert requested.count(requested[0]) == 1    # shops are requested once
+    combined = shopstats.combine_periods(found)
+    assert combined['period'].tolist() == [ '201911', '201912', '202001', '202002' ]
+    assert list(combined.columns[:3]) == [ 'period', 'chain_id', 'shop_id' ]
+
+
+def test_generate_dataframe_when_period(monkeypatch):
+    requested_params = []
+
+
+    def mock_request(session, method, url, params=None, **kwargs):
+        requested_params.append(params)
+        if url.endswith('/user/accessible-resources'):
+            return MockResponse(text='[ { "id": "chain_1", "shops": [ {"id": "shop_1", "name": "shopname_1"} ] } ]')
+        return MockResponse(text='[]')
+
+    monkeypatch.setattr(requests.Session, 'request', mock_request)
+    generate_dataframe([ aggregation_no_subkey_spec ], period=datetime.date(2019, 12, 1))
+    assert requested_params[-1] == shopstats.compose_querystring(datetime.date(2019, 12, 1))
+
+
+def sample_shopstats(nshops=3):
+    """ returns a DataFrame of stats of nshops for the default nodepoint_specs """
+    columns = [ 'chain_id', 'shop_id', 'shop_name' ]
+    for nodepoint_spec in shopstats.get_nodepoint_specs():
+        columns += shopstats.compose_nodepoint_column(nodepoint_spec)
+    rows = [ [ 'chain_1', 'shop_%s' % i, 'shopname_%s' % i ] + [ 10 + i ] * (len(columns) - 3)
+             for i in range(nshops) ]
+    return shopstats.sort_columns(pd.DataFrame(rows, columns=columns))
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_render_charts(tmp_path, processes):
+    df = sample_shopstats()
+    jobs = [ (chart, df, str(tmp_path / ('%s.png' % chart)), 'June 2019') for chart in shopstats.chart_functions ]
+    found = shopstats.render_charts(jobs, processes=processes)
+    for _, _, filename, _ in jobs:
+        assert (tmp_path / filename).stat().st_size > 0
+    assert set(found['chart_seconds']) == { filename for _, _, filename, _ in jobs }
+    assert found['wall_seconds'] > 0 and found['peak_rss_mb'] > 0
+    assert 0 <= found['chart_rss_growth_mb'] <= found['peak_rss_mb']
+
+
+def test_save_charts_close_their_figures(tmp_path):
+    import matplotlib.pyplot as plt
+    df = sample_shopstats()
+    for chart, chart_function in shopstats.chart_functions.items():
+        chart_function(df, str(tmp_path / ('%s.png' % chart)), 'June 2019')
+    assert plt.get_fignums() == []
+
+
+def test_compose_chart_jobs_when_more_shops_than_tile_rows():
+    df = sample_shopstats(5)
+    df.loc[3, 'products/sales_billing'] = 1
+    jobs, tiled = shopstats.compose_chart_jobs('billing_chart', df, 'billing_201906.png', 'June 2019', tile_rows=2)
+    assert [ job[2] for job in jobs ] == [ 'billing_201906_summary.png', 'billing_201906_tile001.png',
+                                          'billing_201906_tile002.png', 'billing_201906_tile003.png' ]
+    assert jobs[0][1] is df and jobs[0][4] == { 'flagged_only': True }
+    assert [ len(job[1]) for job in jobs[1:] ] == [ 2, 2, 1 ]
+    assert jobs[2][3] == 'June 2019 - shops 3 to 4 of 5'
+    assert tiled['flagged'] == 1 and [ tile['flagged'] for tile in tiled['tiles'] ] == [ 0, 1, 0 ]
+    assert shopstats.compose_chart_jobs('billing_chart', df, 'billing_201906.png', 'June 2019', tile_rows=5) == \
+           ([ ('billing_chart', df, 'billing_201906.png', 'June 2019') ], None)
+
+
+def test_save_period_outputs_when_tiled_charts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    df = sample_shopstats(3)
+    jobs = shopstats.save_period_outputs(df, datetime.date(2019, 6, 1), tile_rows=2)
+    rendering = shopstats.render_charts(jobs, processes=1)
+    assert len(rendering['chart_seconds']) == 3 * len(shopstats.chart_functions)
+    for filename in rendering['chart_seconds']:
+        assert (tmp_path / filename).stat().st_size > 0
+    index = (tmp_path / 'charts_201906.html').read_text()
+    assert '<img src="distinct_201906_summary.png"' in index
+    assert '<a href="malformed_201906_tile002.png">shops 3 to 3</a> (<strong>1 flagged</strong>)' in index
+    assert 'dup_chart: 0 flagged shops of 3' in index
+
+
+def test_select_flagged_keeps_the_most_flagged_shops():
+    df = sample_shopstats(6)
+    df.loc[[ 1, 4 ], 'products/sales_billing'] = 1
+    df.loc[4, 'customers/sales_billing'] = 100
+    base, values = shopstats.prepare_sales_data(df)
+    base, values, flagged = shopstats.select_flagged(base, values, max_rows=1)
+    assert flagged == 2
+    assert list(base.index) == [ 'chain_1/shop_4' ]
+    assert base.values.tolist() == [ [ 0, 1, 0, 1, 0 ] ]
+    assert values.values.tolist() == [ [ 14, 1, 14, 100, 14 ] ]
+
+
+def test_prepare_sales_data_when_some_sales_nodepoints():
+    df = pd.DataFrame([ [ 'chain_1', 'shop_1', 10.0, 12.0, 11.0 ], [ 'chain_1', 'shop_2', 10.0, 10.0, 5.0 ] ],
+                      columns=[ 'chain_id', 'shop_id', 'tickets_billing', 'products/sales_billing', 'sales_billing' ])
+    base, values = shopstats.prepare_sales_data(df)
+    assert list(values.columns) == [ 'sales', 'products/sales', 'tickets' ]
+    assert base.values.tolist() == [ [ 0, 1, 0 ], [ 0, 1, 0 ] ]
+    base, _ = shopstats.prepare_sales_data(df.drop(columns=[ 'sales_billing' ]))
+    assert base.values.tolist() == [ [ 0, 0 ], [ 0, 0 ] ]
+
+
+def test_import_is_data_only():
+    import shopbench
+    data_only = shopbench.bench_import_time('import shopstats', repeat=3)
+    with_plotting = shopbench.bench_import_time('import shopstats, matplotlib.pyplot, seaborn', repeat=3)
+    assert data_only['plotting_modules'] == []
+    assert data_only['querystring'] is None     # no dates evaluated at import time
+    assert data_only['nodepoint_specs'] is None     # no files read at import time
+    assert with_plotting['plotting_modules'] == list(shopbench.plotting_modules)
+    # the plotting modules about double the import time. The margin keeps
+    # the best of the repetitions stable on a loaded machine
+    assert data_only['seconds'] < 1.5 * with_plotting['seconds']
+    assert data_only['seconds'] < 10
@@ -0,0 +1,76 @@
+"""
+    Unitary Testing for the shopstore
+"""
+import datetime
+import numpy as np
+import pandas as pd
+import shopstore
+
+
+def sample_stats(value, nshops=2):
+    return pd.DataFrame([ [ 'chain_1', 'shop_%s' % i, 'shopname_%s' % i, value + i, value * 2, np.nan ]
+                          for i in range(nshops) ],
+                        columns=[ 'chain_id', 'shop_id', 'shop_name',
+                                  'products_count', 'products_malformed', 'products/sales_count' ])
+
+
+def test_append_is_idempotent(tmp_path):
+    store = shopstore.StatsStore(str(tmp_path / 'store.db'))
+    assert store.append(datetime.date(2019, 6, 1), sample_stats(10)) == 6
+    store.append(datetime.date(2019, 6, 1), sample_stats(10))
+    (rows,) = store.connection.execute('SELECT COUNT(*) FROM stats').fetchone()
+    assert rows == 6
+    assert store.periods() == [ '201906' ]
+
+
+def test_append_again_replaces_the_period(tmp_path):
+    store = shopstore.StatsStore(str(tmp_path / 'store.db'))
+    store.append(datetime.date(2019, 6, 1), sample_stats(10, nshops=3))
+    store.append(datetime.date(2019, 7, 1), sample_stats(10, nshops=3))
+    store.append(datetime.date(2019, 6, 1), sample_stats(20, nshops=2).drop(columns=[ 'products_malformed' ]))
+    rows = store.connection.execute('SELECT period, COUNT(*) FROM stats GROUP BY period ORDER BY period').fetchall()
+    assert rows == [ ('201906', 4), ('201907', 9) ]
+
+
+def test_append_shard_replaces_its_shops(tmp_path):
+    store = shopstore.StatsStore(str(tmp_path / 'store.db'))
+    shops = sample_stats(10, nshops=4)
+    store.append(datetime.date(2019, 6, 1), shops.iloc[:2], shard=True)
+    store.append(datetime.date(2019, 6, 1), shops.iloc[2:], shard=True)
+    store.append(datetime.date(2019, 6, 1), shops.iloc[2:].drop(columns=[ 'products_malformed' ]), shard=True)
+    rows = store.connection.execute('SELECT shop_id, COUNT(*) FROM stats GROUP BY shop_id ORDER BY shop_id').fetchall()
+    assert rows == [ ('shop_0', 3), ('shop_1', 3), ('shop_2', 2), ('shop_3', 2) ]
+
+
+def test_shop_series(tmp_path):
+    filename = str(tmp_path / 'store.db')
+    store = shopstore.StatsStore(filename)
+    for month, value in ((7, 30), (5, 10), (6, 20)):
+        store.append(datetime.date(2019, month, 1), sample_stats(value))
+    store.append('201906', sample_stats(25))     # replaces the values of the period
+    store.close()
+    series = shopstore.StatsStore(filename).shop_series('chain_1', 'shop_1', [ 'products_malformed', 'products_count' ])
+    assert list(series.index) == [ '201905', '201906', '201907' ]
+    assert list(series.columns) == [ 'products_malformed', 'products_count' ]
+    assert list(series['products_malformed']) == [ 20, 50, 60 ]
+    assert list(series['products_count']) == [ 11, 26, 31 ]
+
+
+def test_shop_series_restricted_to_periods(tmp_path):
+    store = shopstore.StatsStore(str(tmp_path / 'store.db'))
+    for month in range(1, 13):
+        store.append(datetime.date(2019, month, 1), sample_stats(month))
+    series = store.shop_series('chain_1', 'shop_0', first_period=datetime.date(2019, 3, 1), last_period='201905')
+    assert list(series.index) == [ '201903', '201904', '201905' ]
+    assert set(series.columns) == { 'products_count', 'products_malformed', 'products/sales_count' }
+    assert series['products/sales_count'].isna().all()
+
+
+def test_nodepoint_series_excludes_other_nodepoints(tmp_path):
+    store = shopstore.StatsStore(str(tmp_path / 'store.db'))
+    store.append('201905', sample_stats(10))
+    store.append('201906', sample_stats(20))
+    series = store.nodepoint_series('products', shop_id='shop_0')
+    assert set(series['column']) == { 'products_count', 'products_malformed' }
+    assert list(series['period']) == [ '201905', '201906' ] * 2
+    assert list(series['value']) == [ 10, 20, 20, 40 ]